@@ -5,7 +5,16 @@
 '''
 
 # Import libraries
+import argparse
+import csv
+import itertools
+import json
 import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
 
 # Define functions
 
@@ -13,37 +22,53 @@ def print_messages(message):
     '''main print engine - prints supplied message'''
     print(message)
 
+def check_integer (user_entry):
+    '''check_integer - the checks of validate_integers without printing
+       returns (integer, None) - otherwise (None, message)'''
+    try:
+        user_entry = int(user_entry)
+    except (TypeError, ValueError):
+        return None, "Invalid input - please enter a number >0"
+    if user_entry > 0:
+        return user_entry, None
+    return None, "Value must be greater than 0"
+
+def check_float (user_entry):
+    '''check_float - the checks of validate_floats without printing
+       returns (float, None) - otherwise (None, message)'''
+    try:
+        user_entry = float(user_entry)
+    except (TypeError, ValueError):
+        return None, "Invalid input - please enter a number >0"
+    if not math.isfinite(user_entry):
+        return None, "Invalid input - please enter a number >0"
+    if user_entry > 0:
+        return user_entry, None
+    return None, "Value must be greater than 0.0"
+
 def validate_integers (user_entry):
     '''validate_integers - standard function to recieve input,
        try to convert to integer and that its greater than 0
        returns integer - otherwise returns none'''
-    try:
-        user_entry = int(user_entry)
-        if user_entry > 0:
-            return user_entry
-        else:
-            print ("Value must be greater than 0")
-            return None
-    except ValueError:
-        print_messages ("Invalid input - please enter a number >0")
+    user_entry, message = check_integer(user_entry)
+    if message:
+        print_messages (message)
+    return user_entry
 
 def validate_floats (user_entry):
     '''validate_floats - standard function to recieve input, 
        try to convert to float and entry is greater than 0
        returns float - otherwise returns none'''
-    try:
-        user_entry = float(user_entry)
-        if user_entry > 0:
-            return user_entry
-        else:
-            print ("Value must be greater than 0.0")
-            return None
-    except ValueError:
-        print_messages ("Invalid input - please enter a number >0")
+    user_entry, message = check_float(user_entry)
+    if message:
+        print_messages (message)
+    return user_entry
 
 def bond_calculation (p,im,n):
     '''bond_calculation - p = pv of house; im = monthly interest rate and n = no of months
-       returns monthly repayment'''
+       returns monthly repayment (p/n if there is no interest)'''
+    if im == 0:
+        return round(p/n,2)
     repayment = round((im*p)/(1-(1+im)**(-n)),2)
     return repayment
 
@@ -59,165 +84,761 @@ def investment_calculation (p,r,t):
     tot_int_comp_c = tot_amt_comp_c-p
     return tot_amt_simp_c, tot_int_simp_c, tot_amt_comp_c, tot_int_comp_c
 
-# main code loop follows
+# Vectorised versions - the same calculations on whole arrays / grids
 
-print ("\nWelcome to the finance calculators.\n")
+def round_half_even (values, decimals=0):
+    '''round_half_even - rounds an array exactly like the built in round
+       np.round scales by 10**decimals first, which can tip values that are
+       very close to a half the other way - those few are redone with round
+       returns float array'''
+    values = np.asarray(values, dtype=float)
+    rounded = np.round(values, decimals)
+    if decimals == 0:
+        # no scaling so np.round is already exact
+        return rounded
+    scaled = values*10.0**decimals
+    # allow for the error of scaling large values
+    tolerance = 1e-6 + 8*np.spacing(np.abs(scaled))
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < tolerance
+    near_half &= np.isfinite(values)
+    if near_half.any():
+        rounded[near_half] = [round(value, decimals)
+                              for value in values[near_half].tolist()]
+    return rounded
 
-while True:
-    # lets get user selection, relevant inputs and process:
+def scenario_grid (principals, rates, terms):
+    '''scenario_grid - every combination of principal x rate x term
+       returns 3 arrays that broadcast to shape
+       (len(principals), len(rates), len(terms)) without copying, eg
+       bond_calculation_grid(*scenario_grid(loans, rates, months))'''
+    return np.ix_(np.atleast_1d(principals), np.atleast_1d(rates),
+                  np.atleast_1d(terms))
 
-    init_choice = input("You can choose from:\n" + "\"Investment\""
-                        + " - to calculate the total amount you may earn on your investment\n"
-                        + "\"Bond\" - to calculate how much it will "
-                        + "cost to pay off your mortgage or\n"
-                        + "\"Quit\" - to terminate program\n\n"
-                        + "Please enter your selection...\n")
+def bond_calculation_grid (p, im, n):
+    '''bond_calculation_grid - array version of bond_calculation
+       p, im and n can be numbers or arrays that broadcast together (see
+       scenario_grid) - zero interest rates repay p/n
+       returns array of monthly repayments rounded to 2dps'''
+    p, im, n = np.broadcast_arrays(np.asarray(p, dtype=float),
+                                   np.asarray(im, dtype=float),
+                                   np.asarray(n, dtype=float))
+    zero_rate = im == 0
+    # avoid dividing by zero where the rate is 0 - those are filled in after
+    safe_im = np.where(zero_rate, 1.0, im)
+    repayment = (safe_im*p)/(1-(1+safe_im)**(-n))
+    repayment = np.where(zero_rate, p/n, repayment)
+    return round_half_even(repayment, 2)
 
-    # process the initial choice to get consistent shortened string
-    # - this could be just 1 char given diff words
-    final_choice = init_choice.replace(" ","").lower()[0:4]
+def investment_calculation_grid (p, r, t):
+    '''investment_calculation_grid - array version of investment_calculation
+       p, r and t can be numbers or arrays that broadcast together (see
+       scenario_grid)
+       returns arrays of simple and compound totals and interest earned'''
+    p, r, t = np.broadcast_arrays(np.asarray(p, dtype=float),
+                                  np.asarray(r, dtype=float),
+                                  np.asarray(t, dtype=float))
+    # simple
+    tot_amt_simp_c = round_half_even(p*(1+r*t), 0)
+    tot_int_simp_c = tot_amt_simp_c-p
+    # compound
+    tot_amt_comp_c = round_half_even(p*np.power(1+r, t), 0)
+    tot_int_comp_c = tot_amt_comp_c-p
+    return tot_amt_simp_c, tot_int_simp_c, tot_amt_comp_c, tot_int_comp_c
 
-    # if user wants to quit use full "quit" or short cut q
-    if final_choice == "quit" or init_choice =="q":
-        #carry_on = False
-        break
+def rate_shock_table (p, annual_rate, n, shocks=(-1, -0.5, 0.5, 1, 2)):
+    '''rate_shock_table - monthly repayment at the annual rate (in %) and
+       at the annual rate moved by each shock (in % points), with the
+       monthly rate rounded to 4dps as the bond calculator does
+       returns list of (annual rate, repayment, change in repayment)'''
+    annual_rates = annual_rate + np.array([0, *shocks], dtype=float)
+    annual_rates = annual_rates[annual_rates >= 0]
+    monthly_rates = round_half_even(annual_rates/100/12, 4)
+    repayments = bond_calculation_grid(p, monthly_rates, n).tolist()
+    return [(rate, repayment, round(repayment - repayments[0], 2))
+            for rate, repayment in zip(annual_rates.tolist(), repayments)]
 
-    # deal with investment
-    elif final_choice =="inve" or init_choice =="i":
-        print("We're going to see how much you can earn by saving a lump sum...\n\n")
-        print("we just need answers to a couple of easy quesions:\n")
+# Amortization schedules - interest, principal and balance per period
+# the repayment is the rounded monthly bond and the last payment clears
+# whatever is left over (a few pence either way)
 
+def amortization_schedule (p, im, n, repayment=None):
+    '''amortization_schedule - generator of the repayment schedule of one
+       loan, one period at a time so very long loans need no memory
+       p = amount borrowed; im = monthly interest rate; n = no of months
+       repayment = monthly repayment (default bond_calculation(p, im, n))
+       yields (period, payment, interest, principal, balance after)'''
+    if n < 1:
+        raise ValueError("The number of months must be at least 1")
+    if repayment is None:
+        repayment = bond_calculation(p, im, n)
+    balance = float(p)
+    for period in range(1, n+1):
+        interest = balance*im
+        payment = balance + interest if period == n else repayment
+        principal = payment - interest
+        balance = 0.0 if period == n else balance - principal
+        yield period, payment, interest, principal, balance
+
+def balance_at_period (p, im, n, k, repayment=None):
+    '''balance_at_period - balance left after k repayments, worked out
+       directly rather than by going through the schedule
+       p, im, n, k (and repayment) can be numbers or arrays that broadcast
+       together
+       returns float array (0 once the loan is paid off)'''
+    p, im, n, k = np.broadcast_arrays(np.asarray(p, dtype=float),
+                                      np.asarray(im, dtype=float),
+                                      np.asarray(n, dtype=float),
+                                      np.asarray(k, dtype=float))
+    if repayment is None:
+        repayment = bond_calculation_grid(p, im, n)
+    repayment = np.broadcast_to(np.asarray(repayment, dtype=float), p.shape)
+    # balance = p(1+i)^k - R((1+i)^k - 1)/i, or p - Rk with no interest
+    growth = np.power(1+im, k)
+    safe_im = np.where(im == 0, 1.0, im)
+    balance = np.where(im == 0, p - repayment*k,
+                       p*growth - repayment*(growth-1)/safe_im)
+    return np.where(k >= n, 0.0, balance)
+
+def amortization_schedule_batch (p, im, n, start=0, stop=None):
+    '''amortization_schedule_batch - repayment schedules of many loans at
+       once, for periods start+1 to stop (default the longest term) so a
+       large portfolio can be done a block of periods at a time
+       p, im and n are numbers or 1d arrays (one per loan)
+       returns periods (1d) and payment, interest, principal and balance
+       after - 2d arrays of loans x periods (0 once a loan is paid off)'''
+    p, im, n = (np.atleast_1d(np.asarray(values, dtype=float))
+                for values in (p, im, n))
+    p, im, n = np.broadcast_arrays(p, im, n)
+    if (n < 1).any():
+        raise ValueError("The number of months must be at least 1")
+    if stop is None:
+        stop = int(n.max())
+    repayment = bond_calculation_grid(p, im, n)[:, None]
+    p, im, n = p[:, None], im[:, None], n[:, None]
+    periods = np.arange(start+1, stop+1)
+    opening = balance_at_period(p, im, n, periods-1, repayment)
+    interest = opening*im
+    active = periods <= n
+    payment = np.where(periods == n, opening + interest, repayment)
+    payment = np.where(active, payment, 0.0)
+    interest = np.where(active, interest, 0.0)
+    principal = payment - interest
+    balance = np.where(periods >= n, 0.0, opening - principal)
+    return periods, payment, interest, principal, balance
+
+# Monte Carlo simulation - investment_calculation with a random annual
+# rate each year instead of one fixed rate
+
+def simulate_block (p, r, t, paths, seed_sequence, volatility, reversion,
+                    mean_rate, floor):
+    '''simulate_block - final amounts of one block of simulated rate paths
+       each year's rate moves back towards mean_rate by reversion (as a
+       fraction of the gap) plus a normal shock with sd volatility, and is
+       not allowed below floor - the first year's rate is r
+       returns float array of final amounts (rounded like
+       investment_calculation)'''
+    rng = np.random.default_rng(seed_sequence)
+    years = math.ceil(t)
+    shocks = rng.standard_normal((paths, years))*volatility
+    rate = np.full(paths, float(r))
+    growth = np.ones(paths)
+    for year in range(years):
+        if year:
+            rate = np.maximum(rate + reversion*(mean_rate - rate)
+                              + shocks[:, year], floor)
+        # a part year at the end grows by part of the year's rate
+        growth *= np.power(1+rate, min(t - year, 1))
+    return round_half_even(p*growth, 0)
+
+def simulate_investment (p, r, t, paths=100000, seed=None, volatility=0.01,
+                         reversion=0.1, mean_rate=None, floor=0.0,
+                         block_size=50000, processes=None):
+    '''simulate_investment - compound growth of p over t years along many
+       random annual rate paths (see simulate_block) starting at rate r
+       and moving back towards mean_rate (default r)
+       paths are done in blocks of block_size (about block_size*t*8 bytes
+       each) spread over processes worker processes (default every CPU) -
+       each block has its own seed from seed, so the results are the
+       same for a seed whatever the number of processes
+       returns float array of the final amount of each path'''
+    if paths < 1 or block_size < 1 or t <= 0:
+        raise ValueError("paths, block_size and t must be greater than 0")
+    mean_rate = r if mean_rate is None else mean_rate
+    block_sizes = [min(block_size, paths - start)
+                   for start in range(0, paths, block_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(block_sizes))
+    blocks = [(p, r, t, size, block_seed, volatility, reversion, mean_rate,
+               floor) for size, block_seed in zip(block_sizes, seeds)]
+    processes = min(processes or os.cpu_count() or 1, len(blocks))
+    if processes == 1:
+        results = [simulate_block(*block) for block in blocks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(simulate_block, *zip(*blocks)))
+    return np.concatenate(results)
+
+def simulation_percentiles (amounts, percentiles=(5, 25, 50, 75, 95)):
+    '''simulation_percentiles - summary of simulated final amounts
+       returns dict of mean and each percentile of the final amount'''
+    summary = {"mean": float(np.mean(amounts))}
+    for percentile, value in zip(percentiles,
+                                 np.percentile(amounts, percentiles)):
+        summary[f"p{percentile:g}"] = float(value)
+    return summary
+
+# Inverse solvers - the rate, term or amount that gives a target
+# repayment (or investment goal), on whole arrays of queries
+# these solve the unrounded formulas - round the answers as needed
+# invalid or impossible queries give nan
+
+def _positive_arrays (*values):
+    '''_positive_arrays - broadcast float arrays plus a mask of the
+       elements where every value is finite and greater than 0'''
+    arrays = np.broadcast_arrays(*(np.asarray(value, dtype=float)
+                                   for value in values))
+    valid = np.ones(arrays[0].shape, dtype=bool)
+    for array in arrays:
+        valid &= np.isfinite(array) & (array > 0)
+    return arrays, valid
+
+def _bond_repayment (p, im, n):
+    '''_bond_repayment - unrounded monthly repayment for rates > 0 and its
+       derivative with respect to the rate (for the Newton steps)'''
+    # 1-(1+i)^-n with log1p/expm1 so small rates keep their precision
+    discount = np.exp(-n*np.log1p(im))
+    annuity = -np.expm1(-n*np.log1p(im))
+    repayment = im*p/annuity
+    derivative = p*(annuity - im*n*discount/(1+im))/annuity**2
+    return repayment, derivative
+
+def solve_bond_rate (p, n, repayment, tolerance=1e-13, max_iterations=200):
+    '''solve_bond_rate - monthly interest rate at which p is repaid over n
+       months by the given monthly repayment
+       Newton steps kept inside a bracket [0, repayment/p] that shrinks
+       every step - a step that would leave the bracket is replaced by a
+       bisection, so every query converges
+       returns float array of monthly rates (0 if repayment is p/n, nan if
+       it is less)'''
+    (p, n, repayment), valid = _positive_arrays(p, n, repayment)
+    straight_line = p/np.where(valid, n, 1.0)
+    zero_rate = valid & np.isclose(repayment, straight_line, rtol=1e-15,
+                                   atol=0)
+    solving = valid & ~zero_rate & (repayment > straight_line)
+    p, n, target = p[solving], n[solving], repayment[solving]
+
+    low = np.zeros(p.shape)
+    # the repayment is always more than the interest alone, so the rate
+    # is less than repayment/p
+    high = target/p
+    # first guess from the repayment of a small rate, p/n + ip(n+1)/2n
+    rate = np.clip(2*n*(target - p/n)/(p*(n+1)), high*1e-3, high*0.999)
+    # only the queries that have not converged yet are worked on
+    active = np.arange(len(rate))
+    for _ in range(max_iterations):
+        if not len(active):
+            break
+        current = rate[active]
+        value, derivative = _bond_repayment(p[active], current, n[active])
+        too_high = value > target[active]
+        high[active] = np.where(too_high, current, high[active])
+        low[active] = np.where(too_high, low[active], current)
+        step = current - (value - target[active])/derivative
+        step = np.where((step > low[active]) & (step < high[active]), step,
+                        (low[active] + high[active])/2)
+        rate[active] = step
+        done = ((np.abs(step - current) <= tolerance*current)
+                | (high[active] - low[active] <= tolerance*high[active]))
+        active = active[~done]
+
+    rates = np.full(valid.shape, np.nan)
+    rates[zero_rate] = 0.0
+    rates[solving] = rate
+    return rates
+
+def solve_bond_term (p, im, repayment):
+    '''solve_bond_term - number of months to repay p at monthly rate im
+       with the given monthly repayment (closed form, usually not a whole
+       number - np.ceil gives the months needed)
+       returns float array (nan if the repayment does not cover the
+       interest)'''
+    (p, repayment), valid = _positive_arrays(p, repayment)
+    im = np.broadcast_to(np.asarray(im, dtype=float), p.shape)
+    valid &= np.isfinite(im) & (im >= 0)
+    safe_im = np.where(valid & (im > 0), im, 1.0)
+    # n = -log(1 - ip/R)/log(1+i), or p/R with no interest
+    remaining = 1 - safe_im*p/np.where(valid, repayment, 1.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        months = np.where(im > 0, -np.log(remaining)/np.log1p(safe_im),
+                          p/repayment)
+    return np.where(valid & ((im == 0) | (remaining > 0)), months, np.nan)
+
+def solve_bond_principal (im, n, repayment):
+    '''solve_bond_principal - amount that the monthly repayment pays off
+       over n months at monthly rate im (closed form)
+       returns float array'''
+    (n, repayment), valid = _positive_arrays(n, repayment)
+    im = np.broadcast_to(np.asarray(im, dtype=float), n.shape)
+    valid &= np.isfinite(im) & (im >= 0)
+    safe_im = np.where(im > 0, im, 1.0)
+    annuity = -np.expm1(-n*np.log1p(safe_im))/safe_im
+    principal = np.where(im > 0, repayment*annuity, repayment*n)
+    return np.where(valid, principal, np.nan)
+
+def solve_investment_years (p, r, goal, compound=True):
+    '''solve_investment_years - years for a deposit p to grow to goal at
+       annual rate r, with compound or simple interest (closed form)
+       returns float array (nan if the goal is not more than p)'''
+    (p, r, goal), valid = _positive_arrays(p, r, goal)
+    valid &= goal > p
+    with np.errstate(invalid="ignore", divide="ignore"):
+        years = (np.log(goal/p)/np.log1p(r) if compound
+                 else (goal/p - 1)/r)
+    return np.where(valid, years, np.nan)
+
+def solve_investment_rate (p, t, goal, compound=True):
+    '''solve_investment_rate - annual rate needed for a deposit p to grow
+       to goal in t years (closed form)
+       returns float array (nan if the goal is not more than p)'''
+    (p, t, goal), valid = _positive_arrays(p, t, goal)
+    valid &= goal > p
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rates = (np.expm1(np.log(goal/p)/t) if compound
+                 else (goal/p - 1)/t)
+    return np.where(valid, rates, np.nan)
+
+def solve_investment_principal (r, t, goal, compound=True):
+    '''solve_investment_principal - deposit needed to grow to goal in t
+       years at annual rate r (closed form)
+       returns float array'''
+    (r, t, goal), valid = _positive_arrays(r, t, goal)
+    deposit = goal/np.power(1+r, t) if compound else goal/(1 + r*t)
+    return np.where(valid, deposit, np.nan)
+
+def check_inverse_solvers (samples=1000000, seed=0):
+    '''check_inverse_solvers - round trips random queries through the
+       solvers and the forward formulas
+       returns dict of the largest relative error of each solver and the
+       number of solved rates whose rounded repayment is not the target
+       (all should be about 1e-9 or less, and 0)'''
+    rng = np.random.default_rng(seed)
+    p = rng.integers(1000, 2000000, samples).astype(float)
+    im = rng.uniform(1e-6, 0.03, samples)
+    n = rng.integers(1, 601, samples).astype(float)
+    repayment, _ = _bond_repayment(p, im, n)
+    r = rng.uniform(1e-4, 0.3, samples)
+    t = rng.uniform(0.1, 60, samples)
+    goal = p*np.power(1+r, t)
+    simple_goal = p*(1+r*t)
+
+    def error(solved, expected):
+        return float(np.max(np.abs(solved - expected)/np.abs(expected)))
+
+    rates = solve_bond_rate(p, n, repayment)
+    # a rate that gives a rounded repayment
+    rounded = bond_calculation_grid(p, im, n)
+    rounded_rates = solve_bond_rate(p, n, rounded)
+    return {
+        "bond_rate": error(rates, im),
+        "bond_rate_rounded_mismatches": int(np.count_nonzero(
+            bond_calculation_grid(p, rounded_rates, n) != rounded)),
+        "bond_term": error(solve_bond_term(p, im, repayment), n),
+        "bond_principal": error(solve_bond_principal(im, n, repayment), p),
+        "investment_years": error(solve_investment_years(p, r, goal), t),
+        "investment_rate": error(solve_investment_rate(p, t, goal), r),
+        "investment_principal": error(
+            solve_investment_principal(r, t, goal), p),
+        "simple_years": error(
+            solve_investment_years(p, r, simple_goal, False), t),
+        "simple_rate": error(
+            solve_investment_rate(p, t, simple_goal, False), r),
+        "simple_principal": error(
+            solve_investment_principal(r, t, simple_goal, False), p),
+    }
+
+def check_grid_calculations (samples=100000, seed=0):
+    '''check_grid_calculations - compares the grid versions with the
+       scalar functions on random inputs (including zero rates)
+       returns number of differences found (should be 0)'''
+    rng = np.random.default_rng(seed)
+    p = rng.integers(1, 2000000, samples)
+    im = np.round(rng.uniform(0, 0.02, samples), 4)
+    im[::10] = 0
+    n = rng.integers(1, 481, samples)
+    r = np.round(rng.uniform(0, 0.2, samples), 4)
+    t = np.round(rng.uniform(0.01, 40, samples), 2)
+    bonds = bond_calculation_grid(p, im, n)
+    investments = np.stack(investment_calculation_grid(p, r, t), axis=1)
+    differences = 0
+    for i in range(samples):
+        if bond_calculation(int(p[i]), float(im[i]), int(n[i])) != bonds[i]:
+            differences += 1
+        scalar = investment_calculation(int(p[i]), float(r[i]), float(t[i]))
+        if list(scalar) != investments[i].tolist():
+            differences += 1
+    return differences
+
+# Batch mode - the calculators over a whole CSV / JSONL file of records
+# (the rates are annual percentages, as typed into the interactive version)
+
+BATCH_COLUMNS = {"bond": ["principal", "annual_rate", "months"],
+                 "investment": ["deposit", "annual_rate", "years"]}
+# columns that must be whole numbers (validate_integers)
+INTEGER_COLUMNS = {"principal", "deposit", "months"}
+BATCH_CHUNK_SIZE = 100000
+
+def parse_lines (file_path):
+    '''parse_lines - reads each record of a CSV or JSONL (.jsonl / .json)
+       file, one line at a time so a line that cannot be parsed only
+       loses that record
+       yields (record dict, "") - or ({}, parse error message)'''
+    with open(file_path, newline="", encoding="utf-8") as records_file:
+        if file_path.endswith((".jsonl", ".json")):
+            for line_number, line in enumerate(records_file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as error:
+                    yield {}, f"line {line_number}: invalid JSON ({error})"
+                    continue
+                if isinstance(record, dict):
+                    yield record, ""
+                else:
+                    yield {}, f"line {line_number}: not a JSON object"
+            return
+        reader = csv.reader(records_file)
+        header = next(reader, [])
         while True:
-            # get initial deposit...in hindsight this could have
-            # been done with the house value etc in a single routine
-            initial_deposit_input = input("Enter the amount you want to deposit...")
-            initial_deposit = validate_integers (initial_deposit_input)
-            if initial_deposit is not None:
-                print (f"Your initial deposit is £{initial_deposit:,.0f}")
-                break
-        while True:
-            # get interest rate to 4dps
-            int_rate_input = input("Enter the expected interest rates...")
-            curr_int_rate = validate_floats (int_rate_input)
-            if curr_int_rate is not None:
-                curr_int_rate = round(curr_int_rate/100,4)
-                print (f"Your current interest rate is {curr_int_rate*100:,.2f}%")
-                break
-        while True:
-            # get number of years to save
-            No_of_years_input = input("Enter the expected number of YEARS to save...")
-            No_of_years = validate_floats (No_of_years_input)
-            if No_of_years is not None:
-                No_of_years = round(No_of_years,2)
-                print (f"Your expected saving period is {No_of_years} years")
-                break
-
-        print (f"\nIn summary:\nAmount to deposit - £{initial_deposit:,.0f}\n"
-              f"Interest rate - {curr_int_rate*100:,.2f}% pa\n"
-              f"Period to save - {No_of_years} years\n")
-
-        # call the calculations
-        (total_simp_ret, total_simp_int,
-        total_cum_ret, total_cum_int) = \
-        investment_calculation(initial_deposit, curr_int_rate, No_of_years)
-
-        # ask the user what result they would like to see
-        while True:
-            user_int_choice = input("You can choose to see the results "
-                                    + "on two different calucations - choose from:\n"
-                                    + "\"Simple\" - to see the total amount "
-                                    + "returned from simple interest calculation or\n"
-                                    + "\"Compound\" - to how much you would earn "
-                                    + "with compound intereest...\n"
-                                    + "\"Move on\" to do some more calculations...\n")
-
-            #process the initial choice to get consistent shortened string:
-            user_int_choice_final = user_int_choice.replace(" ","").lower()[0:4]
-
-            # show simple results (s is the short cut)
-            if user_int_choice_final == "simp" or user_int_choice =="s":
-                print (f"The simple amount returned after {No_of_years:,.2f} "
-                       f"years will be £{total_simp_ret:,.0f}\n"
-                       f"The simple interest earned would be £{total_simp_int:,.0f}\n")
-            elif user_int_choice_final == "comp" or user_int_choice =="c":
-                print (f"The compound amount returned after {No_of_years:,.2f} "
-                       f"years will be £{total_cum_ret:,.0f}\n"
-                       f"The compound interest earned would be £{total_cum_int:,.0f}\n")
+            try:
+                fields = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as error:
+                yield {}, f"line {reader.line_num}: invalid CSV ({error})"
+                continue
+            if not fields:
+                continue
+            if len(fields) != len(header):
+                yield {}, (f"line {reader.line_num}: {len(fields)} fields "
+                           f"but the header has {len(header)}")
             else:
-                break
+                yield dict(zip(header, fields)), ""
 
-  # Deal with bond calculation
-    # deal with mortgage repayment (short cut is 'b')
-    elif final_choice == "bond" or init_choice =="b":
-        print("We're going to see how much to repay your house off...\n\n")
-        print("We just need answers to a couple of easy quesions:\n")
+def read_records (file_path, chunk_size=BATCH_CHUNK_SIZE):
+    '''read_records - streams a CSV or JSONL (.jsonl / .json) file in
+       chunks of chunk_size records, with the values as written (CSV
+       values as text) so they can be checked like typed entries
+       yields (DataFrame indexed by record number in the file, Series of
+       parse errors - "" for records that were read)'''
+    lines = parse_lines(file_path)
+    start = 0
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if not chunk:
+            return
+        index = pd.RangeIndex(start, start + len(chunk))
+        # object columns keep each JSON value as it was written
+        records = pd.DataFrame([record for record, _ in chunk], index=index,
+                               dtype=object)
+        parse_errors = pd.Series([error for _, error in chunk], index=index,
+                                 dtype=object)
+        yield records, parse_errors
+        start += len(chunk)
 
-        while True:
-            #get value of house - really this is the amount of money needed to pay for the house...
-            curr_house_value_input = input("Enter the value of the house...")
-            curr_house_value = validate_integers (curr_house_value_input)
-            if curr_house_value is not None:
-                print (f"Your house value is approx £{curr_house_value:,.0f}")
-                break
-        while True:
-            #get interest rate
-            int_rate_input = input("Enter the expected interest rate...")
-            curr_int_rate = validate_floats (int_rate_input)
-            if curr_int_rate is not None:
-                monthly_int_rate = round(curr_int_rate/100/12,4)
-                curr_int_rate_extra = curr_int_rate+1
-                monthly_int_rate_extra = round(curr_int_rate_extra/100/12,4)
-                print (f"Your current annual interest rate is {curr_int_rate}% ")
-                break
-        while True:
-            #get number of months to repay
-            No_of_months_input = input("Enter the expected number of MONTHS to repay...")
-            No_of_months = validate_integers (No_of_months_input)
-            if No_of_months is not None:
-                print (f"Your expected repayment period is {No_of_months} or "
-                       f"{round(No_of_months/12,2)} years")
-                break
-        print (f"\nIn summary:\nAmount to pay - £{curr_house_value:,.0f}\n"
-              f"Interest rate - {curr_int_rate}% pa\n"
-              f"Period to pay - {No_of_months} months\n")
-
-        # let show the results
-        # first get the info from the function bond_calculation
-        bond_repyament = bond_calculation(curr_house_value, monthly_int_rate,No_of_months)
-        total_paid = bond_repyament*No_of_months
-        total_int_paid = total_paid-curr_house_value
-
-        # tell the user
-        print (f"The amount of the monthly bond is £{bond_repyament:,.2f}\n"
-              f"The total amount payable is £{total_paid:,.2f}\n"
-              f"Total interest payable is £{total_int_paid:,.2f}\n")
-
-        # see if the user wants to know what happens if interest rates go up by a point?
-        show_comparison = input("Would you like to see what would happen if interest rates "
-                                "increased by 1%? - just enter \"y\" or \"n\"...")
-
-        # if show comparison required
-        if show_comparison == "y":
-            bond_repyament_extra =\
-            bond_calculation(curr_house_value,monthly_int_rate_extra,No_of_months)
-            total_paid_hr = bond_repyament_extra * No_of_months
-            total_int_paid_hr = total_paid_hr-curr_house_value
-            print (f"\nIf interest rates increased by just 1% to "
-                  f"{curr_int_rate_extra}%:\n"
-                  f"The amount of the increased monthly bond would be "
-                  f"£{bond_repyament_extra:,.2f}\n"
-                  f"The monthly extra payable would be "
-                  f"£{bond_repyament_extra - bond_repyament:,.2f}\n"
-                  f"Total extra interest payable would be "
-                  f"£{total_int_paid_hr - total_int_paid:,.2f}\n\n")
-
-# get ready to do it again
-        print ("Would you like to do another calculation...")
-
-# inital string result nonsensical
+def validate_columns (records, columns):
+    '''validate_columns - checks every value of the given columns of a
+       chunk of records with check_integer (INTEGER_COLUMNS) or
+       check_float, as validate_integers / validate_floats check a typed
+       entry
+       returns dict of column -> float array (nan where invalid) and a
+       Series of error messages ("" for valid rows)'''
+    missing = [column for column in columns if column not in records]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+    values = {}
+    messages = [[] for _ in range(len(records))]
+    for column in columns:
+        check = check_integer if column in INTEGER_COLUMNS else check_float
+        numbers = np.full(len(records), np.nan)
+        for row, entry in enumerate(records[column].tolist()):
+            if entry is None or (isinstance(entry, float)
+                                 and math.isnan(entry)):
+                # not in this JSONL record (or after a parse error)
+                value, message = None, "missing"
+            else:
+                # JSON numbers are checked as written, eg 3.0 is not a
+                # whole number
+                value, message = check(str(entry))
+            if message:
+                messages[row].append(f"{column}: {message}")
+            else:
+                numbers[row] = value
+        values[column] = numbers
+    errors = pd.Series(["; ".join(row) for row in messages],
+                       index=records.index, dtype=object)
+    return values, errors
+
+def calculate_records (records, calculator, parse_errors=None):
+    '''calculate_records - validates and calculates one chunk of records
+       the same way as the interactive calculators (rates rounded to 4dps,
+       investment years to 2dps)
+       parse_errors - optional Series from read_records, reported instead
+       of the checks for records that could not be read
+       returns the records with the validated values (integer columns as
+       whole numbers, blank where invalid), the results and an error
+       column'''
+    columns = BATCH_COLUMNS[calculator]
+    # a column none of the chunk's records have is missing from each row
+    records = records.reindex(columns=list(records.columns) + [
+        column for column in columns if column not in records])
+    values, errors = validate_columns(records, columns)
+    if parse_errors is not None:
+        errors = parse_errors.where(parse_errors != "", errors)
+    records = records.copy()
+    for column in columns:
+        records[column] = (pd.Series(values[column], index=records.index)
+                           .astype("Int64" if column in INTEGER_COLUMNS
+                                   else "float64"))
+    results = pd.DataFrame(index=records.index)
+    if calculator == "bond":
+        monthly_int_rate = round_half_even(values["annual_rate"]/100/12, 4)
+        months = values["months"]
+        repayment = bond_calculation_grid(values["principal"],
+                                          monthly_int_rate, months)
+        results["monthly_repayment"] = repayment
+        total_paid = round_half_even(repayment*months, 2)
+        results["total_paid"] = total_paid
+        results["total_interest"] = round_half_even(
+            total_paid - values["principal"], 2)
+    else:
+        curr_int_rate = round_half_even(values["annual_rate"]/100, 4)
+        years = round_half_even(values["years"], 2)
+        (results["simple_total"], results["simple_interest"],
+         results["compound_total"], results["compound_interest"]) = \
+            investment_calculation_grid(values["deposit"], curr_int_rate,
+                                        years)
+    results["error"] = errors
+    return pd.concat([records, results], axis=1)
+
+def run_batch (args):
+    '''run_batch - streams the input file through the chosen calculator,
+       writing each chunk of results out as soon as it is done, with an
+       error for each invalid row rather than prompting again'''
+    jsonl = args.output.endswith((".jsonl", ".json"))
+    rows = error_rows = 0
+    output = (sys.stdout if args.output == "-"
+              else open(args.output, "w", newline="", encoding="utf-8"))
+    try:
+        for chunk_number, (records, parse_errors) in enumerate(
+                read_records(args.input, args.chunk_size)):
+            results = calculate_records(records, args.calculator,
+                                        parse_errors)
+            if jsonl:
+                results.rename_axis("row").reset_index().to_json(
+                    output, orient="records", lines=True)
+            else:
+                results.to_csv(output, header=chunk_number == 0,
+                               index_label="row")
+            rows += len(results)
+            error_rows += int((results["error"] != "").sum())
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    # the summary goes to stderr so results can be written to stdout
+    print(f"{rows:,} {args.calculator} records calculated, "
+          f"{error_rows:,} with errors", file=sys.stderr)
+
+def parse_args (argv=None):
+    '''parse_args - the batch mode command line arguments'''
+    parser = argparse.ArgumentParser(
+        description="Batch bond or investment calculations over a CSV or "
+                    "JSONL file. Run without any arguments for the "
+                    "interactive calculators.")
+    parser.add_argument("calculator", choices=list(BATCH_COLUMNS),
+                        help="bond records need principal, annual_rate (%%)"
+                             " and months - investment records need "
+                             "deposit, annual_rate (%%) and years")
+    parser.add_argument("--input", required=True,
+                        help="CSV or JSONL (.jsonl) file of records")
+    parser.add_argument("--output", default="-",
+                        help="CSV or JSONL (.jsonl) results file "
+                             "(default: CSV to stdout)")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE,
+                        help="records per chunk (default: %(default)s)")
+    return parser.parse_args(argv)
+
+# main code loop follows
+
+def run_interactive ():
+    '''run_interactive - the interactive calculator loop'''
+    print ("\nWelcome to the finance calculators.\n")
+
+    while True:
+        # lets get user selection, relevant inputs and process:
+
+        init_choice = input("You can choose from:\n" + "\"Investment\""
+                            + " - to calculate the total amount you may earn on your investment\n"
+                            + "\"Bond\" - to calculate how much it will "
+                            + "cost to pay off your mortgage or\n"
+                            + "\"Quit\" - to terminate program\n\n"
+                            + "Please enter your selection...\n")
+
+        # process the initial choice to get consistent shortened string
+        # - this could be just 1 char given diff words
+        final_choice = init_choice.replace(" ","").lower()[0:4]
+
+        # if user wants to quit use full "quit" or short cut q
+        if final_choice == "quit" or init_choice =="q":
+            #carry_on = False
+            break
+
+        # deal with investment
+        elif final_choice =="inve" or init_choice =="i":
+            print("We're going to see how much you can earn by saving a lump sum...\n\n")
+            print("we just need answers to a couple of easy quesions:\n")
+
+            while True:
+                # get initial deposit...in hindsight this could have
+                # been done with the house value etc in a single routine
+                initial_deposit_input = input("Enter the amount you want to deposit...")
+                initial_deposit = validate_integers (initial_deposit_input)
+                if initial_deposit is not None:
+                    print (f"Your initial deposit is £{initial_deposit:,.0f}")
+                    break
+            while True:
+                # get interest rate to 4dps
+                int_rate_input = input("Enter the expected interest rates...")
+                curr_int_rate = validate_floats (int_rate_input)
+                if curr_int_rate is not None:
+                    curr_int_rate = round(curr_int_rate/100,4)
+                    print (f"Your current interest rate is {curr_int_rate*100:,.2f}%")
+                    break
+            while True:
+                # get number of years to save
+                No_of_years_input = input("Enter the expected number of YEARS to save...")
+                No_of_years = validate_floats (No_of_years_input)
+                if No_of_years is not None:
+                    No_of_years = round(No_of_years,2)
+                    print (f"Your expected saving period is {No_of_years} years")
+                    break
+
+            print (f"\nIn summary:\nAmount to deposit - £{initial_deposit:,.0f}\n"
+                  f"Interest rate - {curr_int_rate*100:,.2f}% pa\n"
+                  f"Period to save - {No_of_years} years\n")
+
+            # call the calculations
+            (total_simp_ret, total_simp_int,
+            total_cum_ret, total_cum_int) = \
+            investment_calculation(initial_deposit, curr_int_rate, No_of_years)
+
+            # ask the user what result they would like to see
+            while True:
+                user_int_choice = input("You can choose to see the results "
+                                        + "on two different calucations - choose from:\n"
+                                        + "\"Simple\" - to see the total amount "
+                                        + "returned from simple interest calculation or\n"
+                                        + "\"Compound\" - to how much you would earn "
+                                        + "with compound intereest...\n"
+                                        + "\"Move on\" to do some more calculations...\n")
+
+                #process the initial choice to get consistent shortened string:
+                user_int_choice_final = user_int_choice.replace(" ","").lower()[0:4]
+
+                # show simple results (s is the short cut)
+                if user_int_choice_final == "simp" or user_int_choice =="s":
+                    print (f"The simple amount returned after {No_of_years:,.2f} "
+                           f"years will be £{total_simp_ret:,.0f}\n"
+                           f"The simple interest earned would be £{total_simp_int:,.0f}\n")
+                elif user_int_choice_final == "comp" or user_int_choice =="c":
+                    print (f"The compound amount returned after {No_of_years:,.2f} "
+                           f"years will be £{total_cum_ret:,.0f}\n"
+                           f"The compound interest earned would be £{total_cum_int:,.0f}\n")
+                else:
+                    break
+
+      # Deal with bond calculation
+        # deal with mortgage repayment (short cut is 'b')
+        elif final_choice == "bond" or init_choice =="b":
+            print("We're going to see how much to repay your house off...\n\n")
+            print("We just need answers to a couple of easy quesions:\n")
+
+            while True:
+                #get value of house - really this is the amount of money needed to pay for the house...
+                curr_house_value_input = input("Enter the value of the house...")
+                curr_house_value = validate_integers (curr_house_value_input)
+                if curr_house_value is not None:
+                    print (f"Your house value is approx £{curr_house_value:,.0f}")
+                    break
+            while True:
+                #get interest rate
+                int_rate_input = input("Enter the expected interest rate...")
+                curr_int_rate = validate_floats (int_rate_input)
+                if curr_int_rate is not None:
+                    monthly_int_rate = round(curr_int_rate/100/12,4)
+                    curr_int_rate_extra = curr_int_rate+1
+                    monthly_int_rate_extra = round(curr_int_rate_extra/100/12,4)
+                    print (f"Your current annual interest rate is {curr_int_rate}% ")
+                    break
+            while True:
+                #get number of months to repay
+                No_of_months_input = input("Enter the expected number of MONTHS to repay...")
+                No_of_months = validate_integers (No_of_months_input)
+                if No_of_months is not None:
+                    print (f"Your expected repayment period is {No_of_months} or "
+                           f"{round(No_of_months/12,2)} years")
+                    break
+            print (f"\nIn summary:\nAmount to pay - £{curr_house_value:,.0f}\n"
+                  f"Interest rate - {curr_int_rate}% pa\n"
+                  f"Period to pay - {No_of_months} months\n")
+
+            # let show the results
+            # first get the info from the function bond_calculation
+            bond_repyament = bond_calculation(curr_house_value, monthly_int_rate,No_of_months)
+            total_paid = bond_repyament*No_of_months
+            total_int_paid = total_paid-curr_house_value
+
+            # tell the user
+            print (f"The amount of the monthly bond is £{bond_repyament:,.2f}\n"
+                  f"The total amount payable is £{total_paid:,.2f}\n"
+                  f"Total interest payable is £{total_int_paid:,.2f}\n")
+
+            # see if the user wants to know what happens if interest rates go up by a point?
+            show_comparison = input("Would you like to see what would happen if interest rates "
+                                    "increased by 1%? - just enter \"y\" or \"n\"...")
+
+            # if show comparison required
+            if show_comparison == "y":
+                bond_repyament_extra =\
+                bond_calculation(curr_house_value,monthly_int_rate_extra,No_of_months)
+                total_paid_hr = bond_repyament_extra * No_of_months
+                total_int_paid_hr = total_paid_hr-curr_house_value
+                print (f"\nIf interest rates increased by just 1% to "
+                      f"{curr_int_rate_extra}%:\n"
+                      f"The amount of the increased monthly bond would be "
+                      f"£{bond_repyament_extra:,.2f}\n"
+                      f"The monthly extra payable would be "
+                      f"£{bond_repyament_extra - bond_repyament:,.2f}\n"
+                      f"Total extra interest payable would be "
+                      f"£{total_int_paid_hr - total_int_paid:,.2f}\n\n")
+
+    # get ready to do it again
+            print ("Would you like to do another calculation...")
+
+    # inital string result nonsensical
+        else:
+            print ("You have entered nonsense! (an unrecognised string) "
+                    "- please try again or quit...\n\n")
+
+    # The following executes on quitting/break
+    print_messages ("Thanks for using the system")  # This prints 'False' when 'quit is entered
+
+def main ():
+    '''main - runs the interactive calculators if there are no command line
+       arguments, otherwise the batch mode'''
+    if len(sys.argv) > 1:
+        run_batch(parse_args())
     else:
-        print ("You have entered nonsense! (an unrecognised string) "
-                "- please try again or quit...\n\n")
+        run_interactive()
 
-# The following executes on quitting/break
-print_messages ("Thanks for using the system")  # This prints 'False' when 'quit is entered
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+''' approximate_summary.py
+Simon Kinsey
+
+Quick approximate version of the sentiment_analysis summary, eg for
+trying out preprocessing choices without scoring every review.
+
+Reviews are sampled at random within strata (by default the star rating
+of the review, which goes closely with its sentiment) and scored in
+rounds. After each round the percentage of positive, negative and
+neutral reviews is estimated with a confidence interval, and sampling
+stops as soon as every interval is within the error bound asked for (or
+every review has been scored).
+
+Usage:
+    python approximate_summary.py --error-bound 1 --lemmatize
+    python approximate_summary.py --compare
+'''
+
+# Import Required Libraries
+import argparse
+import time
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+
+# Configuration
+# error bound of each percentage (+/- percentage points)
+ERROR_BOUND = 1.0
+CONFIDENCE = 0.95
+# reviews sampled per round
+ROUND_SIZE = 500
+STRATUM_COLUMN = 'reviews.rating'
+SEED = None
+
+
+# Sample allocation
+def allocate_round(stratum_sizes, sampled, target):
+    """
+    Split a total sample of target reviews over the strata in proportion
+    to their size (every stratum gets at least one review).
+
+    Parameters:
+        stratum_sizes (numpy.ndarray): Number of reviews in each stratum.
+        sampled (numpy.ndarray): Number already sampled from each stratum.
+        target (int): Total sample size to reach.
+    Returns:
+        numpy.ndarray: Number of extra reviews to sample from each stratum.
+    """
+    wanted = np.ceil(target * stratum_sizes / stratum_sizes.sum())
+    wanted = np.minimum(wanted.astype(np.int64), stratum_sizes)
+    return np.maximum(wanted - sampled, 0)
+
+# Stratified estimate of the rating percentages
+def estimate_percentages(rating_counts, scored, stratum_sizes,
+                         confidence=CONFIDENCE):
+    """
+    Estimate the percentage of reviews with each rating from a stratified
+    sample.
+
+    Reviews whose cleaned text is empty are left out (as they are in the
+    full run), so the size of each stratum is scaled by the share of its
+    sampled reviews that were kept. The variance of each stratum's
+    proportion includes the finite population correction, so an
+    exhaustively sampled stratum adds no error.
+
+    Parameters:
+        rating_counts (numpy.ndarray): Count of each rating (RATINGS
+            order) among the kept sampled reviews, one row per stratum.
+        scored (numpy.ndarray): Number of reviews sampled from each
+            stratum (kept or not).
+        stratum_sizes (numpy.ndarray): Number of reviews in each stratum.
+        confidence (float): Confidence level of the intervals.
+    Returns:
+        tuple: (percentages, half_widths) - numpy arrays in RATINGS order.
+    """
+    kept = rating_counts.sum(axis=1)
+    sampled = scored > 0
+    # estimated number of kept reviews in each stratum
+    weights = np.where(sampled, stratum_sizes * kept / np.maximum(scored, 1),
+                       0.0)
+    if not weights.sum():
+        return np.zeros(rating_counts.shape[1]), np.full(
+            rating_counts.shape[1], 100.0)
+    weights = weights / weights.sum()
+    proportions = rating_counts / np.maximum(kept, 1)[:, None]
+    estimate = weights @ proportions
+
+    # sample variance of each stratum's proportions (a conservative 0.25
+    # where there are too few reviews to estimate it)
+    variances = np.where(
+        (kept >= 2)[:, None],
+        proportions * (1 - proportions) * (kept / np.maximum(kept - 1, 1)
+                                           )[:, None],
+        0.25)
+    correction = 1 - scored / stratum_sizes
+    variance = (weights ** 2 * correction / np.maximum(kept, 1)) @ variances
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    return estimate * 100, z * np.sqrt(variance) * 100
+
+# Approximate sentiment summary
+def approximate_sentiment(reviews, nlp=None, lemmatize=False,
+                          remove_punctuation=False, remove_stop_words=False,
+                          score_text=None, engine=None,
+                          error_bound=ERROR_BOUND, confidence=CONFIDENCE,
+                          round_size=ROUND_SIZE,
+                          stratum_column=STRATUM_COLUMN, seed=SEED):
+    """
+    Estimate the sentiment_analysis rating percentages from a stratified
+    random sample, sampling in rounds until the error bound is reached.
+
+    Parameters:
+        reviews (pandas.DataFrame): Reviews with a 'reviews.text' column
+            (and the stratum column if there is one).
+        nlp (spacy.lang): spaCy model - only needed for the preprocessing
+            choices.
+        lemmatize, remove_punctuation, remove_stop_words (bool):
+            Preprocessing choices (as for score_reviews).
+        score_text (str): 'cleaned' or 'raw' (default SCORE_TEXT).
+        engine (str): Sentiment engine (default SENTIMENT_ENGINE).
+        error_bound (float): Largest half-width of the confidence
+            intervals, in percentage points.
+        confidence (float): Confidence level of the intervals.
+        round_size (int): Reviews added to the sample each round.
+        stratum_column (str): Column to stratify by, or None for a simple
+            random sample.
+        seed (int): Random seed for a repeatable sample.
+    Returns:
+        dict: 'percentages' and 'half_widths' (rating -> percentage
+        points), 'counts' (rating counts in the sample), 'reviews',
+        'sampled', 'rounds', 'converged' and 'seconds'.
+    """
+    import sentiment_analysis as sa
+
+    if not 0 < confidence < 1:
+        raise ValueError('confidence must be between 0 and 1.')
+    if error_bound <= 0 or round_size < 1:
+        raise ValueError('error_bound and round_size must be positive.')
+    score_text = score_text or sa.SCORE_TEXT
+    engine = engine or sa.SENTIMENT_ENGINE
+    start = time.perf_counter()
+    rng = np.random.default_rng(seed)
+
+    texts = reviews['reviews.text'].to_numpy()
+    if stratum_column:
+        strata, _ = pd.factorize(reviews[stratum_column],
+                                 use_na_sentinel=False)
+    else:
+        strata = np.zeros(len(reviews), dtype=np.int64)
+    stratum_sizes = np.bincount(strata)
+    # each stratum's reviews in a random order - a sample of n reviews
+    # from a stratum is its first n
+    order = [rng.permutation(np.flatnonzero(strata == stratum))
+             for stratum in range(len(stratum_sizes))]
+
+    scored = np.zeros(len(stratum_sizes), dtype=np.int64)
+    rating_counts = np.zeros((len(stratum_sizes), len(sa.RATINGS)),
+                             dtype=np.int64)
+    rounds = 0
+    converged = False
+    while scored.sum() < len(texts):
+        rounds += 1
+        extra = allocate_round(stratum_sizes, scored,
+                               scored.sum() + round_size)
+        rows = np.concatenate([order[stratum][scored[stratum]:
+                                              scored[stratum] + count]
+                               for stratum, count in enumerate(extra)])
+        results = list(sa.score_reviews(
+            texts[rows], nlp, lemmatize=lemmatize,
+            remove_punctuation=remove_punctuation,
+            remove_stop_words=remove_stop_words, score_text=score_text,
+            engine=engine))
+        kept = np.array([cleaned != '' for cleaned, _, _ in results],
+                        dtype=bool)
+        ratings = sa.rate_polarities(
+            [polarity for _, polarity, _ in results]).codes
+        np.add.at(rating_counts, (strata[rows][kept], ratings[kept]), 1)
+        scored += extra
+
+        percentages, half_widths = estimate_percentages(
+            rating_counts, scored, stratum_sizes, confidence)
+        if half_widths.max() <= error_bound:
+            converged = True
+            break
+    else:
+        # everything was scored - the percentages are exact
+        converged = True
+
+    return {
+        'percentages': dict(zip(sa.RATINGS, percentages.tolist())),
+        'half_widths': dict(zip(sa.RATINGS, half_widths.tolist())),
+        'counts': dict(zip(sa.RATINGS, rating_counts.sum(axis=0).tolist())),
+        'reviews': len(texts),
+        'sampled': int(scored.sum()),
+        'rounds': rounds,
+        'converged': converged,
+        'confidence': confidence,
+        'seconds': time.perf_counter() - start,
+    }
+
+# Approximate summary for printing
+def format_approximate_summary(result):
+    '''
+    Format the estimated percentages with their confidence intervals,
+    from the dictionary returned by approximate_sentiment
+    Returns - formatted string for simple print
+    '''
+    lines = [f"Approximate sentiment analysis from {result['sampled']} of "
+             f"{result['reviews']} reviews "
+             f"({result['sampled'] / result['reviews'] * 100:.1f}%, "
+             f"{result['rounds']} rounds, {result['seconds']:.1f}s):"]
+    for rating, percentage in result['percentages'].items():
+        half_width = result['half_widths'][rating]
+        lines.append(f'{rating.capitalize()} ratings: {percentage:.2f}% '
+                     f'+/- {half_width:.2f} '
+                     f'({max(percentage - half_width, 0):.2f}% to '
+                     f'{min(percentage + half_width, 100):.2f}%)')
+    lines.append(f"({result['confidence'] * 100:g}% confidence intervals)")
+    return '\n'.join(lines) + '\n'
+
+
+# Command line
+def main():
+    '''prints the approximate summary (and optionally the exact one)'''
+    import sentiment_analysis as sa
+
+    parser = argparse.ArgumentParser(
+        description='Approximate sentiment summary from a stratified '
+                    'sample of the reviews.')
+    parser.add_argument('--input', default=None,
+                        help='reviews CSV or zip file (default: the '
+                             'extracted CSV if there is one, otherwise '
+                             'the zip)')
+    parser.add_argument('--model', default='en_core_web_sm',
+                        help='spaCy model (default: %(default)s)')
+    parser.add_argument('--lemmatize', action='store_true')
+    parser.add_argument('--remove-punctuation', action='store_true')
+    parser.add_argument('--remove-stop-words', action='store_true')
+    parser.add_argument('--score-text', choices=['cleaned', 'raw'],
+                        default=sa.SCORE_TEXT)
+    parser.add_argument('--engine', choices=list(sa.SENTIMENT_ENGINES),
+                        default=sa.SENTIMENT_ENGINE)
+    parser.add_argument('--error-bound', type=float, default=ERROR_BOUND,
+                        help='stop when every percentage is within this '
+                             'many percentage points (default: '
+                             '%(default)s)')
+    parser.add_argument('--confidence', type=float, default=CONFIDENCE,
+                        help='confidence level (default: %(default)s)')
+    parser.add_argument('--round-size', type=int, default=ROUND_SIZE,
+                        help='reviews sampled per round '
+                             '(default: %(default)s)')
+    parser.add_argument('--stratify', default=STRATUM_COLUMN,
+                        help="column to stratify by, or 'none' "
+                             '(default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--compare', action='store_true',
+                        help='also score every review and check the exact '
+                             'percentages are inside the intervals')
+    args = parser.parse_args()
+
+    stratum_column = None if args.stratify == 'none' else args.stratify
+    columns = sa.REVIEW_COLUMNS + ([stratum_column] if stratum_column
+                                   else [])
+    reviews = sa.load_reviews(args.input or sa.default_reviews_file(),
+                              columns)
+    choices = {
+        "lemmatize": args.lemmatize,
+        "remove_punctuation": args.remove_punctuation,
+        "remove_stop_words": args.remove_stop_words
+    }
+    nlp = (sa.get_nlp(args.model, lemmatize=args.lemmatize)
+           if any(choices.values()) else None)
+
+    result = approximate_sentiment(
+        reviews, nlp, **choices, score_text=args.score_text,
+        engine=args.engine, error_bound=args.error_bound,
+        confidence=args.confidence, round_size=args.round_size,
+        stratum_column=stratum_column, seed=args.seed)
+    print(format_approximate_summary(result))
+    if not args.compare:
+        return
+
+    start = time.perf_counter()
+    scored = pd.concat(sa.score_review_chunks(
+        sa.read_review_chunks(args.input or sa.default_reviews_file()),
+        nlp, **choices, score_text=args.score_text, engine=args.engine))
+    elapsed = time.perf_counter() - start
+    print(f'Full run: {elapsed:.1f}s\n{sa.sentiment_analysis(scored)}')
+    counts = sa.count_ratings(scored['polarity_rating'])
+    for rating, count in zip(sa.RATINGS, counts):
+        exact = count / counts.sum() * 100 if counts.sum() else 0
+        error = abs(exact - result['percentages'][rating])
+        inside = error <= result['half_widths'][rating]
+        print(f'{rating.capitalize()}: off by {error:.2f} points - '
+              f"{'inside' if inside else 'OUTSIDE'} the interval")
+
+if __name__ == "__main__":
+    main()
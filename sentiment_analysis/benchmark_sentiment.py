@@ -0,0 +1,404 @@
+''' benchmark_sentiment.py
+Simon Kinsey
+
+Throughput benchmark for the sentiment_analysis.py preprocessing and
+scoring stage (score_reviews - the single pass version of
+load_and_preprocess_data and analyze_sentiment).
+
+Every configuration (sentiment engine, spaCy model, preprocessing
+choices, batch size and process count) is run in a fresh Python process
+on the same seeded sample of reviews, so the model load, the sentiment
+memos and the peak memory of one run cannot affect the next. The sample
+is picked once, in a process of its own, and handed to each run in a
+small JSON file - neither the runs nor the process starting them read the
+whole reviews file, so its memory is not in any run's peak (a child
+process starts with its parent's peak). For each run it records:
+    reviews_per_second - over the timed run (after a short warm up)
+    p50_ms / p99_ms - per-review latency, from the review being read by
+        the pipeline to its scores coming out (so it includes the time
+        spent waiting for the rest of its batch - score_reviews reads
+        batch_size reviews before parsing or scoring any of them)
+    peak_rss_mb - peak resident memory of the run (and of any nlp.pipe
+        worker processes)
+
+Results are appended as JSON lines to benchmark_results.jsonl with the
+git commit they were run on, so runs can be compared across commits.
+
+Usage:
+    python benchmark_sentiment.py
+    python benchmark_sentiment.py --models sm --flags none lemmatize
+                                  --batch-sizes 100 1000 --n-process 1 2
+    python benchmark_sentiment.py --engine textblob lexicon --flags none
+    python benchmark_sentiment.py --compare <commit> <commit>
+'''
+
+# Import Required Libraries
+import argparse
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+from datetime import datetime, timezone
+from itertools import product
+import numpy as np
+import sentiment_analysis as sa
+from instrumentation import peak_rss_mb
+from review_cache import library_versions
+
+# Configuration
+RESULTS_FILE_PATH = 'benchmark_results.jsonl'
+SAMPLE_SIZE = 1000
+SEED = 42
+WARMUP_REVIEWS = 50
+MODEL_NAMES = {'sm': 'en_core_web_sm', 'md': 'en_core_web_md'}
+MODELS = ['sm', 'md']
+# preprocessing choices to combine with '+', or 'none'
+FLAG_NAMES = {
+    'lemmatize': 'lemmatize',
+    'punctuation': 'remove_punctuation',
+    'stop_words': 'remove_stop_words'
+}
+FLAG_SETS = ['none', 'lemmatize', 'punctuation+stop_words',
+             'lemmatize+punctuation+stop_words']
+BATCH_SIZES = [100, 1000]
+N_PROCESSES = [1, 2]
+ENGINES = [sa.SENTIMENT_ENGINE]
+
+
+# Seeded review sample
+def sample_reviews(file_path, sample_size=SAMPLE_SIZE, seed=SEED):
+    '''returns a list of sample_size review texts picked at random (but
+       always the same ones for the same seed) from the reviews file'''
+    reviews = sa.load_reviews(file_path, sa.REVIEW_COLUMNS)
+    reviews = reviews.sample(n=min(sample_size, len(reviews)),
+                             random_state=seed)
+    return reviews['reviews.text'].tolist()
+
+def write_sample(texts, file_path):
+    '''saves the sample texts as a JSON list for the benchmark runs'''
+    with open(file_path, 'w', encoding='utf-8') as sample_file:
+        json.dump(texts, sample_file)
+
+def read_sample(file_path):
+    '''returns the sample texts saved by write_sample'''
+    with open(file_path, encoding='utf-8') as sample_file:
+        return json.load(sample_file)
+
+def sample_digest(texts):
+    '''returns a short hash of the sample, so results from different
+       samples are not compared by mistake'''
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode('utf-8') + b'\0')
+    return digest.hexdigest()[:16]
+
+# Preprocessing flags
+def parse_flags(flag_set):
+    '''turns eg "lemmatize+stop_words" into the preprocessing choices
+       dictionary used by sentiment_analysis'''
+    names = [] if flag_set == 'none' else flag_set.split('+')
+    unknown = [name for name in names if name not in FLAG_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown preprocessing flag '{unknown[0]}' - use "
+                         f"'none' or any of {', '.join(FLAG_NAMES)} "
+                         "joined with '+'.")
+    return {choice: name in names for name, choice in FLAG_NAMES.items()}
+
+# Benchmark configurations
+def benchmark_configs(models=MODELS, flag_sets=FLAG_SETS,
+                      batch_sizes=BATCH_SIZES, n_processes=N_PROCESSES,
+                      engines=ENGINES):
+    """
+    Build the grid of configurations to run.
+
+    Without any preprocessing choices the reviews are not parsed, so the
+    model makes no difference - that case is run once for each engine,
+    batch size and process count.
+    Returns:
+        list: Configuration dictionaries.
+    """
+    configs = []
+    for engine, flag_set in product(engines, flag_sets):
+        parsed = any(parse_flags(flag_set).values())
+        flag_models = ([MODEL_NAMES.get(model, model) for model in models]
+                       if parsed else [None])
+        for model, batch_size, n_process in product(flag_models, batch_sizes,
+                                                    n_processes):
+            configs.append({'engine': engine, 'model': model,
+                            'flags': flag_set,
+                            'batch_size': batch_size,
+                            'n_process': n_process})
+    return configs
+
+def config_engine(config):
+    '''returns the engine of a configuration (records from before there
+       was a choice of engine used the default)'''
+    return config.get('engine', sa.SENTIMENT_ENGINE)
+
+# Single benchmark run
+def run_config(config, texts, warmup=WARMUP_REVIEWS):
+    """
+    Time score_reviews on the sample with one configuration. Call this in
+    a fresh process (see run_in_subprocess) so the peak memory is only
+    this configuration's.
+
+    Returns:
+        dict: Timing and memory results.
+    """
+    flags = parse_flags(config['flags'])
+    options = {'engine': config_engine(config),
+               'batch_size': config['batch_size'],
+               'n_process': config['n_process']}
+
+    nlp = None
+    start = time.perf_counter()
+    if any(flags.values()):
+        nlp = sa.load_nlp(config['model'], lemmatize=flags['lemmatize'])
+    load_seconds = time.perf_counter() - start
+
+    # warm up (loading the lexicon too) then forget the warm up reviews'
+    # scores, whichever engine remembered them
+    for _ in sa.score_reviews(texts[:warmup], nlp, **flags, **options):
+        pass
+    sa.clear_sentiment_memos()
+
+    read_times = deque()
+    def timed_texts():
+        for text in texts:
+            read_times.append(time.perf_counter())
+            yield text
+
+    latencies = np.empty(len(texts))
+    start = time.perf_counter()
+    for row, _ in enumerate(sa.score_reviews(timed_texts(), nlp, **flags,
+                                             **options)):
+        latencies[row] = time.perf_counter() - read_times.popleft()
+    elapsed = time.perf_counter() - start
+
+    p50, p99 = (np.percentile(latencies, [50, 99]) * 1000
+                if len(texts) else (0.0, 0.0))
+    children = peak_rss_mb(children=True)
+    return {
+        'components': nlp.pipe_names if nlp else [],
+        'load_seconds': load_seconds,
+        'elapsed_seconds': elapsed,
+        'reviews_per_second': len(texts) / elapsed if elapsed else 0,
+        'p50_ms': float(p50),
+        'p99_ms': float(p99),
+        'peak_rss_mb': peak_rss_mb(),
+        'children_peak_rss_mb': children or None,
+    }
+
+def make_sample(args, sample_path):
+    '''picks the sample in a fresh Python process and saves it at
+       sample_path, so this process never holds the whole reviews file'''
+    command = [sys.executable, os.path.abspath(__file__),
+               '--input', args.input, '--sample-size', str(args.sample_size),
+               '--seed', str(args.seed), '--write-sample', sample_path]
+    completed = subprocess.run(command, capture_output=True, text=True,
+                               check=False)
+    if completed.returncode != 0:
+        lines = completed.stderr.strip().splitlines()
+        sys.exit(f'FAILED: could not sample {args.input}: '
+                 + (lines[-1] if lines else
+                    f'exit code {completed.returncode}'))
+
+def run_in_subprocess(config, sample_path):
+    '''runs one configuration on the sample saved at sample_path in a
+       fresh Python process and returns its results, or a dictionary
+       with the error if the run failed'''
+    command = [sys.executable, os.path.abspath(__file__),
+               '--sample-file', sample_path,
+               '--run-config', json.dumps(config)]
+    completed = subprocess.run(command, capture_output=True, text=True,
+                               check=False)
+    if completed.returncode != 0:
+        lines = completed.stderr.strip().splitlines()
+        return {'error': lines[-1] if lines else
+                f'exit code {completed.returncode}'}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+# Git commit of the code being measured
+def git_commit():
+    '''returns the current git commit (with "-dirty" if there are
+       uncommitted changes), or None outside a git checkout'''
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_dir,
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain',
+                                 '--untracked-files=no'], cwd=repo_dir,
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if status else '')
+
+# Results table
+def format_result(record):
+    '''returns one line of the results table for a benchmark record'''
+    config = record['config']
+    settings = (f"{config_engine(config):<8} "
+                f"{config['model'] or '-':<16} {config['flags']:<33} "
+                f"{config['batch_size'] or '-':>5} "
+                f"{config['n_process'] or '-':>2}")
+    if 'error' in record:
+        return f"{settings}  failed: {record['error']}"
+    peak = record['peak_rss_mb']
+    return (f"{settings} {record['reviews_per_second']:9.0f} "
+            f"{record['p50_ms']:8.2f} {record['p99_ms']:8.2f} "
+            f"{peak if peak is not None else float('nan'):8.0f}")
+
+TABLE_HEADER = (f"{'engine':<8} {'model':<16} {'preprocessing':<33} "
+                f"{'batch':>5} "
+                f"{'np':>2} {'reviews/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+                f"{'peak MB':>8}")
+
+# Compare two commits
+def compare_results(records, commit_a, commit_b):
+    """
+    Compare the throughput of each configuration run at two commits
+    (using the latest run of each). Commits can be given as prefixes.
+    Returns:
+        str: Formatted comparison table.
+    """
+    def latest(commit):
+        runs = {}
+        for record in records:
+            if ((record.get('commit') or '').startswith(commit)
+                    and 'error' not in record):
+                config = dict(record['config'],
+                              engine=config_engine(record['config']))
+                runs[json.dumps(config, sort_keys=True)] = record
+        return runs
+
+    runs_a, runs_b = latest(commit_a), latest(commit_b)
+    lines = [f"{'configuration':<70} {commit_a[:8]:>9} {commit_b[:8]:>9} "
+             f"{'change':>7}"]
+    for key in runs_a.keys() & runs_b.keys():
+        config = json.loads(key)
+        speed_a = runs_a[key]['reviews_per_second']
+        speed_b = runs_b[key]['reviews_per_second']
+        change = (speed_b / speed_a - 1) * 100 if speed_a else 0
+        name = (f"{config['engine']} {config['model'] or '-'} "
+                f"{config['flags']} "
+                f"batch={config['batch_size'] or '-'} "
+                f"n_process={config['n_process'] or '-'}")
+        lines.append(f'{name:<70} {speed_a:9.0f} {speed_b:9.0f} '
+                     f'{change:+6.1f}%')
+    if len(lines) == 1:
+        lines.append('No configurations were run at both commits.')
+    return '\n'.join(lines)
+
+def read_results(file_path):
+    '''returns the benchmark records stored in a JSON lines file'''
+    with open(file_path, encoding='utf-8') as results_file:
+        return [json.loads(line) for line in results_file if line.strip()]
+
+
+# Command line
+def parse_args(argv=None):
+    '''parses the benchmark command line arguments'''
+    parser = argparse.ArgumentParser(
+        description='Benchmark the sentiment analysis scoring stage.')
+    parser.add_argument('--input', default=None,
+                        help='reviews CSV or zip file (default: the '
+                             'extracted CSV if there is one, otherwise '
+                             'the zip)')
+    parser.add_argument('--sample-size', type=int, default=SAMPLE_SIZE,
+                        help='reviews in the sample (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=SEED,
+                        help='sample seed (default: %(default)s)')
+    parser.add_argument('--models', nargs='+', default=MODELS,
+                        help='sm, md or spaCy model names or paths '
+                             '(default: %(default)s)')
+    parser.add_argument('--flags', nargs='+', default=FLAG_SETS,
+                        help="preprocessing choices: 'none' or any of "
+                             f"{', '.join(FLAG_NAMES)} joined with '+' "
+                             '(default: %(default)s)')
+    parser.add_argument('--batch-sizes', nargs='+', type=int,
+                        default=BATCH_SIZES,
+                        help='reviews per batch (default: %(default)s)')
+    parser.add_argument('--n-process', nargs='+', type=int,
+                        default=N_PROCESSES,
+                        help='worker process counts '
+                             '(default: %(default)s)')
+    parser.add_argument('--engine', nargs='+', default=ENGINES,
+                        choices=list(sa.SENTIMENT_ENGINES),
+                        help='sentiment engines (default: %(default)s)')
+    parser.add_argument('--output', default=RESULTS_FILE_PATH,
+                        help='JSON lines file the results are appended to '
+                             '(default: %(default)s)')
+    parser.add_argument('--compare', nargs=2, metavar='COMMIT',
+                        help='compare the stored results of two commits '
+                             'instead of running the benchmark')
+    parser.add_argument('--run-config', help=argparse.SUPPRESS)
+    parser.add_argument('--sample-file', help=argparse.SUPPRESS)
+    parser.add_argument('--write-sample', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def run_benchmark(args, sample_path):
+    '''runs every configuration on the saved sample, printing the results
+       table and appending the records to the output file'''
+    texts = read_sample(sample_path)
+    run_info = {
+        'commit': git_commit(),
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'versions': library_versions(),
+        'input': args.input,
+        'sample_size': len(texts),
+        'seed': args.seed,
+        'sample': sample_digest(texts),
+    }
+    print(f"Benchmarking on {len(texts)} reviews from {args.input} "
+          f"(seed {args.seed}) at commit {run_info['commit']}\n")
+    print(TABLE_HEADER)
+    with open(args.output, 'a', encoding='utf-8') as results_file:
+        for config in benchmark_configs(args.models, args.flags,
+                                        args.batch_sizes, args.n_process,
+                                        args.engine):
+            record = dict(run_info, config=config,
+                          **run_in_subprocess(config, sample_path))
+            results_file.write(json.dumps(record) + '\n')
+            results_file.flush()
+            print(format_result(record))
+
+def main():
+    '''runs the benchmark grid (or a single configuration, or compares
+       stored results)'''
+    args = parse_args()
+    if args.compare:
+        print(compare_results(read_results(args.output), *args.compare))
+        return
+
+    if args.run_config:
+        # a single configuration in its own process - see run_in_subprocess
+        texts = read_sample(args.sample_file)
+        print(json.dumps(run_config(json.loads(args.run_config), texts)))
+        return
+
+    args.input = args.input or sa.default_reviews_file()
+    if args.write_sample:
+        # picking the sample in its own process - see make_sample
+        write_sample(sample_reviews(args.input, args.sample_size, args.seed),
+                     args.write_sample)
+        return
+
+    for flag_set in args.flags:
+        parse_flags(flag_set)
+    with tempfile.TemporaryDirectory() as sample_dir:
+        sample_path = os.path.join(sample_dir, 'sample.json')
+        make_sample(args, sample_path)
+        run_benchmark(args, sample_path)
+    print(f'\nResults appended to {args.output}')
+
+if __name__ == "__main__":
+    main()
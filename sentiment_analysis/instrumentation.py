@@ -0,0 +1,269 @@
+''' instrumentation.py
+Simon Kinsey
+
+Opt-in timing and memory instrumentation for sentiment_analysis.py, to
+show which stage of a run the time goes to.
+
+Each stage records its number of calls, items processed, wall time, CPU
+time and the memory high-water mark reached by the end of the stage.
+Stages are meant to be coarse (a chunk or batch of reviews, not each
+review) as every call samples the process memory.
+Stages can be nested (eg spaCy parsing inside scoring) - "self" times
+leave out the time spent in nested stages. A cProfile of the hot loop
+can be sampled every N chunks.
+
+A disabled Instrumentation does nothing, so code can always be written
+as though it is on:
+
+    instrumentation = Instrumentation(enabled=False)
+    with instrumentation.stage('load', items=n):
+        ...
+'''
+
+# Import Required Libraries
+import cProfile
+import io
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows - the RSS high-water mark is not recorded
+    resource = None
+
+# Configuration
+PROFILE_LINES = 20
+
+
+# Process memory high-water mark
+def peak_rss_mb(children=False):
+    '''returns the peak resident memory of this process so far in MB (or
+       with children=True the largest of its finished child processes),
+       or None if it cannot be measured'''
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children
+                               else resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return usage.ru_maxrss / scale
+
+
+class Instrumentation:
+    '''
+    Collects per-stage timings for one run.
+    enabled - if False every method is a no-op
+    trace_memory - also record the peak Python allocations of each stage
+        with tracemalloc (accurate but slows the run down noticeably)
+    profile_every - sample a cProfile of every Nth item of the iterables
+        passed to profile (0 to never profile)
+    '''
+
+    def __init__(self, enabled=True, trace_memory=False, profile_every=0):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.profile_every = profile_every if enabled else 0
+        self.profiler = cProfile.Profile() if self.profile_every else None
+        self.profiled_items = 0
+        self.stages = {}
+        self._stack = []
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    # Stage timing
+    def _enter(self):
+        '''starts timing a stage and returns its frame'''
+        frame = {'wall': time.perf_counter(), 'cpu': time.process_time(),
+                 'child_wall': 0.0, 'child_cpu': 0.0, 'traced_peak': 0}
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                # keep the parent's peak before starting a new one
+                parent = self._stack[-1]
+                parent['traced_peak'] = max(parent['traced_peak'], peak)
+            tracemalloc.reset_peak()
+            frame['traced_peak'] = current
+        self._stack.append(frame)
+        return frame
+
+    def _exit(self, name, items):
+        '''stops timing the current stage and adds it to the totals'''
+        frame = self._stack.pop()
+        wall = time.perf_counter() - frame['wall']
+        cpu = time.process_time() - frame['cpu']
+        if self._stack:
+            self._stack[-1]['child_wall'] += wall
+            self._stack[-1]['child_cpu'] += cpu
+
+        totals = self.stages.get(name)
+        if totals is None:
+            totals = self.stages[name] = {
+                'calls': 0, 'items': 0, 'wall_seconds': 0.0,
+                'self_wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                'self_cpu_seconds': 0.0, 'peak_rss_mb': None,
+                'peak_traced_mb': None}
+        totals['calls'] += 1
+        totals['items'] += items if items is not None else 1
+        totals['wall_seconds'] += wall
+        totals['self_wall_seconds'] += wall - frame['child_wall']
+        totals['cpu_seconds'] += cpu
+        totals['self_cpu_seconds'] += cpu - frame['child_cpu']
+        rss = peak_rss_mb()
+        if rss is not None:
+            totals['peak_rss_mb'] = max(totals['peak_rss_mb'] or 0, rss)
+        if self.trace_memory:
+            peak = max(frame['traced_peak'],
+                       tracemalloc.get_traced_memory()[1])
+            if self._stack:
+                parent = self._stack[-1]
+                parent['traced_peak'] = max(parent['traced_peak'], peak)
+            totals['peak_traced_mb'] = max(totals['peak_traced_mb'] or 0,
+                                           peak / (1024 * 1024))
+
+    def stage(self, name, items=None):
+        """
+        Context manager timing one call of a stage. Yields a dictionary -
+        set its 'items' if the number of items is only known at the end.
+        Example:
+            with instrumentation.stage('score') as stage:
+                stage['items'] = len(reviews)
+        """
+        if not self.enabled:
+            return nullcontext({'items': items})
+        return self._stage(name, items)
+
+    @contextmanager
+    def _stage(self, name, items):
+        record = {'items': items}
+        self._enter()
+        try:
+            yield record
+        finally:
+            self._exit(name, record['items'])
+
+    def iterate(self, name, iterable, size=None):
+        '''wraps an iterable so the time taken to produce each item is
+           recorded as a call of stage name - size(item) gives the number
+           of items it counts as (eg len for chunks of reviews)'''
+        if not self.enabled:
+            return iterable
+        return self._iterate(name, iterable, size)
+
+    def _iterate(self, name, iterable, size):
+        iterator = iter(iterable)
+        while True:
+            self._enter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                # the time spent finding out there is nothing left
+                self._exit(name, 0)
+                self.stages[name]['calls'] -= 1
+                return
+            except BaseException:
+                self._exit(name, 0)
+                raise
+            self._exit(name, size(item) if size else 1)
+            yield item
+
+    # Sampled profiling
+    def profile(self, iterable):
+        '''wraps the iterable of the hot loop so producing every
+           profile_every-th item (starting with the first) is profiled'''
+        if not self.profile_every:
+            return iterable
+        return self._profile(iterable)
+
+    def _profile(self, iterable):
+        iterator = iter(iterable)
+        count = 0
+        while True:
+            sampled = count % self.profile_every == 0
+            if sampled:
+                self.profiler.enable()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                if sampled:
+                    self.profiler.disable()
+            if sampled:
+                self.profiled_items += 1
+            count += 1
+            yield item
+
+    # Reports
+    def trace(self):
+        '''returns the recorded stages as a JSON serialisable dictionary'''
+        stages = []
+        for name, totals in self.stages.items():
+            wall = totals['wall_seconds']
+            stages.append(dict(
+                {'stage': name}, **totals,
+                items_per_second=totals['items'] / wall if wall else None))
+        return {
+            'wall_seconds': time.perf_counter() - self._start_wall,
+            'cpu_seconds': time.process_time() - self._start_cpu,
+            'peak_rss_mb': peak_rss_mb(),
+            'profiled_items': self.profiled_items,
+            'stages': stages,
+        }
+
+    def write_trace(self, file_path):
+        '''writes the trace (see trace) to a JSON file'''
+        with open(file_path, 'w', encoding='utf-8') as trace_file:
+            json.dump(self.trace(), trace_file, indent=2)
+
+    def summary_table(self):
+        '''
+        Per-stage totals as a table - nested stages are included in the
+        times of the stages around them, the self columns leave them out
+        Returns - formatted string for simple print
+        '''
+        trace = self.trace()
+        lines = [f"{'stage':<24} {'calls':>7} {'items':>8} {'wall s':>8} "
+                 f"{'self s':>8} {'cpu s':>8} {'self cpu':>8} "
+                 f"{'items/s':>9} {'peak MB':>8}"]
+        for stage in trace['stages']:
+            rate = stage['items_per_second']
+            peak = stage['peak_traced_mb' if self.trace_memory
+                         else 'peak_rss_mb']
+            lines.append(
+                f"{stage['stage']:<24} {stage['calls']:>7} "
+                f"{stage['items']:>8} {stage['wall_seconds']:>8.2f} "
+                f"{stage['self_wall_seconds']:>8.2f} "
+                f"{stage['cpu_seconds']:>8.2f} "
+                f"{stage['self_cpu_seconds']:>8.2f} "
+                f"{rate if rate is not None else 0:>9.0f} "
+                f"{peak if peak is not None else float('nan'):>8.0f}")
+        memory = ('the peak traced Python memory during the stage'
+                  if self.trace_memory
+                  else 'the process peak RSS by the end of the stage')
+        lines.append(f"Total {trace['wall_seconds']:.2f}s wall, "
+                     f"{trace['cpu_seconds']:.2f}s CPU (this process only) "
+                     f"- peak MB is {memory}")
+        return '\n'.join(lines) + '\n'
+
+    def write_profile(self, file_path):
+        '''saves the sampled profile for pstats / snakeviz'''
+        if self.profiler is not None:
+            self.profiler.dump_stats(file_path)
+
+    def profile_summary(self, lines=PROFILE_LINES):
+        '''returns the functions with the highest cumulative time in the
+           sampled profile as a string'''
+        if self.profiler is None or not self.profiled_items:
+            return 'Nothing was profiled.\n'
+        output = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=output)
+        stats.sort_stats('cumulative').print_stats(lines)
+        return (f'Profile of {self.profiled_items} sampled chunks (every '
+                f'{self.profile_every}):\n{output.getvalue()}')
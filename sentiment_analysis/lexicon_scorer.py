@@ -0,0 +1,372 @@
+''' lexicon_scorer.py
+Simon Kinsey
+
+Fast polarity / subjectivity scoring without spaCy.
+
+spacytextblob just runs TextBlob's pattern sentiment on doc.text: the
+text is split into tokens and each word found in TextBlob's sentiment
+lexicon (en-sentiment.xml) is scored, with the rules for modifiers
+("very good"), negation ("not good"), exclamation marks, "(!)" sarcasm
+and emoticons applied. This module applies the same lexicon and rules
+directly:
+    - the lexicon, the set of modifier words and the emoticons are read
+      from TextBlob once into plain dictionaries, rather than going
+      through TextBlob's lazily loaded dictionary on every lookup
+    - tokens are split with the same rules as TextBlob's tokenizer, but
+      words with no punctuation to split off skip the per-character work
+    - texts where a sarcasm "(!)" or emoticon could be re-joined (which
+      TextBlob does sentence by sentence) fall back to TextBlob's own
+      tokenizer so the result stays the same
+
+The tokenizer rules and emoticons are only available from TextBlob's
+private _text module, so the scorer is pinned to the TextBlob versions in
+TEXTBLOB_VERSIONS - score_reviews refuses the lexicon engine with any
+other version. --check compares the scores with TextBlob itself on
+PARITY_TEXTS (every rule above) and fails if any differ; run it before
+adding a new version. check_parity compares the scores, ratings and
+speed with the spaCy path (analyze_sentiment) over the reviews.
+
+Usage:
+    python lexicon_scorer.py --check
+    python lexicon_scorer.py --model en_core_web_sm
+'''
+
+# Import Required Libraries
+import argparse
+import re
+import sys
+import time
+from functools import lru_cache
+import textblob
+from textblob import TextBlob
+from textblob.en import sentiment as pattern_sentiment
+# private to TextBlob - see TEXTBLOB_VERSIONS
+from textblob._text import (ABBREVIATIONS, EMOTICONS, EOS, PUNCTUATION,
+                            RE_ABBR1, RE_ABBR2, RE_ABBR3, RE_EMOTICONS,
+                            RE_SARCASM, replacements as CONTRACTIONS)
+from textblob.en import parser as pattern_parser
+
+# Configuration
+# TextBlob versions the scores have been checked against (--check)
+TEXTBLOB_VERSIONS = ('0.15.3',)
+# texts covering each rule and tokenizer case, for --check
+PARITY_TEXTS = [
+    '', 'ok', 'Good.', 'good', 'very good', 'not good', 'not a good idea',
+    'not bad at all', 'really not good', 'never very happy',
+    "I don't like it", "it isn't great", "it's the best, isn't it?",
+    'Great!', 'great!!!', 'terrible !', 'awful!!! really awful...',
+    'so good (!)', 'fine ( ! ) i guess', 'love it :)', 'hate it :-(',
+    'meh :/', 'cool ;-) but slow :(', '"Amazing" product', '“nice” one',
+    'works well e.g. for reading.', 'Mr. Smith was pleased',
+    'U.S.A. made and happy', 'ok...fine', 'first line\n\nsecond happy line',
+    'GREAT VALUE', 'Happy happy joy joy', '(great) [bad] {ok}',
+    "the kids' tablet is extremely durable", 'not the worst, not the best',
+    'absolutely fantastic, highly recommended!',
+    'a bit slow but otherwise excellent', 'easy to use; easy to set up',
+    'very a good day', 'very big good day', 'extremely the best',
+]
+# punctuation split off the start of a token (periods are handled at the
+# end of a token, where abbreviations like "e.g." keep theirs)
+LEADING_PUNCTUATION = PUNCTUATION.replace('.', '')
+# tuples for str.startswith / str.endswith
+LEADING_MARKS = tuple(LEADING_PUNCTUATION)
+TRAILING_MARKS = LEADING_MARKS + ('.',)
+QUOTES = ['“', '”', '‘', '’', "'", '"']
+LINE_BREAKS = re.compile(r'\n{2,}')
+
+
+# Precomputed lexicon
+@lru_cache(maxsize=None)
+def load_lexicon():
+    """
+    Read TextBlob's sentiment lexicon into plain dictionaries.
+    Returns:
+        tuple: (words, modifiers, negations, emoticons, special) - words
+        maps each word to its (polarity, subjectivity, intensity),
+        modifiers is the set of words that can modify the next word
+        (adverbs), negations the negation words, emoticons maps each
+        emoticon to its polarity and special is the set of words not in
+        the lexicon that still affect the scores.
+    """
+    pattern_sentiment.load()
+    words = {}
+    modifiers = set()
+    for word, tags in dict.items(pattern_sentiment):
+        # TextBlob scores plain text without part-of-speech tags, which
+        # uses the scores averaged over all tags
+        words[word] = tuple(tags[None])
+        if any(tag in tags for tag in pattern_sentiment.modifiers):
+            modifiers.add(word)
+    emoticons = {}
+    for (_, polarity), faces in EMOTICONS.items():
+        for face in faces:
+            face = face.lower()
+            # only punctuation-like tokens are checked for emoticons
+            if (not face.isalpha() and len(face) <= 5
+                    and face not in PUNCTUATION):
+                emoticons.setdefault(face, polarity)
+    negations = frozenset(pattern_sentiment.negations)
+    # unknown words that still change the scores
+    special = negations | {'!', '(!)'} | emoticons.keys()
+    return words, frozenset(modifiers), negations, emoticons, special
+
+# Tokenizer
+def tokenize(text):
+    '''returns the list of tokens TextBlob's tokenizer splits text into
+       (before lowercasing)'''
+    original = text
+    if "'" in text:
+        for contraction, spaced in CONTRACTIONS.items():
+            text = text.replace(contraction, spaced)
+    for quote in QUOTES:
+        if quote in text:
+            text = text.replace(quote, f' {quote} ')
+    if '\n' in text:
+        text = LINE_BREAKS.sub(f' {EOS} ', text.replace('\r\n', '\n'))
+
+    tokens = []
+    for token in text.split():
+        if (token[0] not in LEADING_PUNCTUATION
+                and token[-1] not in PUNCTUATION):
+            tokens.append(token)
+            continue
+        tail = []
+        while token.startswith(LEADING_MARKS):
+            tokens.append(token[0])
+            token = token[1:]
+        while token.endswith(TRAILING_MARKS):
+            if token.endswith(LEADING_MARKS):
+                tail.append(token[-1])
+                token = token[:-1]
+            if token.endswith('...'):
+                tail.append('...')
+                token = token[:-3].rstrip('.')
+            if token.endswith('.'):
+                if (token in ABBREVIATIONS or RE_ABBR1.match(token)
+                        or RE_ABBR2.match(token) or RE_ABBR3.match(token)):
+                    break
+                tail.append(token[-1])
+                token = token[:-1]
+        if token:
+            tokens.append(token)
+        tokens.extend(reversed(tail))
+    # sentence breaks only matter for joining "( ! )" and emoticons
+    tokens = [token for token in tokens if token != EOS]
+
+    joined = ' '.join(tokens)
+    if RE_SARCASM.search(joined) or RE_EMOTICONS.search(joined):
+        # joined sentence by sentence - leave these to TextBlob
+        return ' '.join(pattern_parser.find_tokens(original)).split()
+    return tokens
+
+# Sentiment of a text
+def sentiment(text):
+    """
+    Score text the same way as TextBlob(text).sentiment (and so
+    spacytextblob's doc._.polarity and doc._.subjectivity).
+    Returns:
+        tuple: (polarity, subjectivity)
+    """
+    words, modifiers, negations, emoticons, special = load_lexicon()
+    # [polarity, subjectivity, intensity, negated] of each scored word
+    assessments = []
+    modifier = None
+    negation = None
+    for word in tokenize(text):
+        word = word.lower()
+        scores = words.get(word)
+        if scores is not None:
+            polarity, subjectivity, intensity = scores
+            if modifier is None:
+                assessments.append([polarity, subjectivity, intensity, False])
+            else:
+                # "very good" - the modifier's intensity scales this word
+                last = assessments[-1]
+                last[0] = max(-1.0, min(polarity * last[2], 1.0))
+                last[1] = max(-1.0, min(subjectivity * last[2], 1.0))
+                last[2] = intensity
+            if negation is not None:
+                assessments[-1][2] = 1.0 / assessments[-1][2]
+                assessments[-1][3] = True
+            modifier = word if word in modifiers else None
+            negation = word if word in negations else None
+            continue
+
+        if modifier is None and negation is None and word not in special:
+            # most words - nothing to score and no rule to apply
+            continue
+        if word in negations:
+            negation = word
+        elif negation and len(word.strip("'")) > 1:
+            # negation carries across short words ("not a good")
+            negation = None
+        if (negation is not None and modifier is not None
+                and modifier.endswith('ly')):
+            # "really not good"
+            assessments[-1][3] = True
+            negation = None
+        elif modifier and len(word) > 2:
+            modifier = None
+        if word == '!' and assessments:
+            assessments[-1][0] = max(-1.0, min(assessments[-1][0] * 1.25,
+                                               1.0))
+        if word == '(!)':
+            assessments.append([0.0, 1.0, 1.0, False])
+        if word in emoticons:
+            assessments.append([emoticons[word], 1.0, 1.0, False])
+
+    if not assessments:
+        return 0.0, 0.0
+    # "not good" is slightly bad and "not bad" slightly good
+    polarity = sum(scores[0] * -0.5 if scores[3] else scores[0]
+                   for scores in assessments)
+    subjectivity = sum(scores[1] for scores in assessments)
+    return (polarity / float(len(assessments)),
+            subjectivity / float(len(assessments)))
+
+
+# TextBlob version check
+def require_checked_textblob():
+    '''raises ImportError if the installed TextBlob is not one the scorer
+       has been checked against'''
+    if textblob.__version__ not in TEXTBLOB_VERSIONS:
+        raise ImportError(
+            f'The lexicon scorer has not been checked against TextBlob '
+            f'{textblob.__version__} (only '
+            f"{', '.join(TEXTBLOB_VERSIONS)}) - run python "
+            'lexicon_scorer.py --check and add it to TEXTBLOB_VERSIONS if '
+            "it passes, or use the 'textblob' engine.")
+
+# Parity with TextBlob
+def check_textblob_parity(texts=None, tolerance=1e-12):
+    '''compares sentiment with TextBlob(text).sentiment on texts (default
+       PARITY_TEXTS, as written and lowercased)
+       Returns - list of (text, TextBlob scores, lexicon scores) for the
+       texts that do not match (empty if they all do)'''
+    if texts is None:
+        texts = PARITY_TEXTS + [text.lower() for text in PARITY_TEXTS]
+    mismatches = []
+    for text in texts:
+        expected = tuple(TextBlob(text).sentiment)
+        actual = sentiment(text)
+        if max(abs(a - b) for a, b in zip(expected, actual)) > tolerance:
+            mismatches.append((text, expected, actual))
+    return mismatches
+
+# Parity with the spaCy path
+def check_parity(texts, nlp, tolerance=1e-12):
+    """
+    Score texts with both sentiment and analyze_sentiment (spaCy with
+    spacytextblob) and compare them.
+
+    Parameters:
+        texts (list of str): Texts to compare (eg the lowercased reviews
+            score_reviews scores).
+        nlp (spacy.lang): spaCy model with spacytextblob.
+        tolerance (float): Largest score difference counted as the same.
+    Returns:
+        dict: Number of texts, score and rating agreement, the largest
+        differences, the speed of each path and the first few texts that
+        do not match.
+    """
+    import sentiment_analysis as sa
+
+    start = time.perf_counter()
+    expected = [(doc._.polarity, doc._.subjectivity)
+                for doc in nlp.pipe(texts, batch_size=sa.BATCH_SIZE)]
+    spacy_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = [sentiment(text) for text in texts]
+    lexicon_seconds = time.perf_counter() - start
+
+    same_scores = same_ratings = 0
+    largest = [0.0, 0.0]
+    mismatches = []
+    for text, spacy_scores, lexicon_scores in zip(texts, expected, actual):
+        differences = [abs(a - b) for a, b in zip(spacy_scores,
+                                                   lexicon_scores)]
+        largest = [max(pair) for pair in zip(largest, differences)]
+        if max(differences) <= tolerance:
+            same_scores += 1
+        elif len(mismatches) < 5:
+            mismatches.append((text, spacy_scores, lexicon_scores))
+        if (sa.rate_polarity(spacy_scores[0])
+                == sa.rate_polarity(lexicon_scores[0])):
+            same_ratings += 1
+    count = len(texts)
+    return {
+        'texts': count,
+        'score_agreement': same_scores / count if count else 1.0,
+        'rating_agreement': same_ratings / count if count else 1.0,
+        'max_polarity_difference': largest[0],
+        'max_subjectivity_difference': largest[1],
+        'spacy_texts_per_second': count / spacy_seconds if spacy_seconds
+                                  else None,
+        'lexicon_texts_per_second': count / lexicon_seconds
+                                    if lexicon_seconds else None,
+        'mismatches': mismatches,
+    }
+
+
+# Command line
+def main():
+    '''checks the lexicon scorer against the spaCy path on the reviews'''
+    import sentiment_analysis as sa
+
+    parser = argparse.ArgumentParser(
+        description='Compare the lexicon scorer with analyze_sentiment.')
+    parser.add_argument('--input', default=None,
+                        help='reviews CSV or zip file (default: the '
+                             'extracted CSV if there is one, otherwise '
+                             'the zip)')
+    parser.add_argument('--model', default='en_core_web_sm',
+                        help='spaCy model (default: %(default)s)')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='only check the first LIMIT reviews')
+    parser.add_argument('--original-case', action='store_true',
+                        help='score the reviews as written instead of '
+                             'lowercased (as score_reviews does)')
+    parser.add_argument('--check', action='store_true',
+                        help='only compare the scores with TextBlob on '
+                             'PARITY_TEXTS (no spaCy model needed)')
+    args = parser.parse_args()
+
+    if args.check:
+        mismatches = check_textblob_parity()
+        for text, expected, actual in mismatches:
+            print(f'Different scores: "{text}"\n'
+                  f'    TextBlob {expected}, lexicon {actual}')
+        if mismatches:
+            sys.exit(f'FAILED: {len(mismatches)} texts score differently '
+                     f'with TextBlob {textblob.__version__}.')
+        print(f'OK - {2 * len(PARITY_TEXTS)} texts score the same as '
+              f'TextBlob {textblob.__version__}.')
+        return
+    require_checked_textblob()
+
+    reviews = sa.load_reviews(args.input or sa.default_reviews_file(),
+                              sa.REVIEW_COLUMNS)['reviews.text']
+    if args.limit:
+        reviews = reviews.head(args.limit)
+    if not args.original_case:
+        reviews = reviews.str.lower().str.strip()
+    nlp = sa.get_nlp(args.model, sentiment=True)
+    # load the lexicon before timing
+    sentiment('')
+    results = check_parity(reviews.tolist(), nlp)
+
+    print(f"Checked {results['texts']} reviews:")
+    print(f"Same scores: {results['score_agreement'] * 100:.2f}%")
+    print(f"Same ratings: {results['rating_agreement'] * 100:.2f}%")
+    print(f"Largest differences: polarity "
+          f"{results['max_polarity_difference']:.2e}, subjectivity "
+          f"{results['max_subjectivity_difference']:.2e}")
+    print(f"spaCy path: {results['spacy_texts_per_second']:.0f} reviews/s,"
+          f" lexicon scorer: {results['lexicon_texts_per_second']:.0f} "
+          'reviews/s')
+    for text, spacy_scores, lexicon_scores in results['mismatches']:
+        print(f'\nDifferent scores: "{text}"\n'
+              f'    spaCy {spacy_scores}, lexicon {lexicon_scores}')
+
+if __name__ == "__main__":
+    main()
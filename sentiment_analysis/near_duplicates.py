@@ -0,0 +1,256 @@
+''' near_duplicates.py
+Simon Kinsey
+
+Finds reviews that are near-duplicates of each other (eg only differing
+in punctuation or a word or two) so they can be dropped, or scored once
+per cluster, before the sentiment analysis.
+
+Each review is lowercased, stripped of punctuation and split into
+overlapping character shingles. A MinHash signature of the shingles
+estimates the Jaccard similarity of two reviews, and LSH banding (reviews
+whose signatures match on every row of any band become candidates) means
+only candidate pairs are compared rather than every pair of reviews.
+
+The signature's hash functions are multiply-add-shift hashes of the 64
+bit shingle hashes - (a * x + b) mod 2**64 with a odd, keeping the top 32
+bits - which numpy's uint64 arithmetic (wrapping at 2**64) gives
+directly.
+
+Usage:
+    python near_duplicates.py --threshold 0.8
+'''
+
+# Import Required Libraries
+import argparse
+import re
+import numpy as np
+import pandas as pd
+
+# Configuration
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+# 16 bands of 8 rows - pairs with a Jaccard similarity of about
+# (1/16)**(1/8) = 0.71 or more are likely to become candidates
+BANDS = 16
+THRESHOLD = 0.8
+SEED = 1
+MAX_HASH = np.uint64((1 << 32) - 1)
+HASH_SHIFT = np.uint64(32)
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+
+# Text normalisation
+def normalize_text(text):
+    '''lowercases text and removes punctuation and extra whitespace'''
+    return ' '.join(PUNCTUATION.sub('', text.lower()).split())
+
+# Shingle hashes
+def shingle_hashes(text, shingle_size=SHINGLE_SIZE):
+    """
+    Hash every run of shingle_size bytes of the normalised text.
+    Returns:
+        numpy.ndarray: Unique uint64 shingle hashes (texts shorter than
+        shingle_size are a single shingle, empty texts have none).
+    """
+    data = np.frombuffer(normalize_text(text).encode('utf-8'), dtype=np.uint8)
+    if len(data) == 0:
+        return np.empty(0, dtype=np.uint64)
+    if len(data) < shingle_size:
+        data = np.pad(data, (0, shingle_size - len(data)))
+    windows = np.lib.stride_tricks.sliding_window_view(data, shingle_size)
+    # polynomial hash of each window (wrapping around at 2**64)
+    powers = np.uint64(257) ** np.arange(shingle_size, dtype=np.uint64)
+    return np.unique((windows.astype(np.uint64) * powers).sum(axis=1))
+
+# MinHash signatures
+def minhash_signatures(texts, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE,
+                       seed=SEED):
+    """
+    Compute a MinHash signature for each text.
+
+    Parameters:
+        texts (iterable of str): Review texts.
+        num_perm (int): Number of hash functions (signature length).
+        shingle_size (int): Shingle length in bytes.
+        seed (int): Seed for the hash functions - signatures are only
+            comparable if they were made with the same seed.
+    Returns:
+        numpy.ndarray: (texts x num_perm) uint32 signatures.
+    """
+    rng = np.random.default_rng(seed)
+    # multiply-add-shift hash functions - a must be odd
+    a = rng.integers(0, np.iinfo(np.uint64).max, num_perm, dtype=np.uint64,
+                     endpoint=True) | np.uint64(1)
+    b = rng.integers(0, np.iinfo(np.uint64).max, num_perm, dtype=np.uint64,
+                     endpoint=True)
+    signatures = []
+    for text in texts:
+        hashes = shingle_hashes(text, shingle_size)
+        if len(hashes) == 0:
+            signatures.append(np.full(num_perm, MAX_HASH, dtype=np.uint32))
+            continue
+        # the products wrap at 2**64 - the top 32 bits are the hash
+        permuted = (np.outer(hashes, a) + b) >> HASH_SHIFT
+        signatures.append(permuted.min(axis=0).astype(np.uint32))
+    if not signatures:
+        return np.empty((0, num_perm), dtype=np.uint32)
+    return np.vstack(signatures)
+
+# LSH candidate groups
+def lsh_buckets(signatures, bands=BANDS):
+    """
+    Group reviews whose signatures match on every row of a band.
+    Yields:
+        numpy.ndarray: Row positions of each bucket with two or more
+        reviews, for every band.
+    """
+    rows_per_band = signatures.shape[1] // bands
+    if rows_per_band == 0:
+        raise ValueError('More bands than signature rows.')
+    for band in range(bands):
+        band_rows = signatures[:, band * rows_per_band:
+                               (band + 1) * rows_per_band]
+        _, bucket_ids = np.unique(band_rows, axis=0, return_inverse=True)
+        bucket_ids = bucket_ids.ravel()
+        order = np.argsort(bucket_ids, kind='stable')
+        boundaries = np.flatnonzero(np.diff(bucket_ids[order])) + 1
+        for bucket in np.split(order, boundaries):
+            if len(bucket) > 1:
+                yield bucket
+
+# Clustering
+def _find(parents, row):
+    '''returns the root of row in the union-find parents array'''
+    while parents[row] != row:
+        parents[row] = parents[parents[row]]
+        row = parents[row]
+    return row
+
+def cluster_signatures(signatures, threshold=THRESHOLD, bands=BANDS):
+    """
+    Cluster reviews whose estimated Jaccard similarity (the share of
+    matching signature values) is at least threshold with another review
+    in the cluster.
+
+    Each LSH bucket is checked against one representative at a time
+    rather than pair by pair, so buckets of many exact copies stay cheap.
+    Returns:
+        numpy.ndarray: For each row, the position of the first row of its
+        cluster (rows that are not near-duplicates point to themselves).
+    """
+    parents = np.arange(len(signatures))
+    for bucket in lsh_buckets(signatures, bands):
+        remaining = bucket
+        while len(remaining) > 1:
+            representative = remaining[0]
+            similarity = (signatures[remaining[1:]]
+                          == signatures[representative]).mean(axis=1)
+            similar = similarity >= threshold
+            for row in remaining[1:][similar]:
+                root_a = _find(parents, representative)
+                root_b = _find(parents, row)
+                if root_a != root_b:
+                    parents[max(root_a, root_b)] = min(root_a, root_b)
+            remaining = remaining[1:][~similar]
+    return np.array([_find(parents, row) for row in range(len(parents))],
+                    dtype=np.int64)
+
+def near_duplicate_clusters(reviews, column='cleaned_reviews',
+                            threshold=THRESHOLD, num_perm=NUM_PERM,
+                            bands=BANDS, shingle_size=SHINGLE_SIZE):
+    """
+    Cluster near-duplicate reviews, eg from load_and_preprocess_data.
+
+    Returns:
+        pandas.Series: For each review (same index as reviews) the index
+        label of the first review in its cluster.
+    """
+    signatures = minhash_signatures(reviews[column], num_perm, shingle_size)
+    clusters = cluster_signatures(signatures, threshold, bands)
+    return pd.Series(reviews.index[clusters], index=reviews.index,
+                     name='near_duplicate_of')
+
+def near_duplicate_keep_mask(chunks, column='reviews.text',
+                             threshold=THRESHOLD, num_perm=NUM_PERM,
+                             bands=BANDS, shingle_size=SHINGLE_SIZE):
+    """
+    Find the reviews to keep when dropping near-duplicates from a stream
+    of chunks (eg from read_review_chunks), holding only the signatures
+    in memory rather than the review text.
+    Returns:
+        numpy.ndarray: Boolean keep flag for each row, in stream order -
+        True for the first review of each cluster.
+    """
+    signatures = [minhash_signatures(chunk[column], num_perm, shingle_size)
+                  for chunk in chunks]
+    signatures = (np.vstack(signatures) if signatures
+                  else np.empty((0, num_perm), dtype=np.uint32))
+    clusters = cluster_signatures(signatures, threshold, bands)
+    return clusters == np.arange(len(clusters))
+
+def drop_near_duplicates(reviews, column='cleaned_reviews', **options):
+    '''returns reviews with only the first review of each near-duplicate
+       cluster kept (options are passed to near_duplicate_clusters)'''
+    clusters = near_duplicate_clusters(reviews, column, **options)
+    return reviews[clusters.index == clusters.to_numpy()]
+
+def broadcast_cluster_results(results, clusters):
+    """
+    Copy results worked out for the first review of each cluster (eg the
+    scores of drop_near_duplicates(reviews)) back to every review.
+
+    Parameters:
+        results (pandas.DataFrame): Results indexed by the first review.
+        clusters (pandas.Series): From near_duplicate_clusters.
+    Returns:
+        pandas.DataFrame: Results for every review in clusters.
+    """
+    return results.loc[clusters.to_numpy()].set_axis(clusters.index)
+
+# Cluster summary
+def cluster_summary(clusters):
+    '''
+    Describe how many reviews are near-duplicates
+    Returns - formatted string for simple print
+    '''
+    sizes = clusters.value_counts()
+    duplicates = int((sizes - 1).sum())
+    total = len(clusters)
+    return (f'{total} reviews in {len(sizes)} clusters - '
+            f'{duplicates} near-duplicates '
+            f'({duplicates / total * 100 if total else 0:.2f}%), '
+            f'largest cluster {sizes.max() if total else 0} reviews\n')
+
+
+# Command line
+def main():
+    '''report the near-duplicate clusters in the reviews file'''
+    import sentiment_analysis as sa
+
+    parser = argparse.ArgumentParser(
+        description='Find near-duplicate reviews with MinHash and LSH.')
+    parser.add_argument('--input', default=None,
+                        help='reviews CSV or zip file (default: the '
+                             'extracted CSV if there is one, otherwise '
+                             'the zip)')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='minimum Jaccard similarity '
+                             '(default: %(default)s)')
+    parser.add_argument('--examples', type=int, default=5,
+                        help='number of the largest clusters to show')
+    args = parser.parse_args()
+
+    reviews = sa.load_reviews(args.input or sa.default_reviews_file())
+    clusters = near_duplicate_clusters(reviews, 'reviews.text',
+                                       threshold=args.threshold)
+    print(cluster_summary(clusters))
+    sizes = clusters.value_counts()
+    for first, size in sizes[sizes > 1].head(args.examples).items():
+        members = clusters.index[clusters == first]
+        print(f'{size} reviews like review {first}:')
+        for row in members[:3]:
+            print(f'    {row}: "{reviews.at[row, "reviews.text"]}"')
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+''' product_sentiment.py
+Simon Kinsey
+
+Sentiment summary of each product, rather than one summary of every
+review.
+
+The product columns are read alongside the review text and each scored
+chunk is reduced to a small partial aggregate per product (number of
+reviews, sums of the scores and a count of each rating). Partial
+aggregates just add up, so they are merged as the chunks stream past (or
+from separate runs / worker processes) and only one row per product is
+held in memory however many reviews there are. The means and rating
+shares are worked out from the merged totals at the end.
+
+Usage:
+    python product_sentiment.py --top 20
+    python product_sentiment.py --engine lexicon --output products.csv
+'''
+
+# Import Required Libraries
+import argparse
+import pandas as pd
+
+# Configuration
+# the product id and name (the same name is used for more than one id)
+PRODUCT_COLUMNS = ['id', 'name']
+AGGREGATE_COLUMNS = ['reviews', 'polarity_sum', 'subjectivity_sum',
+                     'positive', 'negative', 'neutral']
+
+
+# Partial aggregate of a chunk
+def product_aggregate(reviews, key_columns=None):
+    """
+    Reduce scored reviews (eg a chunk from score_review_chunks read with
+    the product columns) to one row of totals per product.
+
+    Parameters:
+        reviews (pandas.DataFrame): Scored reviews with the key columns.
+        key_columns (list): Columns identifying a product (default
+            PRODUCT_COLUMNS).
+    Returns:
+        pandas.DataFrame: AGGREGATE_COLUMNS indexed by the key columns -
+        partial aggregates are combined with merge_product_aggregates.
+    """
+    key_columns = list(key_columns or PRODUCT_COLUMNS)
+    ratings = pd.get_dummies(reviews['polarity_rating'], dtype='int64')
+    totals = pd.DataFrame({
+        'reviews': 1,
+        # subjectivity is stored as float32 - sum in full precision
+        'polarity_sum': reviews['polarity'].astype('float64'),
+        'subjectivity_sum': reviews['subjectivity'].astype('float64'),
+        **{rating: ratings[rating] for rating in AGGREGATE_COLUMNS[3:]}},
+        index=reviews.index)
+    keys = [reviews[column] for column in key_columns]
+    return totals.groupby(keys, dropna=False, sort=False).sum()
+
+# Merging partial aggregates
+def merge_product_aggregates(partial_aggregates):
+    '''adds up partial aggregates (from product_aggregate or earlier
+       merges) into one row per product'''
+    partial_aggregates = [partial for partial in partial_aggregates
+                          if partial is not None and len(partial)]
+    if not partial_aggregates:
+        return pd.DataFrame(columns=AGGREGATE_COLUMNS)
+    if len(partial_aggregates) == 1:
+        return partial_aggregates[0]
+    merged = pd.concat(partial_aggregates)
+    return merged.groupby(level=list(range(merged.index.nlevels)),
+                          dropna=False, sort=False).sum()
+
+# Streaming aggregation
+def aggregate_product_chunks(scored_chunks, key_columns=None):
+    """
+    Aggregate a stream of scored chunks, merging each chunk's partial
+    aggregate into the running totals so no reviews are kept.
+    Returns:
+        pandas.DataFrame: Merged totals (see product_aggregate).
+    """
+    totals = None
+    for chunk in scored_chunks:
+        totals = merge_product_aggregates(
+            [totals, product_aggregate(chunk, key_columns)])
+    return merge_product_aggregates([totals])
+
+# Per-product summary
+def product_summary(totals):
+    """
+    Work out each product's sentiment summary from the merged totals.
+
+    Parameters:
+        totals (pandas.DataFrame): Merged totals from
+            aggregate_product_chunks / merge_product_aggregates.
+    Returns:
+        pandas.DataFrame: Number of reviews, mean polarity and
+        subjectivity, rating counts and the percentage of each rating,
+        most reviewed products first.
+    """
+    reviews = totals['reviews'].astype('int64')
+    summary = pd.DataFrame({
+        'reviews': reviews,
+        'mean_polarity': totals['polarity_sum'] / reviews,
+        'mean_subjectivity': totals['subjectivity_sum'] / reviews},
+        index=totals.index)
+    for rating in AGGREGATE_COLUMNS[3:]:
+        summary[rating] = totals[rating].astype('int64')
+    for rating in AGGREGATE_COLUMNS[3:]:
+        summary[f'{rating}_perc'] = totals[rating] / reviews * 100
+    return summary.sort_values('reviews', ascending=False, kind='stable')
+
+# Per-product summary for printing
+def format_product_summary(summary, top=None):
+    '''
+    Format the product summary as a table - top limits it to the most
+    reviewed products
+    Returns - formatted string for simple print
+    '''
+    shown = summary.head(top) if top else summary
+    table = shown[['reviews', 'mean_polarity', 'positive_perc',
+                   'negative_perc', 'neutral_perc']].rename(columns={
+                       'mean_polarity': 'polarity',
+                       'positive_perc': 'positive %',
+                       'negative_perc': 'negative %',
+                       'neutral_perc': 'neutral %'})
+    table.index = [' / '.join(str(part)[:40] for part in
+                              (key if isinstance(key, tuple) else (key,)))
+                   for key in table.index]
+    return (f'Sentiment by product ({len(shown)} of {len(summary)} '
+            f'products):\n'
+            + table.to_string(float_format=lambda value: f'{value:.2f}')
+            + '\n')
+
+
+# Command line
+def main():
+    '''scores the reviews and prints (or saves) the per-product summary'''
+    import sentiment_analysis as sa
+
+    parser = argparse.ArgumentParser(
+        description='Sentiment summary of each product in one pass over '
+                    'the reviews.')
+    parser.add_argument('--input', default=None,
+                        help='reviews CSV or zip file (default: the '
+                             'extracted CSV if there is one, otherwise '
+                             'the zip)')
+    parser.add_argument('--model', default='en_core_web_sm',
+                        help='spaCy model (default: %(default)s)')
+    parser.add_argument('--lemmatize', action='store_true')
+    parser.add_argument('--remove-punctuation', action='store_true')
+    parser.add_argument('--remove-stop-words', action='store_true')
+    parser.add_argument('--engine', choices=list(sa.SENTIMENT_ENGINES),
+                        default=sa.SENTIMENT_ENGINE)
+    parser.add_argument('--key', nargs='+', default=PRODUCT_COLUMNS,
+                        help='columns identifying a product '
+                             '(default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=sa.CHUNK_SIZE)
+    parser.add_argument('--top', type=int, default=None,
+                        help='only print the TOP most reviewed products')
+    parser.add_argument('--output', default=None,
+                        help='also save the full summary to a CSV file')
+    args = parser.parse_args()
+
+    choices = {
+        "lemmatize": args.lemmatize,
+        "remove_punctuation": args.remove_punctuation,
+        "remove_stop_words": args.remove_stop_words
+    }
+    nlp = (sa.get_nlp(args.model, lemmatize=args.lemmatize)
+           if any(choices.values()) else None)
+    chunks = sa.read_review_chunks(args.input or sa.default_reviews_file(),
+                                   sa.REVIEW_COLUMNS + args.key,
+                                   args.chunk_size)
+    totals = aggregate_product_chunks(
+        sa.score_review_chunks(chunks, nlp, **choices, engine=args.engine),
+        args.key)
+    summary = product_summary(totals)
+    print(format_product_summary(summary, args.top))
+    if args.output:
+        summary.to_csv(args.output)
+        print(f'Saved {args.output}')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+''' review_cache.py
+Simon Kinsey
+
+Persistent SQLite cache of per-review results for sentiment_analysis.py
+so re-runs only need to preprocess and score reviews not seen before.
+
+Each review is keyed on a hash of its text, the spaCy model and the
+preprocessing choices. The cache is cleared whenever the installed spaCy,
+spacytextblob or textblob version changes and the least recently used
+entries are evicted once it grows past its size limit. The total size is
+kept up to date by triggers as rows are added and removed, so checking
+it does not mean adding up every row.
+'''
+
+# Import Required Libraries
+import hashlib
+import json
+import sqlite3
+import time
+from importlib.metadata import version, PackageNotFoundError
+
+# Configuration
+CACHE_FILE_PATH = 'sentiment_cache.sqlite'
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+# rough per row overhead (key, scores, index entry) used for sizing
+ROW_OVERHEAD_BYTES = 150
+# sqlite limits the number of ? parameters in a single statement
+LOOKUP_BATCH_SIZE = 500
+# bumped whenever the layout of the results table changes
+SCHEMA_VERSION = 3
+
+
+# Library versions that affect cached results
+def library_versions():
+    '''returns a dictionary of the installed versions of the libraries
+       that produce the cached results'''
+    versions = {}
+    for package in ('spacy', 'spacytextblob', 'textblob'):
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+# Model name for cache keys
+def model_id(nlp):
+    '''returns the name and version of a loaded spaCy model
+       eg "en_core_web_sm-3.7.1" (or None if no model is used)'''
+    if nlp is None:
+        return None
+    return f"{nlp.meta['lang']}_{nlp.meta['name']}-{nlp.meta['version']}"
+
+# Cache key for a single review
+def review_key(text, model_name, choices, score_text):
+    """
+    Build the cache key for a review.
+
+    Parameters:
+        text (str): Original review text.
+        model_name (str): spaCy model name and version (see model_id).
+        choices (dict): Preprocessing choices, as returned by
+            get_preprocessing_choices.
+        score_text (str): Whether the 'cleaned' or 'raw' text was scored.
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    settings = json.dumps([model_name, sorted(choices.items()), score_text])
+    return hashlib.sha256(f'{settings}\n{text}'.encode('utf-8')).hexdigest()
+
+
+class ReviewCache:
+    '''
+    SQLite backed cache mapping review keys to
+    (cleaned_text, polarity, subjectivity) tuples.
+    hits and misses count the lookups made through get_many.
+    '''
+
+    def __init__(self, file_path=CACHE_FILE_PATH, max_bytes=MAX_CACHE_BYTES):
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(file_path)
+        # so rows replaced by INSERT OR REPLACE fire the delete trigger
+        self.connection.execute('PRAGMA recursive_triggers = ON')
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS meta '
+                '(name TEXT PRIMARY KEY, value TEXT)')
+        self._check_versions()
+        self.evict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _check_versions(self):
+        '''recreates an empty results table if the library versions or the
+           cache layout have changed since the results were stored'''
+        versions = json.dumps(dict(library_versions(), schema=SCHEMA_VERSION),
+                              sort_keys=True)
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE name = 'versions'").fetchone()
+        with self.connection:
+            if row is None or row[0] != versions:
+                self.connection.execute('DROP TABLE IF EXISTS results')
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('versions', ?)",
+                    (versions,))
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('total_size', 0)")
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS results '
+                '(key TEXT PRIMARY KEY, cleaned_text TEXT, polarity REAL, '
+                'subjectivity REAL, size INTEGER, last_used REAL)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS results_last_used '
+                'ON results (last_used)')
+            # running total of the size column
+            self.connection.execute(
+                'CREATE TRIGGER IF NOT EXISTS results_insert '
+                'AFTER INSERT ON results BEGIN '
+                "UPDATE meta SET value = value + NEW.size "
+                "WHERE name = 'total_size'; END")
+            self.connection.execute(
+                'CREATE TRIGGER IF NOT EXISTS results_delete '
+                'AFTER DELETE ON results BEGIN '
+                "UPDATE meta SET value = value - OLD.size "
+                "WHERE name = 'total_size'; END")
+
+    def get_many(self, keys):
+        """
+        Look up cached results and mark them as recently used.
+        Returns:
+            dict: key -> (cleaned_text, polarity, subjectivity) for the
+            keys found in the cache.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+            batch = keys[start:start + LOOKUP_BATCH_SIZE]
+            rows = self.connection.execute(
+                'SELECT key, cleaned_text, polarity, subjectivity '
+                'FROM results WHERE key IN '
+                f'({",".join("?" * len(batch))})', batch)
+            for key, *result in rows:
+                found[key] = tuple(result)
+        if found:
+            now = time.time()
+            with self.connection:
+                self.connection.executemany(
+                    'UPDATE results SET last_used = ? WHERE key = ?',
+                    ((now, key) for key in found))
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, results):
+        """
+        Store results (a dict of key -> (cleaned_text, polarity,
+        subjectivity)) then evict old entries if the cache is now over its
+        size limit.
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                ((key, cleaned_text, polarity, subjectivity,
+                  len(cleaned_text.encode('utf-8')) + ROW_OVERHEAD_BYTES, now)
+                 for key, (cleaned_text, polarity, subjectivity)
+                 in results.items()))
+        self.evict()
+
+    def total_size(self):
+        '''returns the total size of the cached results in bytes (the
+           running total kept by the triggers)'''
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE name = 'total_size'").fetchone()
+        return int(row[0]) if row else 0
+
+    def evict(self):
+        '''removes the least recently used entries until the cache is
+           back under 90% of max_bytes'''
+        total = self.total_size()
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        expired = []
+        for key, size in self.connection.execute(
+                'SELECT key, size FROM results ORDER BY last_used'):
+            if total <= target:
+                break
+            expired.append((key,))
+            total -= size
+        with self.connection:
+            self.connection.executemany(
+                'DELETE FROM results WHERE key = ?', expired)
+
+    def clear(self):
+        '''removes all cached results'''
+        with self.connection:
+            self.connection.execute('DELETE FROM results')
+
+    def close(self):
+        '''closes the cache database'''
+        self.connection.close()
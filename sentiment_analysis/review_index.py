@@ -0,0 +1,273 @@
+''' review_index.py
+Simon Kinsey
+
+Precomputed document vectors for the reviews, so similarity searches do
+not need to re-parse reviews with spaCy.
+
+Each review's spaCy Doc.vector (en_core_web_md word vectors) is scaled to
+unit length and stored in a float32 .npy file, which is memory-mapped when
+loaded. The dot product of two rows is then the Doc.similarity of the two
+reviews, so "the k most similar reviews" or "all pairs above a
+threshold" are a blocked matrix multiply.
+
+Row numbers are the row numbers of the reviews file, which is also the
+index of the DataFrames from sentiment_analysis.read_review_chunks.
+
+Usage:
+    python review_index.py build
+    python review_index.py query --row 42 -k 5
+    python review_index.py pairs --threshold 0.98
+    python review_index.py check
+
+check compares the similarities from the vectors with Doc.similarity on
+random pairs of reviews (the differences should only be float32
+rounding, around 1e-7) and fails if any is more than CHECK_TOLERANCE. If
+the vector file has not been built it checks vectors built for a sample
+of the reviews instead.
+'''
+
+# Import Required Libraries
+import argparse
+import os
+import random
+import sys
+import tempfile
+import numpy as np
+import sentiment_analysis as sa
+
+# Configuration
+VECTORS_FILE_PATH = 'review_vectors.npy'
+VECTORS_MODEL = 'en_core_web_md'
+# rows multiplied at a time, bounding the memory of each block of scores
+BLOCK_SIZE = 4096
+# largest difference from Doc.similarity accepted by check
+CHECK_TOLERANCE = 1e-5
+# reviews given vectors for check when there is no vector file
+CHECK_REVIEWS = 1000
+
+
+# Build the vector file
+def build_review_vectors(texts, nlp, file_path=VECTORS_FILE_PATH,
+                         batch_size=sa.BATCH_SIZE, n_process=sa.N_PROCESS):
+    """
+    Parse every review once and store its normalised Doc.vector.
+
+    Parameters:
+        texts (sequence of str): Review texts, one per row.
+        nlp (spacy.lang): Loaded spaCy model with vectors (eg from
+            sentiment_analysis.get_nlp(..., vectors=True)).
+        file_path (str): .npy file to write.
+        batch_size (int): Number of reviews per nlp.pipe batch.
+        n_process (int): Number of processes used by nlp.pipe.
+    Returns:
+        numpy.memmap: The (rows x vector width) float32 matrix. Reviews
+        without a vector are left as rows of zeros, so (as with
+        Doc.similarity) their similarity to everything is 0.
+    """
+    vectors = None
+    docs = nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+    for row, doc in enumerate(docs):
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(
+                file_path, mode='w+', dtype=np.float32,
+                shape=(len(texts), len(doc.vector)))
+        norm = doc.vector_norm
+        if norm:
+            vectors[row] = doc.vector / norm
+    if vectors is None:
+        vectors = np.lib.format.open_memmap(
+            file_path, mode='w+', dtype=np.float32,
+            shape=(0, nlp.vocab.vectors_length))
+    vectors.flush()
+    return vectors
+
+# Load the vector file
+def load_review_vectors(file_path=VECTORS_FILE_PATH):
+    '''returns the review vectors memory-mapped (read only) from file_path'''
+    return np.load(file_path, mmap_mode='r')
+
+# Similarity of two reviews
+def similarity(vectors, row_a, row_b):
+    '''returns the similarity of two reviews (as Doc.similarity)'''
+    return float(np.dot(vectors[row_a], vectors[row_b]))
+
+# Top k search
+def top_k(vectors, queries, k=5, exclude_rows=None, block_size=BLOCK_SIZE):
+    """
+    Find the k rows with the highest similarity to each query vector.
+
+    Parameters:
+        vectors (numpy.ndarray): Normalised review vectors (can be a
+            memmap - only block_size rows are read at a time).
+        queries (numpy.ndarray): (m x width) normalised query vectors.
+        k (int): Number of results per query.
+        exclude_rows (numpy.ndarray): Optional row to leave out of the
+            results of each query (eg the query review itself).
+        block_size (int): Number of rows scored at a time.
+    Returns:
+        tuple: (rows, scores) arrays of shape (m x k), most similar first.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    k = min(k, len(vectors) - (exclude_rows is not None))
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    if k <= 0:
+        return best_rows, best_scores
+
+    for start in range(0, len(vectors), block_size):
+        block = np.asarray(vectors[start:start + block_size])
+        scores = queries @ block.T
+        if exclude_rows is not None:
+            excluded = ((exclude_rows >= start)
+                        & (exclude_rows < start + len(block)))
+            scores[np.nonzero(excluded)[0],
+                   exclude_rows[excluded] - start] = -np.inf
+        rows = np.broadcast_to(np.arange(start, start + len(block)),
+                               scores.shape)
+        # keep the best k of the previous best and this block
+        scores = np.concatenate([best_scores, scores], axis=1)
+        rows = np.concatenate([best_rows, rows], axis=1)
+        if scores.shape[1] > k:
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(scores, keep, axis=1)
+            rows = np.take_along_axis(rows, keep, axis=1)
+        best_scores, best_rows = scores, rows
+
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    return (np.take_along_axis(best_rows, order, axis=1),
+            np.take_along_axis(best_scores, order, axis=1))
+
+def most_similar(vectors, rows, k=5, block_size=BLOCK_SIZE):
+    """
+    Find the k most similar reviews to each of the given reviews
+    (leaving out the review itself).
+    Returns:
+        tuple: (rows, scores) arrays of shape (len(rows) x k).
+    """
+    rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+    return top_k(vectors, np.asarray(vectors[rows]), k, exclude_rows=rows,
+                 block_size=block_size)
+
+# All similar pairs
+def pairs_above_threshold(vectors, threshold, block_size=BLOCK_SIZE):
+    """
+    Find every pair of reviews with a similarity of at least threshold,
+    comparing one pair of row blocks at a time.
+    Yields:
+        tuple: (rows_a, rows_b, scores) arrays for each block pair, with
+        rows_a < rows_b.
+    """
+    for start_a in range(0, len(vectors), block_size):
+        block_a = np.asarray(vectors[start_a:start_a + block_size])
+        for start_b in range(start_a, len(vectors), block_size):
+            block_b = np.asarray(vectors[start_b:start_b + block_size])
+            scores = block_a @ block_b.T
+            rows_a, rows_b = np.nonzero(scores >= threshold)
+            if start_a == start_b:
+                # each pair once and not a review with itself
+                upper = rows_a < rows_b
+                rows_a, rows_b = rows_a[upper], rows_b[upper]
+            if len(rows_a):
+                yield (rows_a + start_a, rows_b + start_b,
+                       scores[rows_a, rows_b])
+
+# Consistency check against spaCy
+def check_against_spacy(vectors, texts, nlp, samples=100, seed=None):
+    """
+    Compare the similarity of random pairs of reviews from the vectors
+    with Doc.similarity.
+    Returns:
+        float: The largest absolute difference found.
+    """
+    rng = random.Random(seed)
+    largest = 0.0
+    for _ in range(samples):
+        row_a, row_b = rng.sample(range(len(texts)), 2)
+        expected = nlp(texts[row_a]).similarity(nlp(texts[row_b]))
+        largest = max(largest,
+                      abs(similarity(vectors, row_a, row_b) - expected))
+    return largest
+
+
+# Command line
+def main():
+    '''build, query or check the review vector index'''
+    parser = argparse.ArgumentParser(
+        description='Review similarity search using precomputed vectors.')
+    parser.add_argument('command',
+                        choices=['build', 'query', 'pairs', 'check'])
+    parser.add_argument('--input', default=None,
+                        help='reviews CSV or zip file (default: '
+                             f'{sa.CSV_FILE_PATH} if extracted, otherwise '
+                             f'{sa.ZIP_FILE_PATH})')
+    parser.add_argument('--vectors', default=VECTORS_FILE_PATH,
+                        help='vector file (default: %(default)s)')
+    parser.add_argument('--model', default=VECTORS_MODEL,
+                        help='spaCy model (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=sa.BATCH_SIZE)
+    parser.add_argument('--n-process', type=int, default=sa.N_PROCESS)
+    parser.add_argument('--row', type=int, default=None,
+                        help='review row to query (default: random)')
+    parser.add_argument('-k', type=int, default=5,
+                        help='number of similar reviews to show')
+    parser.add_argument('--threshold', type=float, default=0.98,
+                        help='minimum similarity for pairs')
+    parser.add_argument('--samples', type=int, default=100,
+                        help='number of random pairs to check')
+    args = parser.parse_args()
+
+    texts = sa.load_reviews(args.input or sa.default_reviews_file())
+    texts = texts['reviews.text'].tolist()
+
+    if args.command == 'build':
+        nlp = sa.get_nlp(args.model, vectors=True)
+        vectors = build_review_vectors(texts, nlp, args.vectors,
+                                       args.batch_size, args.n_process)
+        print(f'Saved {vectors.shape[0]} review vectors to {args.vectors}')
+        return
+
+    if args.command == 'check' and not os.path.exists(args.vectors):
+        # no vector file yet - check vectors built for a sample
+        texts = random.sample(texts, min(CHECK_REVIEWS, len(texts)))
+        print(f'{args.vectors} has not been built - checking vectors for '
+              f'{len(texts)} sampled reviews.')
+        nlp = sa.get_nlp(args.model, vectors=True)
+        with tempfile.TemporaryDirectory() as directory:
+            vectors = np.array(build_review_vectors(
+                texts, nlp, os.path.join(directory, VECTORS_FILE_PATH),
+                args.batch_size))
+    else:
+        vectors = load_review_vectors(args.vectors)
+    if len(vectors) != len(texts):
+        raise ValueError(f'{args.vectors} has {len(vectors)} rows but there '
+                         f'are {len(texts)} reviews - rebuild it.')
+
+    if args.command == 'query':
+        row = args.row
+        if row is None:
+            row = random.randrange(len(texts))
+        rows, scores = most_similar(vectors, row, args.k)
+        print(f'Review {row}: "{texts[row]}"\n')
+        for similar_row, score in zip(rows[0], scores[0]):
+            print(f'{score:.2f} - review {similar_row}: '
+                  f'"{texts[similar_row]}"')
+    elif args.command == 'pairs':
+        pair_count = 0
+        for rows_a, rows_b, scores in pairs_above_threshold(vectors,
+                                                            args.threshold):
+            for row_a, row_b, score in zip(rows_a, rows_b, scores):
+                print(f'{score:.3f} - reviews {row_a} and {row_b}')
+            pair_count += len(scores)
+        print(f'{pair_count} pairs with similarity >= {args.threshold}')
+    else:
+        nlp = sa.get_nlp(args.model, vectors=True)
+        largest = check_against_spacy(vectors, texts, nlp, args.samples)
+        print(f'Largest difference from Doc.similarity over {args.samples} '
+              f'random pairs: {largest:.2e}')
+        if largest > CHECK_TOLERANCE:
+            sys.exit(f'FAILED: the vectors differ from Doc.similarity by '
+                     f'more than {CHECK_TOLERANCE:g}.')
+        print('OK')
+
+if __name__ == "__main__":
+    main()
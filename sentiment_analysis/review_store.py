@@ -0,0 +1,239 @@
+''' review_store.py
+Simon Kinsey
+
+Columnar store of the scored reviews, so the results of a run can be
+looked at again without re-running spaCy.
+
+Each scored chunk is written as its own part file (Parquet, or Arrow
+IPC) in the store directory, so a run can append to the store as it
+goes. Reading memory-maps the part files and only reads the columns asked
+for, eg just the polarity ratings for the sentiment summary. Uncompressed
+Arrow parts (--store-format arrow --store-compression none) are read
+straight from the memory map without copying.
+
+Usage:
+    python review_store.py summary
+    python review_store.py summary --positive-threshold 0.3
+    python review_store.py word-clouds --output-dir sentiment_output
+
+Needs pyarrow (pip install pyarrow).
+'''
+
+# Import Required Libraries
+import argparse
+import glob
+import json
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Configuration
+STORE_PATH = 'scored_reviews'
+STORE_FORMAT = 'parquet'
+COMPRESSION = 'zstd'
+# codecs both formats can use ('none' writes uncompressed parts)
+COMPRESSIONS = ['zstd', 'lz4', 'none']
+FORMAT_EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow'}
+STORE_COLUMNS = ['reviews.text', 'cleaned_reviews', 'polarity',
+                 'subjectivity', 'polarity_rating']
+
+
+# pyarrow check
+def require_pyarrow():
+    '''raises ImportError with install instructions if pyarrow is missing'''
+    if pa is None:
+        raise ImportError('The scored review store needs pyarrow - '
+                          'install it with "pip install pyarrow".')
+
+# Part files of a store
+def part_files(store_path=STORE_PATH):
+    '''returns the part files of the store in the order they were written'''
+    files = []
+    for extension in FORMAT_EXTENSIONS.values():
+        files += glob.glob(os.path.join(store_path, f'part-*{extension}'))
+    return sorted(files)
+
+
+class ReviewStoreWriter:
+    '''
+    Appends scored chunks (eg from score_review_chunks) to a store as
+    part files.
+    store_path - directory of the part files
+    file_format - 'parquet' or 'arrow' (Arrow IPC)
+    compression - one of COMPRESSIONS for either format - 'none' (or
+        None) writes uncompressed parts, which for Arrow are read without
+        any copying or decompression
+    append - keep the existing part files (otherwise they are removed)
+    settings - optional dictionary (eg the model and preprocessing
+        choices) stored with every part
+    '''
+
+    def __init__(self, store_path=STORE_PATH, file_format=STORE_FORMAT,
+                 compression=COMPRESSION, append=False, settings=None):
+        require_pyarrow()
+        if file_format not in FORMAT_EXTENSIONS:
+            raise ValueError(f"file_format must be one of "
+                             f"{', '.join(FORMAT_EXTENSIONS)}.")
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"compression must be one of "
+                             f"{', '.join(COMPRESSIONS)}.")
+        self.store_path = store_path
+        self.file_format = file_format
+        self.compression = None if compression == 'none' else compression
+        self.settings = settings
+        os.makedirs(store_path, exist_ok=True)
+        existing = part_files(store_path)
+        if not append:
+            for file_path in existing:
+                os.remove(file_path)
+            existing = []
+        self.next_part = (int(os.path.basename(existing[-1])[5:10]) + 1
+                          if existing else 0)
+        self.rows_written = 0
+
+    def append(self, chunk):
+        """
+        Write one scored chunk as the next part file.
+        Returns:
+            str: Path of the part file written.
+        """
+        columns = [column for column in STORE_COLUMNS
+                   if column in chunk.columns]
+        table = pa.Table.from_pandas(chunk[columns].rename_axis('row'),
+                                     preserve_index=True)
+        metadata = dict(table.schema.metadata or {})
+        metadata[b'compression'] = (self.compression or 'none').encode()
+        if self.settings is not None:
+            metadata[b'scoring'] = json.dumps(self.settings).encode('utf-8')
+        table = table.replace_schema_metadata(metadata)
+        file_path = os.path.join(
+            self.store_path,
+            f'part-{self.next_part:05d}'
+            f'{FORMAT_EXTENSIONS[self.file_format]}')
+        if self.file_format == 'parquet':
+            pq.write_table(table, file_path, compression=self.compression)
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=self.compression)
+            with pa.OSFile(file_path, 'wb') as sink, \
+                    pa.ipc.new_file(sink, table.schema,
+                                    options=options) as writer:
+                writer.write_table(table)
+        self.next_part += 1
+        self.rows_written += len(chunk)
+        return file_path
+
+# Reading a part file
+def read_part(file_path, columns=None):
+    '''returns the part file as a pyarrow Table (memory-mapped) with only
+       the given columns (and the row numbers) - the other columns are
+       never read or decompressed'''
+    require_pyarrow()
+    if columns is not None:
+        columns = list(dict.fromkeys([*columns, 'row']))
+    if file_path.endswith(FORMAT_EXTENSIONS['parquet']):
+        return pq.read_table(file_path, columns=columns, memory_map=True)
+    source = pa.memory_map(file_path)
+    reader = pa.ipc.open_file(source)
+    metadata = reader.schema.metadata or {}
+    if columns is None or metadata.get(b'compression') == b'none':
+        # uncompressed columns are used straight from the memory map
+        table = reader.read_all()
+        return table if columns is None else table.select(columns)
+    # only decompress the given columns (reading a subset of the fields
+    # copies them, so this is only worth it for compressed parts)
+    options = pa.ipc.IpcReadOptions(included_fields=[
+        reader.schema.get_field_index(column) for column in columns
+        if column in reader.schema.names])
+    table = pa.ipc.open_file(source, options=options).read_all()
+    return table.select(columns)
+
+def iter_scored_chunks(store_path=STORE_PATH, columns=None):
+    '''yields each part of the store as a DataFrame indexed by row with
+       only the given columns - one part in memory at a time'''
+    for file_path in part_files(store_path):
+        yield read_part(file_path, columns).to_pandas()
+
+def load_scored_reviews(store_path=STORE_PATH, columns=None):
+    """
+    Load the scored reviews from a store.
+
+    Parameters:
+        store_path (str): Store directory.
+        columns (list): Columns to read (default: all of STORE_COLUMNS).
+    Returns:
+        pandas.DataFrame: The reviews indexed by row, with a categorical
+        polarity_rating (as produced by score_review_chunks).
+    """
+    files = part_files(store_path)
+    if not files:
+        raise ValueError(f'No scored reviews found in {store_path}.')
+    tables = [read_part(file_path, columns) for file_path in files]
+    # unify the rating dictionaries so the parts concatenate cleanly
+    table = pa.concat_tables(tables, promote_options='permissive')
+    return table.to_pandas()
+
+def store_settings(store_path=STORE_PATH):
+    '''returns the settings stored with the first part, or None'''
+    files = part_files(store_path)
+    if not files:
+        return None
+    metadata = read_part(files[0], ['row']).schema.metadata or {}
+    settings = metadata.get(b'scoring')
+    return json.loads(settings) if settings else None
+
+
+# Command line
+def main():
+    '''regenerates the summary or word clouds from a store'''
+    import sentiment_analysis as sa
+
+    parser = argparse.ArgumentParser(
+        description='Sentiment summary and word clouds from scored '
+                    'reviews saved by sentiment_analysis.py.')
+    parser.add_argument('command', choices=['summary', 'word-clouds'])
+    parser.add_argument('--store', default=STORE_PATH,
+                        help='store directory (default: %(default)s)')
+    parser.add_argument('--positive-threshold', type=float,
+                        default=sa.POSITIVE_THRESHOLD)
+    parser.add_argument('--negative-threshold', type=float,
+                        default=sa.NEGATIVE_THRESHOLD)
+    parser.add_argument('--output-dir', default='sentiment_output',
+                        help='directory for the word cloud PNG files '
+                             '(default: %(default)s)')
+    args = parser.parse_args()
+
+    settings = store_settings(args.store)
+    if settings:
+        print(f'Scored with: {json.dumps(settings)}\n')
+    rerate = (args.positive_threshold != sa.POSITIVE_THRESHOLD
+              or args.negative_threshold != sa.NEGATIVE_THRESHOLD)
+
+    if args.command == 'summary':
+        columns = ['polarity_rating'] + (['polarity'] if rerate else [])
+        reviews = load_scored_reviews(args.store, columns)
+        print(sa.sentiment_analysis(reviews, args.positive_threshold,
+                                    args.negative_threshold))
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    word_counts = {}
+    columns = ['cleaned_reviews', 'polarity_rating'] + (
+        ['polarity'] if rerate else [])
+    for chunk in iter_scored_chunks(args.store, columns):
+        if rerate:
+            chunk['polarity_rating'] = sa.rate_polarities(
+                chunk['polarity'].to_numpy(),
+                args.positive_threshold, args.negative_threshold)
+        sa.update_word_counts(word_counts, chunk)
+    for rating in sa.RATINGS:
+        output_path = os.path.join(args.output_dir,
+                                   f'word_cloud_{rating}.png')
+        sa.create_word_cloud(word_counts.get(rating), output_path)
+        print(f'Saved {output_path}')
+
+if __name__ == "__main__":
+    main()
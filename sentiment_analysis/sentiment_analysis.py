@@ -3,11 +3,33 @@ Simon Kinsey
 '''
 
 # Import Required Libraries
+import argparse
+import json
+import os
 import random
+import re
+import sys
+import time
+import zipfile
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
+from itertools import islice
+import numpy as np
 import pandas as pd
 import spacy
+from spacy.lang.en.stop_words import STOP_WORDS
 from spacytextblob.spacytextblob import SpacyTextBlob
+from textblob import TextBlob
 from wordcloud import WordCloud
+import lexicon_scorer
+from instrumentation import Instrumentation
+from near_duplicates import near_duplicate_keep_mask
+from product_sentiment import (PRODUCT_COLUMNS, merge_product_aggregates,
+                               product_aggregate, product_summary)
+from review_cache import ReviewCache, model_id, review_key
+import review_store
 import matplotlib.pyplot as plt
 
 # to supress warning about using spacy sm model:
@@ -16,6 +38,40 @@ warnings.filterwarnings('ignore', category=UserWarning)
 
 # Configuration
 CSV_FILE_PATH = 'amazon_product_reviews.csv'
+# the CSV can also be read straight out of the zip archive it ships in
+ZIP_FILE_PATH = 'amazon_product_reviews.zip'
+# reviews are streamed in chunks of this many rows, loading only the
+# columns that are needed
+CHUNK_SIZE = 10000
+REVIEW_COLUMNS = ['reviews.text']
+# spaCy components never needed here, and the components the rule based
+# lemmatizer relies on for part of speech tags
+UNUSED_COMPONENTS = ['parser', 'ner', 'senter']
+LEMMATIZER_COMPONENTS = ['tok2vec', 'tagger', 'attribute_ruler', 'lemmatizer']
+# results are cached here so re-runs only score new reviews
+CACHE_FILE_PATH = 'sentiment_cache.sqlite'
+# reviews are parsed and scored in batches - n_process > 1 (or -1 for
+# one per CPU) spreads the batches, parsing and scoring, over worker
+# processes
+BATCH_SIZE = 1000
+N_PROCESS = 1
+# Text used for sentiment scoring - 'cleaned' (after preprocessing choices)
+# or 'raw' (lowercased review before stop word/punctuation removal)
+SCORE_TEXT = 'cleaned'
+# 'textblob' or 'lexicon' (lexicon_scorer.py - the same scores, faster)
+SENTIMENT_ENGINE = 'textblob'
+SCORE_COLUMNS = ['cleaned_reviews', 'polarity', 'subjectivity',
+                 'polarity_rating']
+# polarity above/below these thresholds is rated positive/negative,
+# anything in between is neutral
+POSITIVE_THRESHOLD = 0.15
+NEGATIVE_THRESHOLD = -0.15
+RATINGS = ['positive', 'negative', 'neutral']
+# words counted for the word clouds (the same pattern WordCloud uses)
+WORD_PATTERN = re.compile(r"\w[\w']*")
+WORD_CLOUD_STOPWORDS = set(STOP_WORDS)
+# number of distinct texts whose TextBlob sentiment is remembered
+SENTIMENT_MEMO_SIZE = 100000
 
 # Initialize Spacy - requires user to enter choice
 def get_spacy_model_choice():
@@ -40,6 +96,72 @@ def get_spacy_model_choice():
     else:
         return 'en_core_web_md'
 
+# Trimmed spaCy pipeline loading
+def load_nlp(model_name, lemmatize=False, vectors=False, sentiment=False):
+    """
+    Load a spaCy model with only the components a stage needs.
+
+    Stop word and punctuation checks are lexical attributes so only need
+    the tokenizer, and the parser and NER are never loaded.
+
+    Parameters:
+        model_name (str): spaCy model name, eg 'en_core_web_md'.
+        lemmatize (bool): Keep the lemmatizer and the components it uses.
+        vectors (bool): Keep the word vectors for Doc.similarity (models
+            without vectors keep tok2vec instead as Doc.similarity then
+            falls back to its output).
+        sentiment (bool): Add spacytextblob for analyze_sentiment.
+    Returns:
+        spacy.language.Language: The loaded pipeline.
+    """
+    exclude = list(UNUSED_COMPONENTS)
+    if not lemmatize:
+        exclude += [name for name in LEMMATIZER_COMPONENTS
+                    if not (vectors and name == 'tok2vec')]
+    nlp = spacy.load(model_name, exclude=exclude)
+
+    has_vectors = nlp.vocab.vectors.size > 0
+    if (vectors and has_vectors and not lemmatize
+            and 'tok2vec' in nlp.pipe_names):
+        # Doc.similarity uses the word vectors so tok2vec is not needed
+        nlp.remove_pipe('tok2vec')
+    if not vectors and 'tok2vec' not in nlp.pipe_names:
+        # nothing left uses the vectors so free the memory they take
+        nlp.vocab.reset_vectors(width=0)
+    if sentiment:
+        nlp.add_pipe('spacytextblob')
+    return nlp
+
+# Lazily loaded pipelines - one per combination of needed components
+_loaded_pipelines = {}
+
+def get_nlp(model_name, lemmatize=False, vectors=False, sentiment=False):
+    """
+    Return the trimmed pipeline for a stage (see load_nlp), loading it the
+    first time a stage asks for it.
+    """
+    key = (model_name, lemmatize, vectors, sentiment)
+    if key not in _loaded_pipelines:
+        start = time.perf_counter()
+        nlp = load_nlp(model_name, lemmatize=lemmatize, vectors=vectors,
+                       sentiment=sentiment)
+        components = ', '.join(nlp.pipe_names) or 'tokenizer only'
+        print(f'Loaded {model_name} ({components}) in '
+              f'{time.perf_counter() - start:.1f}s\n')
+        _loaded_pipelines[key] = nlp
+    return _loaded_pipelines[key]
+
+# Components run when parsing reviews for preprocessing
+def parse_components(nlp, lemmatize=False):
+    '''returns the components of nlp that preprocessing runs - only the
+       lemmatizer and the components it relies on, so a pipeline shared
+       with the other stages (eg with spacytextblob) parses as fast as a
+       trimmed one'''
+    if nlp is None or not lemmatize:
+        return []
+    return [name for name in nlp.pipe_names
+            if name in LEMMATIZER_COMPONENTS]
+
 # Get Preprocessing choices
 def get_preprocessing_choices():
     """
@@ -71,27 +193,103 @@ def get_preprocessing_choices():
 
     return choices
 
+# Streaming Data Loading
+def read_review_chunks(file_path, columns=None, chunk_size=CHUNK_SIZE):
+    """
+    Read reviews in fixed size chunks, loading only the required columns.
+
+    Parameters:
+        file_path (str): Path to the CSV file, or to a zip archive holding
+            it - the CSV is then streamed out of the archive without
+            extracting it.
+        columns (list): Columns to load (default REVIEW_COLUMNS).
+        chunk_size (int): Maximum number of rows per chunk.
+    Yields:
+        pandas.DataFrame: Chunks of the data, indexed by row number in
+        the file.
+    """
+    columns = list(columns or REVIEW_COLUMNS)
+    if zipfile.is_zipfile(file_path):
+        with zipfile.ZipFile(file_path) as archive:
+            csv_names = [name for name in archive.namelist()
+                         if name.lower().endswith('.csv')]
+            if not csv_names:
+                raise ValueError(f"No CSV file found in {file_path}.")
+            with archive.open(csv_names[0]) as csv_file:
+                yield from _read_csv_chunks(csv_file, columns, chunk_size)
+    else:
+        yield from _read_csv_chunks(file_path, columns, chunk_size)
+
+def _read_csv_chunks(csv_file, columns, chunk_size):
+    """Read the given columns of a CSV file (path or open file) in chunks."""
+    reader = pd.read_csv(csv_file, usecols=lambda name: name in columns,
+                         chunksize=chunk_size)
+    for chunk in reader:
+        # Check the required columns (eg 'reviews.text') exist
+        missing = [name for name in columns if name not in chunk.columns]
+        if missing:
+            raise ValueError(
+                f"Data does not contain {', '.join(map(repr, missing))} "
+                f"column{'s' if len(missing) > 1 else ''}.")
+        yield chunk[columns]
+
+# Data Loading
+def load_reviews(file_path, columns=None):
+    """
+    Load the required columns of the reviews CSV (or zip) file in one go.
+    Returns:
+        pandas.DataFrame: The loaded data.
+    """
+    return pd.concat(read_review_chunks(file_path, columns))
+
+# Text cleaning for a parsed review
+def preprocess_text(doc, lemmatize=False, remove_punctuation=False,
+                    remove_stop_words=False):
+    """
+    Rebuild the text of a parsed review based on the preprocessing choices.
+
+    Parameters:
+        doc (spacy.tokens.Doc): Parsed review.
+        lemmatize (bool): If True, use the lemma of each token.
+        remove_punctuation (bool): If True, drop punctuation tokens.
+        remove_stop_words (bool): If True, drop stop word tokens.
+    Returns:
+        str: The remaining tokens joined by single spaces.
+    """
+    tokens = []
+    for token in doc:
+        if remove_stop_words and token.is_stop:
+            continue
+        elif remove_punctuation and token.is_punct:
+            continue
+        else:
+            tokens.append(token.lemma_ if lemmatize else token.text)
+    return " ".join(tokens)
+
 # Data Preprocessing
 def load_and_preprocess_data(file_path,
                              lemmatize=False,
                              remove_punctuation=False,
-                             remove_stop_words=False, nlp=None):
+                             remove_stop_words=False, nlp=None,
+                             batch_size=BATCH_SIZE, n_process=N_PROCESS,
+                             key_columns=None):
     """
     Load and preprocess data from CSV file.
     
     Parameters:
-        file_path (str): Path to the CSV file.
+        file_path (str): Path to the CSV (or zip) file.
         lemmatize (bool): If True, lemmatize words.
         remove_punctuation (bool): If True, remove punctuation.
         remove_stop_words (bool): If True, remove stop words.
         nlp (spacy.lang): Loaded spaCy language model.
+        batch_size (int): Number of reviews per nlp.pipe batch.
+        n_process (int): Number of processes used by nlp.pipe.
+        key_columns (list): Other columns to keep, eg PRODUCT_COLUMNS for
+            product_sentiment.py.
     """
+    key_columns = list(key_columns or [])
     # Load data
-    data = pd.read_csv(file_path)
-
-    # Check if 'reviews.text' column exists
-    if 'reviews.text' not in data.columns:
-        raise ValueError("Data does not contain 'reviews.text' column.")
+    data = load_reviews(file_path, REVIEW_COLUMNS + key_columns)
 
     # Initial preprocessing (lowercasing and stripping spaces)
     data['cleaned_reviews'] = data['reviews.text'].str.lower().str.strip()
@@ -101,22 +299,87 @@ def load_and_preprocess_data(file_path,
         if not nlp:
             raise ValueError(
                 "spaCy model not provided for advanced preprocessing.")
-        def preprocess_text(doc):
-            tokens = []
-            for token in doc:
-                if remove_stop_words and token.is_stop:
-                    continue
-                elif remove_punctuation and token.is_punct:
-                    continue
-                else:
-                    tokens.append(token.lemma_ if lemmatize else token.text)
-            return " ".join(tokens)
-        # Apply preprocessing
-        data['cleaned_reviews'] = data['cleaned_reviews'].apply(
-            lambda x: preprocess_text(nlp(x)))
+        # Apply preprocessing - nlp.pipe yields docs in input order
+        docs = nlp.pipe(data['cleaned_reviews'],
+                        batch_size=batch_size, n_process=n_process)
+        data['cleaned_reviews'] = [
+            preprocess_text(doc, lemmatize, remove_punctuation,
+                            remove_stop_words)
+            for doc in docs]
     # Optionally, drop rows where the cleaned text is now empty
     data = data[data['cleaned_reviews'] != '']
-    return data[['reviews.text', 'cleaned_reviews']]
+    return data[key_columns + ['reviews.text', 'cleaned_reviews']]
+
+# Polarity rating
+def rate_polarity(polarity, positive_threshold=POSITIVE_THRESHOLD,
+                  negative_threshold=NEGATIVE_THRESHOLD):
+    """
+    Convert a polarity score into a textual rating
+    (positive > 0.15, negative < -0.15, otherwise neutral).
+    """
+    if polarity > positive_threshold:
+        return 'positive'
+    elif polarity < negative_threshold:
+        return 'negative'
+    else:
+        return 'neutral'
+
+# Polarity ratings for a whole column of scores
+def rate_polarities(polarities, positive_threshold=POSITIVE_THRESHOLD,
+                    negative_threshold=NEGATIVE_THRESHOLD):
+    """
+    Vectorized version of rate_polarity.
+
+    Parameters:
+        polarities (array-like): Polarity scores - float32 scores (eg
+            from an older review store) are compared with the thresholds
+            rounded to float32, so a score stored from exactly the
+            threshold is not rated above it.
+        positive_threshold (float): Scores above this are positive.
+        negative_threshold (float): Scores below this are negative.
+    Returns:
+        pandas.Categorical: Rating of each score, with categories RATINGS.
+    """
+    polarities = np.asarray(polarities)
+    if polarities.dtype == np.float32:
+        positive_threshold = np.float32(positive_threshold)
+        negative_threshold = np.float32(negative_threshold)
+    codes = np.full(len(polarities), RATINGS.index('neutral'), dtype=np.int8)
+    codes[polarities > positive_threshold] = RATINGS.index('positive')
+    codes[polarities < negative_threshold] = RATINGS.index('negative')
+    return pd.Categorical.from_codes(codes, categories=RATINGS)
+
+# Rating counts
+def count_ratings(ratings):
+    """
+    Count the reviews with each polarity rating.
+    Returns:
+        numpy.ndarray: Number of 'positive', 'negative' and 'neutral'
+        ratings (in RATINGS order).
+    """
+    codes = pd.Categorical(ratings, categories=RATINGS).codes
+    return np.bincount(codes[codes >= 0], minlength=len(RATINGS))
+
+# Columns of sentiment scores
+def sentiment_columns(polarities, subjectivities,
+                      positive_threshold=POSITIVE_THRESHOLD,
+                      negative_threshold=NEGATIVE_THRESHOLD):
+    """
+    Build the score columns from lists of polarity and subjectivity scores.
+    Polarity is kept in full precision so re-rating it with other
+    thresholds gives the same ratings as rate_polarity (float32 rounding
+    can move a score onto or past a round threshold like 0.1).
+    Returns:
+        dict: 'polarity' float64 and 'subjectivity' float32 arrays and the
+        categorical 'polarity_rating'.
+    """
+    polarities = np.asarray(polarities, dtype=np.float64)
+    return {
+        'polarity': polarities,
+        'subjectivity': np.asarray(subjectivities, dtype=np.float32),
+        'polarity_rating': rate_polarities(
+            polarities, positive_threshold, negative_threshold),
+    }
 
 # Sentiment Analysis
 def analyze_sentiment(text, nlp):
@@ -129,27 +392,332 @@ def analyze_sentiment(text, nlp):
     polarity = doc._.polarity
     subjectivity = doc._.subjectivity
     # Determine polarity rating based on polarity score
-    if polarity > 0.15:
-        polarity_rating = 'positive'
-    elif polarity < -0.15:
-        polarity_rating = 'negative'
-    else:
-        polarity_rating = 'neutral'
+    polarity_rating = rate_polarity(polarity)
     return polarity, subjectivity, polarity_rating
 
+# TextBlob sentiment for a text, remembered so repeated texts are
+# only scored once
+@lru_cache(maxsize=SENTIMENT_MEMO_SIZE)
+def text_sentiment(text):
+    '''returns (polarity, subjectivity) of the text from TextBlob'''
+    sentiment = TextBlob(text).sentiment
+    return sentiment.polarity, sentiment.subjectivity
+
+# Lexicon scorer sentiment for a text (see lexicon_scorer.py)
+@lru_cache(maxsize=SENTIMENT_MEMO_SIZE)
+def lexicon_sentiment(text):
+    '''returns (polarity, subjectivity) of the text from the lexicon
+       scorer'''
+    return lexicon_scorer.sentiment(text)
+
+SENTIMENT_ENGINES = {
+    'textblob': text_sentiment,
+    'lexicon': lexicon_sentiment
+}
+
+def clear_sentiment_memos():
+    '''forgets the remembered scores of every sentiment engine (eg so a
+       benchmark run starts cold)'''
+    for engine_sentiment in SENTIMENT_ENGINES.values():
+        engine_sentiment.cache_clear()
+
+# Single pass preprocessing and sentiment scoring
+def score_reviews(texts, nlp=None,
+                  lemmatize=False,
+                  remove_punctuation=False,
+                  remove_stop_words=False,
+                  score_text=SCORE_TEXT,
+                  batch_size=BATCH_SIZE, n_process=N_PROCESS,
+                  instrumentation=None, engine=SENTIMENT_ENGINE):
+    """
+    Clean and score reviews using a single spaCy parse of each review.
+
+    Each review is lowercased, stripped and parsed once. The cleaned text
+    is rebuilt from the parsed tokens and the sentiment is taken straight
+    from TextBlob (which is what spacytextblob runs on doc.text), so the
+    cleaned text does not need to be parsed a second time. Different
+    reviews that end up with the same text to score are only scored once.
+
+    Parameters:
+        texts (iterable of str): Original review texts.
+        nlp (spacy.lang): Loaded spaCy model - only needed if any of the
+            preprocessing choices are on.
+        lemmatize (bool): If True, lemmatize words.
+        remove_punctuation (bool): If True, remove punctuation.
+        remove_stop_words (bool): If True, remove stop words.
+        score_text (str): 'cleaned' scores the cleaned text (the same as
+            analyze_sentiment on cleaned_reviews), 'raw' scores the
+            lowercased review before any tokens are removed.
+        batch_size (int): Number of reviews per nlp.pipe batch (and per
+            worker process batch).
+        n_process (int): Number of worker processes that parse and score
+            the batches (-1 for one per CPU) - 1 does everything in this
+            process.
+        instrumentation (Instrumentation): Optional - records the
+            'spacy_parse' (parsing and cleaning) and 'sentiment' stages
+            once per batch (or 'parallel_score' with worker processes).
+        engine (str): 'textblob' scores with TextBlob, 'lexicon' with
+            lexicon_scorer (the same scores without TextBlob's overhead).
+    Yields:
+        tuple: (cleaned_text, polarity, subjectivity) for each review, in
+        input order.
+    """
+    if score_text not in ('cleaned', 'raw'):
+        raise ValueError("score_text must be either 'cleaned' or 'raw'.")
+    if engine not in SENTIMENT_ENGINES:
+        raise ValueError(
+            f"engine must be one of {', '.join(SENTIMENT_ENGINES)}.")
+    if engine == 'lexicon':
+        lexicon_scorer.require_checked_textblob()
+    preprocess = lemmatize or remove_punctuation or remove_stop_words
+    if preprocess and not nlp:
+        raise ValueError(
+            "spaCy model not provided for advanced preprocessing.")
+    if instrumentation is None:
+        instrumentation = Instrumentation(enabled=False)
+    if n_process != 1:
+        yield from _score_reviews_parallel(
+            texts, nlp if preprocess else None, batch_size, n_process,
+            instrumentation,
+            {'lemmatize': lemmatize, 'remove_punctuation': remove_punctuation,
+             'remove_stop_words': remove_stop_words,
+             'score_text': score_text, 'engine': engine})
+        return
+    sentiment = SENTIMENT_ENGINES[engine]
+
+    lowered = (text.lower().strip() for text in texts)
+    if preprocess:
+        # sentiment is scored below so only the lemmatizer (if it is
+        # wanted) needs to run
+        needed = parse_components(nlp, lemmatize)
+        disable = [name for name in nlp.pipe_names if name not in needed]
+        docs = nlp.pipe(lowered, batch_size=batch_size, disable=disable)
+        texts_and_cleaned = (
+            (doc.text, preprocess_text(doc, lemmatize, remove_punctuation,
+                                       remove_stop_words))
+            for doc in docs)
+    else:
+        # nothing to remove so the review does not need parsing at all
+        texts_and_cleaned = ((text, text) for text in lowered)
+
+    # the stages are timed a batch at a time rather than for each review
+    batches = iter(lambda: list(islice(texts_and_cleaned, batch_size)), [])
+    if preprocess:
+        batches = instrumentation.iterate('spacy_parse', batches, len)
+    for batch in batches:
+        with instrumentation.stage('sentiment', len(batch)):
+            scores = [sentiment(cleaned_text if score_text == 'cleaned'
+                                else raw_text)
+                      for raw_text, cleaned_text in batch]
+        for (_, cleaned_text), (polarity, subjectivity) in zip(batch,
+                                                               scores):
+            yield cleaned_text, polarity, subjectivity
+
+# Worker processes for parallel scoring - each keeps its own copy of the
+# pipeline (and its own sentiment memo)
+_worker_nlp = None
+
+def _init_scoring_worker(nlp):
+    '''keeps the pipeline for the batches this worker process scores'''
+    global _worker_nlp
+    _worker_nlp = nlp
+
+def _score_review_batch(texts, options):
+    '''parses and scores one batch of reviews in a worker process'''
+    return list(score_reviews(texts, _worker_nlp, batch_size=len(texts),
+                              n_process=1, **options))
+
+def _score_reviews_parallel(texts, nlp, batch_size, n_process,
+                            instrumentation, options):
+    '''
+    score_reviews over worker processes - batches of batch_size reviews
+    are parsed, cleaned and scored in the workers. Only two batches per
+    worker are in flight at once so the reviews are still streamed.
+    Yields the results in input order.
+    '''
+    if n_process < 1:
+        n_process = os.cpu_count() or 1
+    texts = iter(texts)
+    batches = iter(lambda: list(islice(texts, batch_size)), [])
+    in_flight = deque()
+
+    def finished_batch():
+        with instrumentation.stage('parallel_score') as stage:
+            results = in_flight.popleft().result()
+            stage['items'] = len(results)
+        return results
+
+    with ProcessPoolExecutor(n_process, initializer=_init_scoring_worker,
+                             initargs=(nlp,)) as executor:
+        for batch in batches:
+            in_flight.append(
+                executor.submit(_score_review_batch, batch, options))
+            if len(in_flight) >= 2 * n_process:
+                yield from finished_batch()
+        while in_flight:
+            yield from finished_batch()
+
+# Streaming preprocessing and sentiment scoring
+def score_review_chunks(chunks, nlp=None,
+                        lemmatize=False,
+                        remove_punctuation=False,
+                        remove_stop_words=False,
+                        score_text=SCORE_TEXT,
+                        batch_size=BATCH_SIZE, n_process=N_PROCESS,
+                        cache=None, stats=None, instrumentation=None,
+                        engine=SENTIMENT_ENGINE):
+    """
+    Run score_reviews over a stream of review chunks (eg from
+    read_review_chunks), keeping the chunk boundaries.
+
+    Identical reviews (after lowercasing and stripping) within a chunk
+    are only scored once and the result is copied back to every row with
+    that text. The reviews of all chunks feed one score_reviews stream,
+    so worker processes are started once rather than for every chunk.
+    Only the chunks that have been read ahead are held in memory.
+
+    If a ReviewCache is given, reviews already in the cache are not
+    rescored and new results are added to it. If a stats dictionary is
+    given its 'reviews' and 'unique_reviews' counts are updated (see
+    dedup_summary). If an Instrumentation is given the 'deduplicate' and
+    'build_dataframe' stages (and those of score_reviews) are recorded.
+
+    Yields:
+        pandas.DataFrame: Each chunk with the SCORE_COLUMNS added (see
+        sentiment_columns) and rows with empty cleaned text dropped.
+    """
+    choices = {
+        "lemmatize": lemmatize,
+        "remove_punctuation": remove_punctuation,
+        "remove_stop_words": remove_stop_words
+    }
+    model_name = model_id(nlp) if cache is not None else None
+    # results from other engines are cached separately
+    key_choices = (choices if engine == SENTIMENT_ENGINE
+                   else dict(choices, engine=engine))
+    if instrumentation is None:
+        instrumentation = Instrumentation(enabled=False)
+    if stats is not None:
+        stats.setdefault('reviews', 0)
+        stats.setdefault('unique_reviews', 0)
+    # (chunk, unique text code of each row, cache keys of the unique
+    #  texts, cached results, number of texts to score)
+    pending = deque()
+
+    def texts_to_score():
+        for chunk in chunks:
+            if not len(chunk):
+                continue
+            with instrumentation.stage('deduplicate', len(chunk)):
+                codes, unique_texts = pd.factorize(
+                    chunk['reviews.text'].str.lower().str.strip(),
+                    use_na_sentinel=False)
+                if stats is not None:
+                    stats['reviews'] += len(codes)
+                    stats['unique_reviews'] += len(unique_texts)
+                if cache is None:
+                    keys, cached, to_score = None, {}, unique_texts
+                else:
+                    keys = [review_key(text, model_name, key_choices,
+                                       score_text)
+                            for text in unique_texts]
+                    cached = cache.get_many(keys)
+                    to_score = [text for key, text in zip(keys, unique_texts)
+                                if key not in cached]
+            pending.append((chunk, codes, keys, cached, len(to_score)))
+            yield from to_score
+
+    def finish_chunk(chunk, codes, keys, cached, new_scores):
+        with instrumentation.stage('build_dataframe', len(chunk)):
+            return build_chunk(chunk, codes, keys, cached, new_scores)
+
+    def build_chunk(chunk, codes, keys, cached, new_scores):
+        if keys is None:
+            unique_rows = new_scores
+        else:
+            new_scores = iter(new_scores)
+            unique_rows = [cached[key] if key in cached else next(new_scores)
+                           for key in keys]
+            new_results = {key: row for key, row in zip(keys, unique_rows)
+                           if key not in cached}
+            if new_results:
+                cache.put_many(new_results)
+        cleaned_texts, polarities, subjectivities = (
+            zip(*unique_rows) if len(unique_rows) else ((), (), ()))
+        columns = {'cleaned_reviews': np.array(cleaned_texts, dtype=object)}
+        columns.update(sentiment_columns(polarities, subjectivities))
+        # copy the unique results back out to every row
+        chunk_scores = pd.DataFrame(
+            {name: column.take(codes) for name, column in columns.items()},
+            index=chunk.index)
+        chunk = pd.concat([chunk, chunk_scores], axis=1)
+        # Drop rows where the cleaned text is now empty
+        return chunk[chunk['cleaned_reviews'] != '']
+
+    scores = score_reviews(texts_to_score(), nlp,
+                           lemmatize=lemmatize,
+                           remove_punctuation=remove_punctuation,
+                           remove_stop_words=remove_stop_words,
+                           score_text=score_text,
+                           batch_size=batch_size, n_process=n_process,
+                           instrumentation=instrumentation, engine=engine)
+    for first_score in scores:
+        # a chunk has been read by the time its first score comes back -
+        # any chunks queued ahead of it were fully cached
+        while pending[0][4] == 0:
+            yield finish_chunk(*pending.popleft()[:4], [])
+        chunk, codes, keys, cached, score_count = pending.popleft()
+        yield finish_chunk(chunk, codes, keys, cached,
+                           [first_score, *islice(scores, score_count - 1)])
+    # chunks left over once everything has been scored were fully cached
+    while pending:
+        yield finish_chunk(*pending.popleft()[:4], [])
+
+# Duplicate review summary
+def dedup_summary(stats):
+    '''
+    Describe how many reviews were duplicates, from the stats dictionary
+    filled in by score_review_chunks
+    Returns - formatted string for simple print
+    '''
+    reviews = stats.get('reviews', 0)
+    unique_reviews = stats.get('unique_reviews', 0)
+    ratio = reviews / unique_reviews if unique_reviews else 1
+    duplicate_perc = (1 - unique_reviews / reviews) * 100 if reviews else 0
+    return (f'{reviews} reviews, {unique_reviews} unique - dedup ratio '
+            f'{ratio:.2f} ({duplicate_perc:.2f}% duplicates)\n')
+
 # Sentiment summary for printing
-def sentiment_analysis(reviews):
+def sentiment_analysis(reviews, positive_threshold=POSITIVE_THRESHOLD,
+                       negative_threshold=NEGATIVE_THRESHOLD):
     '''
     Calculate the counts of ratings and percentage of total reviews
     by polarity rating
+    With other thresholds than the defaults the ratings are recalculated
+    from the polarity column (as rate_polarities), otherwise the
+    polarity_rating column is used
+    Returns - formatted string for simple print
+    '''
+    if (positive_threshold == POSITIVE_THRESHOLD
+            and negative_threshold == NEGATIVE_THRESHOLD):
+        ratings = reviews['polarity_rating']
+    else:
+        ratings = rate_polarities(reviews['polarity'].to_numpy(),
+                                  positive_threshold, negative_threshold)
+    return format_sentiment_summary(dict(zip(RATINGS, count_ratings(ratings))))
+
+# Sentiment summary from rating counts
+def format_sentiment_summary(value_counts):
+    '''
+    Format counts of ratings (a mapping of polarity rating to count, eg
+    from value_counts) and their percentage of total reviews
     Returns - formatted string for simple print
     '''
-    value_counts = reviews['polarity_rating'].value_counts()
     positive_count = value_counts.get('positive', 0)
     negative_count = value_counts.get('negative', 0)
     neutral_count = value_counts.get('neutral', 0)
 
-    total = reviews['polarity_rating'].count()
+    total = positive_count + negative_count + neutral_count
 
     positive_perc = (positive_count / total) * 100 if total else 0
     negative_perc = (negative_count / total) * 100 if total else 0
@@ -168,15 +736,94 @@ def sentiment_analysis(reviews):
         )
     return result_string
 
+# Word counts for word clouds
+def count_words(texts, word_counts=None):
+    """
+    Count the words in texts the way WordCloud splits text into words
+    (dropping "'s", numbers and stop words), without joining the texts
+    into one large string.
+
+    Parameters:
+        texts (iterable of str): Texts to count the words of.
+        word_counts (Counter): Counter to add to (default a new one).
+    Returns:
+        collections.Counter: The word counts. Counters for separate chunks
+        or workers can be merged with merge_word_counts.
+    """
+    if word_counts is None:
+        word_counts = Counter()
+    for text in texts:
+        for word in WORD_PATTERN.findall(text):
+            if word.lower().endswith("'s"):
+                word = word[:-2]
+            if word.isdigit() or word.lower() in WORD_CLOUD_STOPWORDS:
+                continue
+            word_counts[word] += 1
+    return word_counts
+
+# Word counts by polarity rating
+def update_word_counts(word_counts_by_rating, reviews):
+    """
+    Add the words of a chunk of scored reviews to the Counter for their
+    polarity rating.
+
+    Parameters:
+        word_counts_by_rating (dict): polarity rating -> Counter, updated
+            in place.
+        reviews (pandas.DataFrame): Scored reviews (eg a chunk from
+            score_review_chunks).
+    """
+    groups = reviews.groupby('polarity_rating', observed=True)
+    for rating, texts in groups['cleaned_reviews']:
+        count_words(texts, word_counts_by_rating.setdefault(rating, Counter()))
+    return word_counts_by_rating
+
+def merge_word_counts(partial_word_counts):
+    """
+    Merge partial word counts by rating (eg from different chunks or
+    worker processes) into one dictionary of polarity rating -> Counter.
+    """
+    merged = {}
+    for word_counts_by_rating in partial_word_counts:
+        for rating, word_counts in word_counts_by_rating.items():
+            merged.setdefault(rating, Counter()).update(word_counts)
+    return merged
+
+def normalize_plurals(word_counts):
+    """
+    Merge the counts of plurals into their singular form where both
+    appear, eg "cases" into "case" (as WordCloud does).
+    """
+    merged = Counter()
+    for word, count in word_counts.items():
+        if (word.endswith('s') and not word.endswith('ss')
+                and word[:-1] in word_counts):
+            merged[word[:-1]] += count
+        else:
+            merged[word] += count
+    return merged
+
 # Word Cloud Visualization
-def create_word_cloud(text):
+def create_word_cloud(text, output_path=None):
     """
-    Create and display a word cloud from text.
+    Create and display a word cloud from text, or from word counts (eg a
+    Counter from count_words). If output_path is given the word cloud is
+    saved as a PNG file there instead of being displayed.
     """
+    if not text:
+        print('No words to show in the word cloud.\n')
+        return
     wordcloud = WordCloud(width = 800, height = 800,
                 background_color ='white',
-                stopwords = set(spacy.lang.en.stop_words.STOP_WORDS),
-                min_font_size = 10).generate(text)
+                stopwords = WORD_CLOUD_STOPWORDS,
+                min_font_size = 10)
+    if isinstance(text, str):
+        wordcloud.generate(text)
+    else:
+        wordcloud.generate_from_frequencies(normalize_plurals(text))
+    if output_path:
+        wordcloud.to_file(output_path)
+        return
     plt.figure(figsize = (8, 8), facecolor = None)
     plt.imshow(wordcloud)
     plt.axis("off")
@@ -208,17 +855,23 @@ def test_random_review_sentiment(reviews, analyze_sentiment_fn, nlp):
 
 
 # Similarity Check
-def test_random_review_similarity(reviews, nlp):
-    '''tests 2 random review statements for similarity and prints results'''
+def test_random_review_similarity(reviews, nlp, vectors=None):
+    '''tests 2 random review statements for similarity and prints results
+       vectors - optional review vectors from review_index.py (rows are the
+       reviews index) used instead of parsing the reviews again'''
     if len(reviews) < 2:
         print('Not enough reviews to compare.')
         return
 
     indices = random.sample(range(len(reviews)), 2)
     review_texts = [reviews.iloc[idx]['reviews.text'] for idx in indices]
-    docs = [nlp(text) for text in review_texts]
 
-    similarity = docs[0].similarity(docs[1])
+    if vectors is not None:
+        rows = [reviews.index[idx] for idx in indices]
+        similarity = float(np.dot(vectors[rows[0]], vectors[rows[1]]))
+    else:
+        docs = [nlp(text) for text in review_texts]
+        similarity = docs[0].similarity(docs[1])
 
     print(f'Comparing review {indices[0]} and review {indices[1]}:')
     print(f'Review {indices[0]}: "{review_texts[0]}"')
@@ -227,13 +880,293 @@ def test_random_review_similarity(reviews, nlp):
           f' (0 = "completely different" to 1 = "identical")\n')
 
 
-# Main Function
-def main():
-    '''main'''
+# Reviews file to use
+def default_reviews_file():
+    '''returns the CSV file path if it has been extracted, otherwise the
+       path of the zip archive it ships in'''
+    return CSV_FILE_PATH if os.path.exists(CSV_FILE_PATH) else ZIP_FILE_PATH
+
+# Command line arguments for batch mode
+def parse_args(argv=None):
+    '''parses the batch mode command line arguments'''
+    parser = argparse.ArgumentParser(
+        description='Batch sentiment analysis of the Amazon product '
+                    'reviews. Run without any arguments for the '
+                    'interactive version.')
+    parser.add_argument('--input', default=None,
+                        help='reviews CSV or zip file (default: '
+                             f'{CSV_FILE_PATH} if extracted, otherwise '
+                             f'{ZIP_FILE_PATH})')
+    parser.add_argument('--model', default='en_core_web_sm',
+                        help='spaCy model (default: %(default)s)')
+    parser.add_argument('--lemmatize', action='store_true',
+                        help='lemmatize words')
+    parser.add_argument('--remove-punctuation', action='store_true',
+                        help='remove punctuation')
+    parser.add_argument('--remove-stop-words', action='store_true',
+                        help='remove stop words')
+    parser.add_argument('--score-text', choices=['cleaned', 'raw'],
+                        default=SCORE_TEXT,
+                        help='text to score (default: %(default)s)')
+    parser.add_argument('--engine', choices=list(SENTIMENT_ENGINES),
+                        default=SENTIMENT_ENGINE,
+                        help='sentiment scorer - lexicon gives the same '
+                             'scores faster (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='reviews per nlp.pipe batch '
+                             '(default: %(default)s)')
+    parser.add_argument('--n-process', type=int, default=N_PROCESS,
+                        help='worker processes that parse and score the '
+                             'reviews, -1 for one per CPU '
+                             '(default: %(default)s)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='rows read per chunk (default: %(default)s)')
+    parser.add_argument('--cache', default=CACHE_FILE_PATH,
+                        help='result cache file (default: %(default)s)')
+    parser.add_argument('--no-cache', dest='cache', action='store_const',
+                        const=None, help='do not use the result cache')
+    parser.add_argument('--drop-near-duplicates', action='store_true',
+                        help='only score the first review of each group of '
+                             'near-duplicate reviews (see near_duplicates.py)')
+    parser.add_argument('--by-product', action='store_true',
+                        help='also summarise the sentiment of each product '
+                             '(see product_sentiment.py)')
+    parser.add_argument('--word-clouds', action='store_true',
+                        help='save a word cloud PNG for each rating')
+    parser.add_argument('--output-dir', default='sentiment_output',
+                        help='directory for the result files '
+                             '(default: %(default)s)')
+    parser.add_argument('--store', metavar='DIR', nargs='?',
+                        const=review_store.STORE_PATH,
+                        help='also save the scored reviews as columnar '
+                             'part files in DIR (default: '
+                             f'{review_store.STORE_PATH}) - see '
+                             'review_store.py')
+    parser.add_argument('--store-format',
+                        choices=list(review_store.FORMAT_EXTENSIONS),
+                        default=review_store.STORE_FORMAT,
+                        help='format of the saved part files '
+                             '(default: %(default)s)')
+    parser.add_argument('--store-compression',
+                        choices=review_store.COMPRESSIONS,
+                        default=review_store.COMPRESSION,
+                        help="compression of the saved part files - "
+                             "'none' lets arrow parts be read without "
+                             "copying (default: %(default)s)")
+    parser.add_argument('--append', action='store_true',
+                        help='add to the saved scored reviews instead of '
+                             'replacing them')
+    parser.add_argument('--interactive', action='store_true',
+                        help='run the interactive version (eg with '
+                             '--store or the instrumentation options '
+                             'below)')
+    instrument = parser.add_argument_group(
+        'instrumentation', 'time each stage of the run (see '
+                           'instrumentation.py)')
+    instrument.add_argument('--instrument', action='store_true',
+                            help='print a per-stage timing and memory '
+                                 'table at the end of the run')
+    instrument.add_argument('--trace', metavar='FILE',
+                            help='also write the per-stage timings to a '
+                                 'JSON file')
+    instrument.add_argument('--trace-memory', action='store_true',
+                            help='record the peak Python memory of each '
+                                 'stage with tracemalloc (slow)')
+    instrument.add_argument('--profile', metavar='FILE',
+                            help='save a cProfile of sampled chunks of the '
+                                 'scoring loop to FILE')
+    instrument.add_argument('--profile-every', type=int, default=10,
+                            metavar='N',
+                            help='profile every Nth chunk '
+                                 '(default: %(default)s)')
+    return parser.parse_args(argv)
+
+# Instrumentation from the command line arguments
+def make_instrumentation(args):
+    '''returns the Instrumentation asked for by the command line options
+       (a disabled one if none were given)'''
+    enabled = bool(args.instrument or args.trace or args.trace_memory
+                   or args.profile)
+    return Instrumentation(enabled=enabled, trace_memory=args.trace_memory,
+                           profile_every=(args.profile_every
+                                          if args.profile else 0))
+
+def report_instrumentation(instrumentation, args):
+    '''prints the instrumentation summary and writes the trace and
+       profile files asked for'''
+    if not instrumentation.enabled:
+        return
+    print(instrumentation.summary_table())
+    if args.trace:
+        instrumentation.write_trace(args.trace)
+        print(f'Stage timings written to {args.trace}')
+    if args.profile:
+        instrumentation.write_profile(args.profile)
+        print(instrumentation.profile_summary())
+        print(f'Profile written to {args.profile}')
+
+# Non-interactive batch run
+def run_batch(args, instrumentation=None):
+    '''
+    Score every review using the command line options (see parse_args)
+    without any prompts or plots. Writes to args.output_dir:
+        review_scores.csv - cleaned text and scores of each review
+        sentiment_summary.txt - the sentiment_analysis summary
+        sentiment_summary.json - counts, percentages, settings and timing
+        product_sentiment.csv - summary of each product (only with
+            --by-product)
+        word_cloud_<rating>.png - word cloud of each rating (only with
+            --word-clouds)
+    and with --store each scored chunk to the review store directory
+    instrumentation - optional Instrumentation recording each stage
+    '''
+    if instrumentation is None:
+        instrumentation = Instrumentation(enabled=False)
+    choices = {
+        "lemmatize": args.lemmatize,
+        "remove_punctuation": args.remove_punctuation,
+        "remove_stop_words": args.remove_stop_words
+    }
+    reviews_file_path = args.input or default_reviews_file()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    nlp = None
+    if any(choices.values()):
+        with instrumentation.stage('spacy_load'):
+            nlp = get_nlp(args.model, lemmatize=args.lemmatize)
+
+    keep_rows = None
+    if args.drop_near_duplicates:
+        print(f'Finding near-duplicate reviews in {reviews_file_path}...\n')
+        with instrumentation.stage('near_duplicates') as stage:
+            keep_rows = near_duplicate_keep_mask(read_review_chunks(
+                reviews_file_path, REVIEW_COLUMNS, args.chunk_size))
+            stage['items'] = len(keep_rows)
+        print(f'{np.count_nonzero(~keep_rows)} near-duplicate reviews '
+              'will be dropped.\n')
+
+    store = None
+    if args.store:
+        store = review_store.ReviewStoreWriter(
+            args.store, args.store_format, args.store_compression,
+            append=args.append,
+            settings={'model': args.model, 'preprocessing': choices,
+                      'score_text': args.score_text, 'engine': args.engine})
+
+    print(f'Scoring reviews from {reviews_file_path}...\n')
+    rating_counts = Counter()
+    word_counts = {}
+    product_totals = None
+    columns = REVIEW_COLUMNS + (PRODUCT_COLUMNS if args.by_product else [])
+    dedup_stats = {}
+    start = time.perf_counter()
+    scores_path = os.path.join(args.output_dir, 'review_scores.csv')
+    cache_context = ReviewCache(args.cache) if args.cache else nullcontext()
+    with cache_context as cache, \
+            open(scores_path, 'w', newline='', encoding='utf-8') as scores:
+        chunks = instrumentation.iterate('read_csv', read_review_chunks(
+            reviews_file_path, columns, args.chunk_size), len)
+        if keep_rows is not None:
+            # chunks are indexed by row number in the file
+            chunks = (chunk[keep_rows[chunk.index]] for chunk in chunks)
+        scored_chunks = score_review_chunks(
+            chunks, nlp, **choices,
+            score_text=args.score_text,
+            engine=args.engine,
+            batch_size=args.batch_size,
+            n_process=args.n_process,
+            cache=cache,
+            stats=dedup_stats,
+            instrumentation=instrumentation)
+        scored_chunks = instrumentation.iterate(
+            'score', instrumentation.profile(scored_chunks), len)
+        for chunk_number, chunk in enumerate(scored_chunks):
+            with instrumentation.stage('write_csv', len(chunk)):
+                chunk[REVIEW_COLUMNS + SCORE_COLUMNS].to_csv(
+                    scores, header=chunk_number == 0, index_label='row')
+            if store is not None:
+                with instrumentation.stage('write_store', len(chunk)):
+                    store.append(chunk)
+            rating_counts.update(dict(zip(
+                RATINGS, count_ratings(chunk['polarity_rating']).tolist())))
+            if args.word_clouds:
+                with instrumentation.stage('word_counts', len(chunk)):
+                    update_word_counts(word_counts, chunk)
+            if args.by_product:
+                with instrumentation.stage('product_aggregate', len(chunk)):
+                    # merged into one row per product as it goes
+                    product_totals = merge_product_aggregates(
+                        [product_totals, product_aggregate(chunk)])
+    elapsed = time.perf_counter() - start
+
+    total = sum(rating_counts.values())
+    summary = format_sentiment_summary(rating_counts)
+    throughput = (f'Scored {total} reviews in {elapsed:.1f}s '
+                  f'({total / elapsed if elapsed else 0:.0f} reviews/s).\n')
+    with open(os.path.join(args.output_dir, 'sentiment_summary.txt'), 'w',
+              encoding='utf-8') as summary_file:
+        summary_file.write(summary + '\n' + dedup_summary(dedup_stats)
+                           + throughput)
+    with open(os.path.join(args.output_dir, 'sentiment_summary.json'), 'w',
+              encoding='utf-8') as summary_file:
+        json.dump({
+            'input': reviews_file_path,
+            'model': args.model,
+            'preprocessing': choices,
+            'score_text': args.score_text,
+            'engine': args.engine,
+            'spacy_components': parse_components(nlp, args.lemmatize),
+            'batch_size': args.batch_size,
+            'n_process': args.n_process,
+            'chunk_size': args.chunk_size,
+            'reviews': total,
+            'unique_reviews': dedup_stats.get('unique_reviews', 0),
+            'near_duplicates_dropped': (int(np.count_nonzero(~keep_rows))
+                                        if keep_rows is not None else 0),
+            'counts': {rating: rating_counts.get(rating, 0)
+                       for rating in ('positive', 'negative', 'neutral')},
+            'percentages': {rating: (rating_counts.get(rating, 0) / total
+                                     * 100 if total else 0)
+                            for rating in ('positive', 'negative', 'neutral')},
+            'elapsed_seconds': elapsed,
+            'reviews_per_second': total / elapsed if elapsed else 0,
+        }, summary_file, indent=2)
+
+    if args.by_product:
+        product_summary(merge_product_aggregates([product_totals])).to_csv(
+            os.path.join(args.output_dir, 'product_sentiment.csv'))
+
+    for rating in RATINGS if args.word_clouds else []:
+        with instrumentation.stage('create_word_cloud'):
+            create_word_cloud(word_counts.get(rating), os.path.join(
+                args.output_dir, f'word_cloud_{rating}.png'))
+
+    print(summary)
+    print(throughput)
+    print(f'Results written to {args.output_dir}')
+    if store is not None:
+        print(f'Scored reviews saved to {args.store} (see review_store.py)')
+
+# Interactive run
+def run_interactive(instrumentation=None, store_path=None,
+                    store_format=review_store.STORE_FORMAT,
+                    store_compression=review_store.COMPRESSION,
+                    append=False):
+    '''the interactive version - prompts for the model and preprocessing
+       choices then shows the results, word cloud and random review tests
+       instrumentation - optional Instrumentation recording each stage
+       store_path - also save the scored reviews to this review store
+       directory (only if given, as with --store in batch mode)
+       store_format, store_compression, append - the file_format,
+       compression and append of review_store.ReviewStoreWriter'''
+    if instrumentation is None:
+        instrumentation = Instrumentation(enabled=False)
+
     # Show intro and user instructions
     print('\nThis program analyses a file called amazon_products_review.csv.\n'
-          'The csv file is provided and needs to be in the same directory\n'
-          'as this python file. \n\n'
+          'The csv file is provided (zipped) and needs to be in the same\n'
+          'directory as this python file - it is read straight from\n'
+          'amazon_product_reviews.zip if it has not been extracted.\n\n'
           'After analysing the amazon_products_review.csv file it also\n'
           'tests a random review for sentiment (polarity) and then checks\n'
           'the similarity of 2 random reviews.\n'
@@ -243,52 +1176,154 @@ def main():
           '(your choice)...'
           )
 
-    # Get Spacy model choice and load and also spacytextblob
+    # Get Spacy model choice - the model is loaded, with the components
+    # all of the stages need, when a stage first uses it
     spacy_model_choice = get_spacy_model_choice()
-    print(f'You have chosen {spacy_model_choice}. Loading model...\n')
-    nlp = spacy.load(spacy_model_choice)
-    nlp.add_pipe('spacytextblob')
+    print(f'You have chosen {spacy_model_choice}.\n')
 
     # Load and preprocess data
     user_choices = get_preprocessing_choices()
 
-    print('Loading data and preprocessing...\n')
-    reviews = load_and_preprocess_data(
-        CSV_FILE_PATH,
-        lemmatize = user_choices["lemmatize"],
-        remove_punctuation = user_choices['remove_punctuation'],
-        remove_stop_words = user_choices['remove_stop_words'],
-        nlp=nlp
-    )
-
-    # Analyze sentiment of reviews
-    print('Analysing sentiment of processed data...please be patient...\n')
-    # Analyze sentiment and directly add results to the DataFrame
-    reviews[['polarity', 'subjectivity', 'polarity_rating']] = (
-            reviews['cleaned_reviews'].apply(lambda x: analyze_sentiment(x, nlp))
-            .apply(pd.Series)
-    )
+    # Stream the reviews from the CSV file or, if it has not been
+    # extracted, straight from the zip archive
+    reviews_file_path = default_reviews_file()
+    print(f'Loading data from {reviews_file_path}, preprocessing and '
+          'analysing sentiment...please be patient...\n')
+    # one pipeline for every stage - the lemmatizer if it is wanted,
+    # spacytextblob for the random review test and the word vectors for
+    # the similarity test (unless review_index.py has already saved them).
+    # get_nlp keeps it, so it is only loaded once. Scoring only needs it
+    # to parse reviews for preprocessing.
+    import review_index
+    pipeline = {'lemmatize': user_choices['lemmatize'], 'sentiment': True,
+                'vectors': not os.path.exists(
+                    review_index.VECTORS_FILE_PATH)}
+    nlp = None
+    if any(user_choices.values()):
+        with instrumentation.stage('spacy_load'):
+            nlp = get_nlp(spacy_model_choice, **pipeline)
+    # with --store the scored reviews are saved so the summary and word
+    # clouds can be made again later without spaCy (review_store.py)
+    store = None
+    if store_path:
+        existing = review_store.part_files(store_path)
+        if existing and not append:
+            print(f'Replacing the {len(existing)} part files already in '
+                  f'{store_path} (use --append to keep them).\n')
+        store = review_store.ReviewStoreWriter(
+            store_path, store_format, store_compression, append=append,
+            settings={
+                'model': spacy_model_choice, 'preprocessing': user_choices,
+                'score_text': SCORE_TEXT, 'engine': SENTIMENT_ENGINE})
+    dedup_stats = {}
+    start = time.perf_counter()
+    with ReviewCache(CACHE_FILE_PATH) as cache:
+        scored_chunks = []
+        word_counts = {}
+        chunks = instrumentation.iterate('read_csv', read_review_chunks(
+            reviews_file_path, REVIEW_COLUMNS, CHUNK_SIZE), len)
+        chunk_stream = score_review_chunks(
+            chunks,
+            nlp,
+            lemmatize = user_choices["lemmatize"],
+            remove_punctuation = user_choices['remove_punctuation'],
+            remove_stop_words = user_choices['remove_stop_words'],
+            score_text=SCORE_TEXT,
+            batch_size=BATCH_SIZE,
+            n_process=N_PROCESS,
+            cache=cache,
+            stats=dedup_stats,
+            instrumentation=instrumentation
+        )
+        for chunk in instrumentation.iterate(
+                'score', instrumentation.profile(chunk_stream), len):
+            # count the words for the word cloud as each chunk is scored
+            with instrumentation.stage('word_counts', len(chunk)):
+                update_word_counts(word_counts, chunk)
+            if store is not None:
+                with instrumentation.stage('write_store', len(chunk)):
+                    store.append(chunk)
+            scored_chunks.append(chunk)
+        with instrumentation.stage('concat'):
+            reviews = pd.concat(scored_chunks)
+        elapsed = time.perf_counter() - start
+        # the throughput of this configuration of preprocessing choices
+        configuration = ', '.join(
+            choice.replace('_', ' ') for choice, chosen
+            in user_choices.items() if chosen) or 'no preprocessing'
+        components = parse_components(nlp, user_choices['lemmatize'])
+        if nlp is None:
+            parsing = 'no spaCy parsing'
+        else:
+            parsing = ('spaCy tokenizer'
+                       + ''.join(f', {name}' for name in components))
+        print(f'Scored {len(reviews)} reviews in {elapsed:.1f}s '
+              f'({len(reviews) / elapsed:.0f} reviews/s) - {configuration} '
+              f'({parsing}).')
+        print(dedup_summary(dedup_stats))
+        print(f'{cache.hits} unique reviews were already in the cache '
+              f'({CACHE_FILE_PATH}), {cache.misses} unique reviews were '
+              'scored.\n')
+        if store is not None:
+            print(f'The scored reviews have been saved to {store_path} - '
+                  'run review_store.py to see the summary again.\n')
 
     # Print sentiment analysis results
-    print(sentiment_analysis(reviews))
+    with instrumentation.stage('sentiment_analysis', len(reviews)):
+        summary = sentiment_analysis(reviews)
+    print(summary)
 
     # Display word cloud for positive sentiment reviews (example)
     print('Word cloud to assist with visualising the review words...\n'
           '...Close the word cloud window when you have finished with it.\n')
-    # Using the 'polarity_rating' column
-    positive_reviews = ' '.join(reviews[reviews['polarity_rating']
-                                == 'positive']['cleaned_reviews'])
-    create_word_cloud(positive_reviews)
+    # Using the word counts of the 'positive' polarity rating
+    # (the wall time includes the time the window is open)
+    with instrumentation.stage('create_word_cloud'):
+        create_word_cloud(word_counts.get('positive'))
 
     # Test sentiment analysis on a random review
     print('Now we will test a random review using the '
           'model for polarity/sentiment analysis:')
-    test_random_review_sentiment(reviews, analyze_sentiment, nlp)
+    with instrumentation.stage('spacy_load'):
+        nlp = get_nlp(spacy_model_choice, **pipeline)
+    with instrumentation.stage('random_review_sentiment'):
+        test_random_review_sentiment(reviews, analyze_sentiment, nlp)
 
-    # Test similarity between two random reviews
+    # Test similarity between two random reviews - using the review
+    # vectors from review_index.py if they have been built, so the reviews
+    # do not need parsing again
     print('Now we will test 2 random reviews for similarity:')
-    test_random_review_similarity(reviews, nlp)
+    vectors = None
+    if os.path.exists(review_index.VECTORS_FILE_PATH):
+        vectors = review_index.load_review_vectors()
+        if len(vectors) != dedup_stats['reviews']:
+            print(f'{review_index.VECTORS_FILE_PATH} has {len(vectors)} '
+                  f"rows but there are {dedup_stats['reviews']} reviews - "
+                  'rebuild it with review_index.py build.\n')
+            vectors = None
+        else:
+            print('Using the review vectors in '
+                  f'{review_index.VECTORS_FILE_PATH}.\n')
+    if vectors is None:
+        # only loads again if the saved vectors could not be used
+        with instrumentation.stage('spacy_load'):
+            nlp = get_nlp(spacy_model_choice, **dict(pipeline, vectors=True))
+    with instrumentation.stage('similarity'):
+        test_random_review_similarity(reviews, nlp, vectors)
 
     print ('Program finished :)...')
+
+# Main Function
+def main():
+    '''main - runs interactively if there are no command line arguments
+       (or --interactive is given), otherwise in batch mode'''
+    args = parse_args()
+    instrumentation = make_instrumentation(args)
+    if len(sys.argv) > 1 and not args.interactive:
+        run_batch(args, instrumentation)
+    else:
+        run_interactive(instrumentation, args.store, args.store_format,
+                        args.store_compression, args.append)
+    report_instrumentation(instrumentation, args)
 if __name__ == "__main__":
     main()
@@ -0,0 +1,374 @@
+''' sentiment_service.py
+Simon Kinsey
+
+Long-running local sentiment scoring service, so reviews can be scored
+as they arrive without loading the spaCy model for every request.
+
+The model (with spacytextblob) is loaded once. Texts from concurrent
+requests are queued and gathered into micro-batches - a batch is scored
+with nlp.pipe as soon as it has max_batch texts or the oldest text has
+waited max_wait_ms since it was queued. The queue is bounded: when it is
+full new requests get a 503 response (with Retry-After) rather than
+piling up, and a request with more texts than the whole queue can hold
+gets a 413.
+
+HTTP/1.1 over TCP or a Unix socket:
+    POST /score    {"text": "..."} or {"texts": ["...", ...]}
+                   -> {"polarity": .., "subjectivity": ..,
+                       "polarity_rating": ..} (or {"results": [...]})
+    GET /metrics   queue depth, batch sizes and latency percentiles
+    GET /health    {"status": "ok"}
+
+Usage:
+    python sentiment_service.py --model en_core_web_md --port 8080
+    curl -d '{"text": "Great speaker"}' http://127.0.0.1:8080/score
+    python sentiment_service.py --unix /tmp/sentiment.sock
+    curl --unix-socket /tmp/sentiment.sock http://localhost/metrics
+'''
+
+# Import Required Libraries
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+import numpy as np
+import sentiment_analysis as sa
+
+# Configuration
+HOST = '127.0.0.1'
+PORT = 8080
+MODEL = 'en_core_web_md'
+MAX_BATCH = 64
+MAX_WAIT_MS = 10
+MAX_QUEUE = 10000
+MAX_BODY_BYTES = 1024 * 1024
+# number of recent requests / batches the latency percentiles cover
+METRICS_WINDOW = 10000
+
+
+# Score a batch of texts
+def score_texts(texts, nlp):
+    '''returns the analyze_sentiment results of each text as
+       dictionaries, scoring the texts together with nlp.pipe'''
+    results = []
+    for doc in nlp.pipe(texts, batch_size=len(texts) or 1):
+        results.append({
+            'polarity': doc._.polarity,
+            'subjectivity': doc._.subjectivity,
+            'polarity_rating': sa.rate_polarity(doc._.polarity),
+        })
+    return results
+
+def percentiles_ms(seconds):
+    '''returns the p50, p95 and p99 of a list of durations in ms'''
+    if not seconds:
+        return {'p50': None, 'p95': None, 'p99': None}
+    p50, p95, p99 = np.percentile(np.asarray(seconds) * 1000, [50, 95, 99])
+    return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+
+
+class QueueFullError(Exception):
+    '''raised when a request would take the queue past its limit'''
+
+
+class RequestTooLargeError(Exception):
+    '''raised when a request has more texts than the queue can ever hold'''
+
+
+class SentimentService:
+    '''
+    Micro-batching scorer shared by all connections.
+    nlp - spaCy pipeline with spacytextblob (eg from
+        sentiment_analysis.get_nlp(model, sentiment=True))
+    max_batch - most texts scored by one nlp.pipe call
+    max_wait_ms - longest a text waits for its batch to fill up
+    max_queue - most texts waiting to be scored before requests are
+        turned away
+    '''
+
+    def __init__(self, nlp, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS,
+                 max_queue=MAX_QUEUE):
+        if max_batch < 1 or max_queue < 1:
+            raise ValueError('max_batch and max_queue must be at least 1.')
+        self.nlp = nlp
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.queue = None
+        # nlp.pipe runs in one worker thread so the event loop stays free
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.started = time.time()
+        self.requests = 0
+        self.rejected = 0
+        self.errors = 0
+        self.texts_scored = 0
+        self.batches = 0
+        self.request_latencies = deque(maxlen=METRICS_WINDOW)
+        self.queue_waits = deque(maxlen=METRICS_WINDOW)
+        self.batch_times = deque(maxlen=METRICS_WINDOW)
+        self.batch_sizes = deque(maxlen=METRICS_WINDOW)
+
+    async def run_batcher(self):
+        '''gathers queued texts into batches and scores them - runs until
+           cancelled'''
+        self.queue = asyncio.Queue(self.max_queue)
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            # the wait counts from when the oldest text was queued, so
+            # time spent in the queue under load is part of the bound
+            deadline = batch[0][2] + self.max_wait
+            while len(batch) < self.max_batch:
+                if self.queue.empty():
+                    timeout = deadline - time.perf_counter()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(
+                            self.queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(self.queue.get_nowait())
+            await self._score_batch(batch, loop)
+
+    async def _score_batch(self, batch, loop):
+        '''scores a batch of (text, future, queued time) items'''
+        start = time.perf_counter()
+        for _, _, queued in batch:
+            self.queue_waits.append(start - queued)
+        try:
+            results = await loop.run_in_executor(
+                self.executor, score_texts, [text for text, _, _ in batch],
+                self.nlp)
+        except Exception as error:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        self.batch_times.append(time.perf_counter() - start)
+        self.batch_sizes.append(len(batch))
+        self.batches += 1
+        self.texts_scored += len(batch)
+        for (_, future, _), result in zip(batch, results):
+            # the request may have gone away (eg the client disconnected)
+            if not future.done():
+                future.set_result(result)
+
+    async def score(self, texts):
+        """
+        Queue texts for scoring and wait for their results.
+        Raises:
+            RequestTooLargeError: If there are more texts than max_queue,
+            so they could never all be queued.
+            QueueFullError: If there is not room in the queue for all of
+            the texts right now - none of them are queued.
+        Returns:
+            list: Result dictionaries in the same order as texts.
+        """
+        if self.queue is None:
+            raise RuntimeError('run_batcher has not been started.')
+        if len(texts) > self.max_queue:
+            self.rejected += 1
+            raise RequestTooLargeError(
+                f'{len(texts)} texts is more than the queue limit of '
+                f'{self.max_queue} - send them in smaller requests.')
+        if self.queue.qsize() + len(texts) > self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(
+                f'{self.queue.qsize()} texts are already waiting.')
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self.queue.put_nowait((text, future, start))
+            futures.append(future)
+        self.requests += 1
+        results = await asyncio.gather(*futures)
+        self.request_latencies.append(time.perf_counter() - start)
+        return results
+
+    def metrics(self):
+        '''returns the service metrics as a dictionary'''
+        return {
+            'uptime_seconds': time.time() - self.started,
+            'queue_depth': self.queue.qsize() if self.queue else 0,
+            'max_queue': self.max_queue,
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000,
+            'requests': self.requests,
+            'rejected_requests': self.rejected,
+            'failed_requests': self.errors,
+            'texts_scored': self.texts_scored,
+            'batches': self.batches,
+            'mean_batch_size': (float(np.mean(self.batch_sizes))
+                                if self.batch_sizes else None),
+            'request_latency_ms': percentiles_ms(self.request_latencies),
+            'queue_wait_ms': percentiles_ms(self.queue_waits),
+            'batch_time_ms': percentiles_ms(self.batch_times),
+        }
+
+    # HTTP handling
+    async def route(self, method, path, body):
+        '''returns the (status, response dictionary) for a request'''
+        if path == '/score':
+            if method != 'POST':
+                return HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'Use POST.'}
+            try:
+                request = json.loads(body)
+                if not isinstance(request, dict):
+                    raise TypeError
+                single = 'text' in request
+                texts = [request['text']] if single else request['texts']
+                if (not isinstance(texts, list) or not texts
+                        or not all(isinstance(text, str) for text in texts)):
+                    raise TypeError
+            except (ValueError, KeyError, TypeError):
+                return HTTPStatus.BAD_REQUEST, {
+                    'error': 'Send {"text": "..."} or a non-empty list of '
+                             'strings as {"texts": ["...", ...]} as JSON.'}
+            try:
+                results = await self.score(texts)
+            except RequestTooLargeError as error:
+                # retrying would never help, so no Retry-After
+                return (HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                        {'error': str(error)})
+            except QueueFullError as error:
+                return HTTPStatus.SERVICE_UNAVAILABLE, {'error': str(error)}
+            except Exception as error:
+                self.errors += 1
+                return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(error)}
+            return HTTPStatus.OK, results[0] if single else {
+                'results': results}
+        if path == '/metrics' and method == 'GET':
+            return HTTPStatus.OK, self.metrics()
+        if path == '/health' and method == 'GET':
+            return HTTPStatus.OK, {'status': 'ok'}
+        return HTTPStatus.NOT_FOUND, {'error': f'No route for {method} '
+                                               f'{path}.'}
+
+    async def handle_connection(self, reader, writer):
+        '''serves HTTP/1.1 requests on one connection (with keep-alive)'''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, path, version = (
+                        request_line.decode('latin-1').split())
+                except ValueError:
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST,
+                                        {'error': 'Bad request line.'},
+                                        False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (version == 'HTTP/1.1' and headers.get(
+                    'connection', '').lower() != 'close')
+
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY_BYTES:
+                    await self._respond(
+                        writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                        {'error': f'Body is over {MAX_BODY_BYTES} bytes.'},
+                        False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, response = await self.route(
+                    method, path.split('?')[0], body)
+                await self._respond(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # the service is stopping - drop the connection quietly
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, response, keep_alive):
+        '''writes a JSON response'''
+        body = json.dumps(response).encode('utf-8')
+        headers = [f'HTTP/1.1 {status.value} {status.phrase}',
+                   'Content-Type: application/json',
+                   f'Content-Length: {len(body)}',
+                   f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            headers.append('Retry-After: 1')
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1')
+                     + body)
+        await writer.drain()
+
+
+# Run the service
+async def serve(service, host=HOST, port=PORT, unix_path=None):
+    '''runs the service on a TCP port, or a Unix socket if unix_path is
+       given, until cancelled'''
+    batcher = asyncio.create_task(service.run_batcher())
+    if unix_path:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+        server = await asyncio.start_unix_server(service.handle_connection,
+                                                 unix_path)
+        address = unix_path
+    else:
+        server = await asyncio.start_server(service.handle_connection,
+                                            host, port)
+        address = f'http://{host}:{port}'
+    print(f'Scoring reviews on {address} (max batch {service.max_batch}, '
+          f'max wait {service.max_wait * 1000:g}ms, max queue '
+          f'{service.max_queue}) - Ctrl+C to stop')
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batcher.cancel()
+        service.executor.shutdown(wait=False)
+        if unix_path and os.path.exists(unix_path):
+            os.remove(unix_path)
+
+def main():
+    '''loads the model and runs the service'''
+    parser = argparse.ArgumentParser(
+        description='Local micro-batching sentiment scoring service.')
+    parser.add_argument('--model', default=MODEL,
+                        help='spaCy model (default: %(default)s)')
+    parser.add_argument('--host', default=HOST,
+                        help='address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=PORT,
+                        help='TCP port (default: %(default)s)')
+    parser.add_argument('--unix', metavar='PATH',
+                        help='listen on a Unix socket instead of TCP')
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH,
+                        help='most texts per nlp.pipe batch '
+                             '(default: %(default)s)')
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_MS,
+                        help='longest wait for a batch to fill '
+                             '(default: %(default)s)')
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUE,
+                        help='most texts waiting before requests are '
+                             'refused (default: %(default)s)')
+    args = parser.parse_args()
+
+    service = SentimentService(sa.get_nlp(args.model, sentiment=True),
+                               args.max_batch, args.max_wait_ms,
+                               args.max_queue)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        print('Service stopped.')
+
+if __name__ == "__main__":
+    main()
@@ -11,10 +11,22 @@ at the moment the user entered percentage only goes through the sledgehammer met
 
 the example numbers that print out after are for fixed example only
 
+reported percentages are usually rounded though (88% could be 87.5%) -
+    python smallest_int_from_percentage.py --rounded 88 16.13
+finds the smallest population where all of them are possible (8 for 88%)
+
 '''
 
+import argparse
 import math
+import time
+from decimal import Decimal
 from fractions import Fraction
+from functools import lru_cache
+import numpy as np
+
+# number of distinct percentages remembered by the memoized version
+MEMO_SIZE = 100000
 
 def get_valid_percentage():
     while True:
@@ -80,23 +92,266 @@ def calculate_lcm(factors):
         lcm *= factor ** factors.count(factor)
     return lcm
 
-# Get required percentage
-user_percentage = get_valid_percentage()
+# memoized method - the smallest integer is just the denominator of the
+# reduced fraction (what the efficient method rebuilds from its factors)
+@lru_cache(maxsize=MEMO_SIZE)
+def get_smallest_integer_for_percentage_cached(percentage):
+    """ Smallest integer for a percentage, remembering repeated inputs. """
+    return (Fraction(str(percentage)) / 100).denominator
+
+# batch method for whole arrays of percentages
+def get_smallest_integers_for_percentages(percentages, decimals=None):
+    """
+    Smallest integer for each of an array of percentages.
+
+    If the number of decimal places is known (eg 4 for percentages to
+    4dps) the fractions are reduced with a vectorised gcd, otherwise each
+    distinct percentage is worked out once with the memoized method.
+    Raises ValueError if a percentage has more decimal places than
+    decimals (rather than silently rounding it).
+    Returns a numpy array of integers.
+    """
+    percentages = np.asarray(percentages, dtype=float)
+    if decimals is not None:
+        # a float read from n decimal places rounds back to itself exactly
+        mismatched = percentages != np.round(percentages, decimals)
+        if mismatched.any():
+            raise ValueError(f"{percentages[mismatched].flat[0]} has more "
+                             f"than {decimals} decimal places.")
+        scale = 10 ** decimals
+        numerators = np.rint(percentages * scale).astype(np.int64)
+        denominator = np.int64(100 * scale)
+        return denominator // np.gcd(numerators, denominator)
+    unique, positions = np.unique(percentages, return_inverse=True)
+    smallest = np.array([get_smallest_integer_for_percentage_cached(value)
+                         for value in unique.tolist()], dtype=np.int64)
+    return smallest[positions.reshape(percentages.shape)]
+
+# benchmark of the methods
+def benchmark_methods(precisions=(0, 1, 2, 3, 4), samples=10000,
+                      slow_samples=5, seed=0):
+    """
+    Time each method on random percentages with each number of decimal
+    places and check they all give the same answers (the slow method only
+    does the first slow_samples percentages as it can loop a million
+    times for each one).
+    Returns a list of dictionaries - one per precision.
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    for decimals in precisions:
+        percentages = np.round(rng.uniform(0, 100, samples), decimals)
+        values = percentages.tolist()
+        timings = {}
+
+        start = time.perf_counter()
+        slow = [get_smallest_integer_for_percentage(value)
+                for value in values[:slow_samples]]
+        timings['sledgehammer'] = ((time.perf_counter() - start)
+                                   / len(slow))
+
+        start = time.perf_counter()
+        efficient = [get_smallest_integer_for_percentage_efficient(value)
+                     for value in values]
+        timings['efficient'] = (time.perf_counter() - start) / samples
+
+        get_smallest_integer_for_percentage_cached.cache_clear()
+        start = time.perf_counter()
+        batch = get_smallest_integers_for_percentages(percentages)
+        timings['batch'] = (time.perf_counter() - start) / samples
+
+        start = time.perf_counter()
+        batch_decimals = get_smallest_integers_for_percentages(percentages,
+                                                               decimals)
+        timings['batch_decimals'] = (time.perf_counter() - start) / samples
+
+        agree = (slow == efficient[:slow_samples]
+                 and efficient == batch.tolist()
+                 and efficient == batch_decimals.tolist())
+        results.append({'decimals': decimals, 'agree': agree,
+                        'largest': max(efficient),
+                        'microseconds': {name: seconds * 1e6 for name, seconds
+                                         in timings.items()}})
+    return results
+
+def print_benchmark(results):
+    """ Print the benchmark results as a table. """
+    names = list(results[0]['microseconds'])
+    print('microseconds per percentage:')
+    print(f"{'dps':>3} {'largest':>8} " + ' '.join(f'{name:>14}'
+                                                  for name in names)
+          + '  agree')
+    for result in results:
+        print(f"{result['decimals']:>3} {result['largest']:>8} "
+              + ' '.join(f"{result['microseconds'][name]:>14.2f}"
+                         for name in names)
+              + f"  {result['agree']}")
+
+
+# rounding-aware method - reported percentages are rounded, so each one
+# only says the true percentage is within half a unit of its last decimal
+def percentage_interval(percentage, decimals=None):
+    """
+    The range of proportions (as Fractions of 1) that round to the
+    reported percentage - decimals is the number of decimal places it was
+    rounded to (worked out from how it is written if not given). Both
+    ends are included so halves can have been rounded either way.
+    """
+    text = str(percentage).strip().rstrip('%')
+    value = Fraction(text)
+    if decimals is None:
+        decimals = max(0, -Decimal(text).as_tuple().exponent)
+    half_unit = Fraction(1, 2 * 10 ** decimals)
+    low = max(value - half_unit, Fraction(0)) / 100
+    high = min(value + half_unit, Fraction(100)) / 100
+    if low > high:
+        raise ValueError(f"{percentage}% is not between 0 and 100")
+    return low, high
+
+def smallest_denominator_from(low, high, start=1):
+    """
+    Smallest integer q >= start for which some whole number lies in
+    [low * q, high * q] (low <= high are Fractions).
+
+    Continued fraction / Stern-Brocot search: if start does not work, the
+    whole number has to be more than high * start, and turning the
+    fractions over (q/p between 1/high and 1/low) gives the same problem
+    for the numerator with a smaller start - so it takes a few steps per
+    term of the continued fractions of low and high rather than a scan.
+    """
+    return _smallest_denominator_from(low.numerator, low.denominator,
+                                      high.numerator, high.denominator,
+                                      start)
+
+def _smallest_denominator_from(low_num, low_den, high_num, high_den, start):
+    """ smallest_denominator_from on whole numbers (much faster). """
+    # ceil(low * start) <= floor(high * start)
+    if -(-low_num * start // low_den) <= high_num * start // high_den:
+        return start
+    # moving both ends by a whole number does not change the answer
+    whole = low_num // low_den
+    low_num -= whole * low_den
+    high_num -= whole * high_den
+    # here 0 < low and high < 1, otherwise start would have worked
+    numerator = _smallest_denominator_from(
+        high_den, high_num, low_den, low_num,
+        high_num * start // high_den + 1)
+    # ceil(numerator / high)
+    return -(-numerator * high_den // high_num)
+
+def smallest_population_for_rounded(percentages, decimals=None):
+    """
+    Smallest population N for which every reported (rounded) percentage
+    is possible, eg 88 (to 0dps) needs only 8 as 7 of 8 is 87.5%.
+
+    percentages - the reported percentages (numbers or strings, eg
+        "16.13" - strings keep their trailing zeros)
+    decimals - decimal places each was rounded to: one number for all of
+        them, a list, or None to work it out from how each is written
+
+    Starting from 1, the population is moved up to the smallest value
+    that works for each percentage in turn (never past the answer, as the
+    answer works for every percentage) until it works for all of them in
+    a row. One or two percentages take a few steps at any precision; many
+    percentages with a large answer take a step for each population that
+    works for the narrowest range on the way.
+    Returns (N, counts) - counts is the smallest count giving each
+    percentage out of N.
+    """
+    if isinstance(percentages, (str, int, float)):
+        percentages = [percentages]
+    if decimals is None or isinstance(decimals, int):
+        decimals = [decimals] * len(percentages)
+    intervals = [percentage_interval(percentage, places)
+                 for percentage, places in zip(percentages, decimals)]
+    # the narrowest ranges rule out the most populations so go first
+    bounds = sorted(((low.numerator, low.denominator, high.numerator,
+                      high.denominator) for low, high in intervals),
+                    key=lambda bound: Fraction(bound[2], bound[3])
+                    - Fraction(bound[0], bound[1]))
+    population = 1
+    # number of percentages in a row that the population has worked for
+    settled = 0
+    while settled < len(bounds):
+        for bound in bounds:
+            moved = _smallest_denominator_from(*bound, population)
+            settled = settled + 1 if moved == population else 1
+            population = moved
+            if settled == len(bounds):
+                break
+    counts = [math.ceil(low * population) for low, _ in intervals]
+    return population, counts
+
+def check_rounded_solver(samples=500, seed=0):
+    """
+    Compare smallest_population_for_rounded with a plain scan of every
+    population on random sets of percentages.
+    Returns the number of differences (should be 0).
+    """
+    rng = np.random.default_rng(seed)
+    differences = 0
+    for _ in range(samples):
+        places = int(rng.integers(0, 3))
+        reported = [f'{value:.{places}f}' for value in
+                    rng.uniform(0, 100, int(rng.integers(1, 4)))]
+        intervals = [percentage_interval(value) for value in reported]
+        population = 1
+        while not all(math.ceil(low * population)
+                      <= math.floor(high * population)
+                      for low, high in intervals):
+            population += 1
+        if smallest_population_for_rounded(reported)[0] != population:
+            differences += 1
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Smallest integer population for a percentage.')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='compare the speed of the methods instead')
+    parser.add_argument('--samples', type=int, default=10000,
+                        help='percentages per precision for the benchmark')
+    parser.add_argument('--rounded', nargs='+', metavar='PERCENTAGE',
+                        help='smallest population for these reported '
+                             '(rounded) percentages instead')
+    parser.add_argument('--decimals', type=int, default=None,
+                        help='decimal places the --rounded percentages '
+                             'were rounded to (default: as written)')
+    args = parser.parse_args()
+    if args.benchmark:
+        print_benchmark(benchmark_methods(samples=args.samples))
+        return
+    if args.rounded:
+        population, counts = smallest_population_for_rounded(
+            args.rounded, args.decimals)
+        print(f"The smallest population for {', '.join(args.rounded)}% "
+              f"is {population}:")
+        for percentage, count in zip(args.rounded, counts):
+            print(f"    {percentage}% - {count} of {population} is "
+                  f"{count / population * 100:.6g}%")
+        return
+
+    # Get required percentage
+    user_percentage = get_valid_percentage()
+
+    # Find the smallest integer for the given percentage
+    smallest_pop = get_smallest_integer_for_percentage(user_percentage)
 
-# Find the smallest integer for the given percentage
-smallest_pop = get_smallest_integer_for_percentage(user_percentage)
+    # Display the result
+    print(f"The smallest integer for which {user_percentage}% "
+          f"results in an integer is {smallest_pop}.")
+    print(f"{user_percentage}% of {smallest_pop} is "
+          f"{(smallest_pop*user_percentage/100)}")
 
-# Display the result
-print(f"The smallest integer for which {user_percentage}% "
-      f"results in an integer is {smallest_pop}.")
-print(f"{user_percentage}% of {smallest_pop} is "
-      f"{(smallest_pop*user_percentage/100)}")
+    # example using fast
+    # Test the function with a high precision percentage
+    example_percentage = 16.1258
+    smallest_integer = get_smallest_integer_for_percentage_efficient(example_percentage)
+    rounded_result = round(smallest_integer * example_percentage / 100)
 
-# example using fast
-# Test the function with a high precision percentage
-example_percentage = 16.1258
-smallest_integer = get_smallest_integer_for_percentage_efficient(example_percentage)
-rounded_result = round(smallest_integer * example_percentage / 100)
+    print(f"Example of fast method {example_percentage}% of "
+          f"{smallest_integer} gives {rounded_result} population")
 
-print(f"Example of fast method {example_percentage}% of "
-      f"{smallest_integer} gives {rounded_result} population")
+if __name__ == "__main__":
+    main()